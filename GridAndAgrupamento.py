@@ -1,12 +1,16 @@
 import s3fs
-import numpy as np
 import os
-import shutil
-from datetime import datetime, timedelta
-from netCDF4 import Dataset
-import xarray as xr
 import sys
 import argparse
+from datetime import timedelta
+from glm_filter import probe_coordinates, filter_buffer, crop_buffer
+from glm_aggregator import WindowAggregator
+from glm_manifest import Manifest, manifest_path, NegativeCache, negative_cache_path, job_identity
+from glm_regions import bbox_region
+from glm_listing import ListingCache, listing_cache_path, listing_hours
+from glm_time import window_start, parse_moment, overlaps
+from glm_pipeline import safe_cat
+from glm_metrics import metrics, update_pass_ratio, MetricsExporter
 
 # Definir limites de coordenadas de interesse (Rio de Janeiro)
 lon_min, lon_max = -45.05290312102409, -42.35676996062447
@@ -14,7 +18,6 @@ lat_min, lat_max = -23.801876626302175, -21.699774257353113
 
 # Diretórios de saída
 output_directory = "data/goes16/glm_files/"
-temp_directory = "data/goes16/temp_glm_files/"
 final_directory = "data/goes16/aggregated_glm_files/"
 
 def create_directory(directory):
@@ -22,119 +25,152 @@ def create_directory(directory):
     os.makedirs(directory, exist_ok=True)
     print(f"Diretório {directory} criado (ou já existia).")
 
-def clear_directory(directory):
-    """Limpa o diretório e cria novamente."""
-    if os.path.exists(directory):
-        shutil.rmtree(directory)
-        print(f"Diretório {directory} limpo.")
-    create_directory(directory)
-
-def download_files(start_date, end_date):
-    """Baixa e processa os arquivos GLM para um intervalo de datas especificado."""
-    current_date = start_date
+def download_files(start, end, probe=False, crop=False, manifest_file=manifest_path,
+                   window_minutes=10, negative_cache_file=negative_cache_path, listing_cache_file=listing_cache_path,
+                   quiet=False, metrics_path=None, metrics_format='jsonl', metrics_interval=10.0):
+    """Baixa e processa os arquivos GLM do intervalo [start, end).
+
+    Só as horas e os granulos que intersectam o intervalo são listados e baixados (a hora anterior ao
+    início também é listada, para o granulo que atravessa o início). Cada granulo é
+    filtrado em memória e os que têm eventos no bbox são anexados ao agregado da sua janela de tempo
+    (window_minutes, segundo o início gravado no nome do arquivo). O intervalo é estendido até janelas
+    inteiras e cada agregado é regravado com todos os granulos da janela; janelas cujos granulos já estão
+    todos no agregado (segundo o manifesto) são puladas, e granulos sabidamente vazios no bbox (segundo o
+    cache negativo) não são baixados de novo.
+    Tempos do download, do filtro e da agregação, bytes e granulos aprovados/rejeitados vão para o registro
+    glm_metrics.metrics, exportado em metrics_path; com quiet, as mensagens por arquivo não são impressas.
+    """
+    log = (lambda message: None) if quiet else print
     fs = s3fs.S3FileSystem(anon=True)
+    bbox = (lon_min, lon_max, lat_min, lat_max)
+    manifest = Manifest(manifest_file, job_identity('aggregate', [bbox_region(bbox)], crop,
+                                                    output=final_directory, window_minutes=window_minutes))
+    negative_cache = NegativeCache(negative_cache_file)
+    listing_cache = ListingCache(fs, listing_cache_file)
+    aggregator = WindowAggregator(final_directory)
 
-    clear_directory(temp_directory)
     create_directory(final_directory)
-
-    temp_files = []
-    while current_date <= end_date:
-        year = current_date.year
-        day_of_year = current_date.timetuple().tm_yday 
-        bucket_path = f'noaa-goes16/GLM-L2-LCFA/{year}/{day_of_year:03d}/'
-
-        print(f"Buscando arquivos para {current_date.strftime('%Y-%m-%d')} (dia {day_of_year})")
-
-        for hour in range(24):
-            hour_path = bucket_path + f"{hour:02d}/"
-            hourly_files = []
-            try:
-                hourly_files = fs.ls(hour_path)
-            except FileNotFoundError:
-                print(f"Hora {hour:02d} não encontrada no bucket. Pulando...")
-
-            for file in hourly_files:
-                file_name = file.split('/')[-1]
-                local_file_path = os.path.join(temp_directory, file_name)
-                print(f"Baixando: {file} para {local_file_path}")
-                fs.get(file, local_file_path)
-                
-                if not filter_by_coordinates(local_file_path):
-                    open(local_file_path, 'w').close()  # Cria arquivo vazio se não há dados no Rio
-
-                temp_files.append(local_file_path)
-
-                if len(temp_files) == 30:
-                    aggregate_files(temp_files, current_date, hour)
-                    clear_directory(temp_directory)  # Limpar a pasta temporária para o próximo ciclo
-                    temp_files.clear()
-
-        current_date += timedelta(days=1)
-
-def filter_by_coordinates(file_path):
-    """Filtra os eventos GLM de um arquivo NetCDF com base nas coordenadas fornecidas."""
+    exporter = MetricsExporter(metrics_path, metrics_format, metrics_interval, update_pass_ratio).start() if metrics_path else None
+
+    # O agregado de uma janela é regravado por inteiro: o intervalo é estendido até janelas completas e,
+    # se algum granulo da janela ainda falta, todos os granulos dela são processados de novo
+    start = window_start(start, window_minutes)
+    end = window_start(end - timedelta(microseconds=1), window_minutes) + timedelta(minutes=window_minutes)
+
+    def process_window(window, entries):
+        """Processa todos os granulos da janela e grava o agregado, a menos que todos já estejam nele."""
+        if all(manifest.is_done(entry['name'], entry.get('size'), entry.get('ETag'), require_aggregate=True)
+               for entry in entries):
+            return
+        aggregator.start(window)
+        batch_keys = []
+        for entry in entries:
+            file = entry['name']
+            size, etag = entry.get('size'), entry.get('ETag')
+            file_name = file.split('/')[-1]
+
+            content = None
+            if negative_cache.is_known_empty(file_name, bbox):
+                metrics.increment('granules_total', result='rejected', reason='negative_cache')
+                log(f"Granulo {file_name} sabidamente sem eventos no filtro. Pulando download.")
+            # No modo sonda, lê só flash_lat/flash_lon por faixa de bytes antes de baixar
+            elif probe and not probe_coordinates(fs, file, bbox):
+                metrics.increment('granules_total', result='rejected', reason='probe')
+                log(f"Nenhum evento dentro do filtro encontrado em {file}. Pulando download.")
+                negative_cache.add(file_name, bbox)
+            else:
+                log(f"Baixando: {file}")
+                try:
+                    with metrics.timer('stage_seconds', stage='download'):
+                        buffer = safe_cat(fs, file)
+                except Exception as e:
+                    # Fica fora do manifesto: a janela é refeita na próxima execução
+                    metrics.increment('stage_errors_total', stage='download')
+                    print(f"Erro ao baixar o arquivo {file}: {e}")
+                    continue
+                try:
+                    with metrics.timer('stage_seconds', stage='filtro'):
+                        if crop:
+                            content = crop_buffer(buffer, bbox, file_name)
+                        else:
+                            content = buffer if filter_buffer(buffer, bbox, file_name) else None
+                except Exception as e:
+                    metrics.increment('stage_errors_total', stage='filtro')
+                    print(f"Erro ao filtrar o arquivo {file}: {e}")
+                    continue
+                if content is None:
+                    metrics.increment('granules_total', result='rejected', reason='filter')
+                    log(f"Nenhum evento dentro do filtro encontrado em {file}.")
+                    negative_cache.add(file_name, bbox)
+
+            if content is not None:
+                metrics.increment('granules_total', result='passed')
+                with metrics.timer('stage_seconds', stage='agregacao'):
+                    aggregator.add_buffer(content, file_name)
+            manifest.record(file, size, etag, passed=content is not None)
+            batch_keys.append(file)
+
+        output_file_path = aggregator.flush()
+        manifest.set_aggregate(batch_keys, output_file_path or '')
+
+    # Um erro inesperado interrompe o backfill, mas os bancos são fechados e as métricas exportadas
     try:
-        dataset = Dataset(file_path, 'r')
-        longitudes = dataset.variables['flash_lon'][:]
-        latitudes = dataset.variables['flash_lat'][:]
-        dataset.close()
-
-        mask = (
-            (longitudes >= lon_min) & (longitudes <= lon_max) &
-            (latitudes >= lat_min) & (latitudes <= lat_max)
-        )
-
-        if np.sum(mask) == 0:
-            print(f"Nenhum evento dentro do filtro encontrado em {file_path}. Removendo arquivo.")
-            return False
-        else:
-            print(f"Eventos dentro do filtro encontrados no arquivo {file_path}.")
-            return True
-    except Exception as e:
-        print(f"Erro ao filtrar o arquivo {file_path}: {e}")
-        return False
-
-def aggregate_files(files, current_date, hour):
-    """Agrupa 30 arquivos válidos e salva como um único arquivo NetCDF."""
-    datasets = []
-    
-    for file in files:
-        if os.path.getsize(file) > 0:  # Ignorar arquivos vazios
-            ds = xr.open_dataset(file)
-            datasets.append(ds)
-
-    if datasets:
-        try:
-            # Remover 'number_of_events' e 'number_of_groups' no momento da concatenação
-            combined = xr.concat(
-                [ds.drop_dims(['number_of_events', 'number_of_groups', 'number_of_flashes'], errors="ignore") for ds in datasets],
-                dim='time',
-                data_vars='minimal',
-                coords='minimal',
-                compat='override'
-            )
-            output_file_name = f"glm_agg_{current_date.strftime('%Y%m%d')}_{hour:02d}.nc"
-            output_file_path = os.path.join(final_directory, output_file_name)
-            combined.to_netcdf(output_file_path)
-            print(f"Agrupamento salvo em {output_file_path}")
-        except ValueError as e:
-            print(f"Erro ao concatenar arquivos: {e}")
-    else:
-        print("Nenhum dado para agrupar nesta rodada.")
-
+        window, window_entries = None, []
+        for hour_start in listing_hours(start, end):
+            if hour_start.hour == 0 or hour_start <= start:
+                print(f"Buscando arquivos para {hour_start.strftime('%Y-%m-%d')} (dia {hour_start.timetuple().tm_yday})")
+
+            # Horas fechadas vêm do índice local; só horas recentes são listadas no bucket
+            hourly_files = listing_cache.list_hour(hour_start)
+
+            for entry in hourly_files:
+                if not overlaps(entry['start'], entry['end'], start, end):
+                    continue
+                # O granulo que atravessa o início pertence à janela anterior, que não é regravada
+                granule_window = window_start(entry['start'], window_minutes)
+                if granule_window < start:
+                    continue
+
+                # Fecha a janela anterior quando o granulo já pertence à próxima
+                if window is not None and granule_window != window:
+                    process_window(window, window_entries)
+                    window_entries = []
+                window = granule_window
+                window_entries.append(entry)
+
+        if window_entries:
+            process_window(window, window_entries)
+    finally:
+        if exporter is not None:
+            exporter.stop()
+        manifest.close()
+        negative_cache.close()
+        listing_cache.close()
 
 def main(argv):
     parser = argparse.ArgumentParser(description='Download e filtro de arquivos GLM por coordenadas.')
-    parser.add_argument('-b', '--start_date', required=True, help='Data de início no formato YYYY-MM-DD')
-    parser.add_argument('-e', '--end_date', required=True, help='Data de término no formato YYYY-MM-DD')
+    parser.add_argument('-b', '--start', '--start_date', dest='start', required=True, help='Início no formato YYYY-MM-DD ou YYYY-MM-DDTHH:MM[:SS] (UTC)')
+    parser.add_argument('-e', '--end', '--end_date', dest='end', required=True, help='Término no formato YYYY-MM-DD (dia inteiro, inclusive) ou YYYY-MM-DDTHH:MM[:SS] (exclusivo)')
+    parser.add_argument('-p', '--probe', action='store_true', help='Lê apenas flash_lat/flash_lon remotamente antes de baixar o granulo')
+    parser.add_argument('-c', '--crop', action='store_true', help='Agrega apenas os flashes, grupos e eventos dentro do bbox')
+    parser.add_argument('--manifest', default=manifest_path, help='Arquivo SQLite com o registro dos granulos já processados')
+    parser.add_argument('-w', '--window', type=int, default=10, help='Tamanho da janela de agrupamento em minutos')
+    parser.add_argument('--negative_cache', default=negative_cache_path, help='Arquivo SQLite com os granulos sabidamente sem eventos no bbox')
+    parser.add_argument('--listing_cache', default=listing_cache_path, help='Arquivo SQLite com o índice das listagens do bucket')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Não imprime uma mensagem por arquivo')
+    parser.add_argument('--metrics', help='Arquivo para exportar as métricas (tempos, bytes, novas tentativas, granulos aprovados/rejeitados)')
+    parser.add_argument('--metrics_format', choices=['jsonl', 'prometheus'], default='jsonl', help='Formato das métricas: JSON lines ou textfile do Prometheus')
+    parser.add_argument('--metrics_interval', type=float, default=10.0, help='Intervalo em segundos entre as exportações das métricas')
     args = parser.parse_args(argv[1:])
 
-    start_date = datetime.strptime(args.start_date, '%Y-%m-%d')
-    end_date = datetime.strptime(args.end_date, '%Y-%m-%d')
+    start = parse_moment(args.start)
+    end = parse_moment(args.end, end=True)
 
-    assert start_date <= end_date, "A data de início deve ser anterior ou igual à data de término."
+    assert start < end, "O início deve ser anterior ao término."
 
-    download_files(start_date, end_date)
+    download_files(start, end, probe=args.probe, crop=args.crop,
+                   manifest_file=args.manifest, window_minutes=args.window, negative_cache_file=args.negative_cache, listing_cache_file=args.listing_cache,
+                   quiet=args.quiet, metrics_path=args.metrics, metrics_format=args.metrics_format, metrics_interval=args.metrics_interval)
 
 if __name__ == "__main__":
     main(sys.argv)
@@ -1,4 +1,7 @@
 import xarray as xr
+from datetime import datetime
+from glm_cache import FlashCache
+from glm_dataset import open_flashes, summarize, print_summary
 
 # Abra o arquivo NetCDF
 file_path = 'data/goes16/glm_files/2023-01-13/OR_GLM-L2-LCFA_G16_s20230130000000_e20230130000200_c20230130000214.nc'
@@ -17,3 +20,22 @@ print(list(dataset.dims))
 
 # Fechar o dataset
 dataset.close()
+
+# Flashes já decodificados, lidos do cache (preenchido na ingestão) em vez de decodificar o HDF5 de novo
+cache = FlashCache()
+flashes = cache.load(file_path)
+cache.close()
+
+print(f"\nFlashes no arquivo: {len(flashes['flash_time'])}")
+if len(flashes['flash_time']):
+    print(f"Primeiro flash: {flashes['flash_time'].min()}, último: {flashes['flash_time'].max()}")
+    print(f"Energia total: {float(flashes['flash_energy'].sum()):.3e} J")
+
+# Vários arquivos de uma vez: o dia inteiro dos granulos filtrados como um único dataset preguiçoso.
+# Só os arquivos do intervalo são abertos, e os resumos são calculados bloco a bloco em paralelo.
+start, end = datetime(2023, 1, 13), datetime(2023, 1, 14)
+flashes_day = open_flashes(start, end, source='granules')
+print(f"\nFlashes de {start.date()} ({flashes_day.attrs['files']} arquivos):")
+print(flashes_day)
+print_summary(summarize(flashes_day, start, end))
+flashes_day.close()
@@ -1,38 +1,249 @@
+import matplotlib
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 import cartopy.crs as ccrs
 import os
+import sys
+import queue
+import shutil
+import argparse
+import tempfile
+import threading
+import time
+import subprocess
+import concurrent.futures
+from datetime import timedelta
 import numpy as np
-from netCDF4 import Dataset
+from PIL import Image
+from glm_time import window_start, parse_moment
+from glm_index import FlashIndex, input_directory, index_directory
 
-input_directory = "data/goes16/glm_files/2024-01-13"
-date = input_directory.split("/")[-1]
 area = [-45.05290312102409, -42.35676996062447, -23.801876626302175, -21.699774257353113] #Area de interesse
 
-# Configuração do plot e mapa
-fig, ax = plt.subplots(subplot_kw={'projection': ccrs.PlateCarree()})
-ax.set_extent( area ) 
-ax.coastlines(resolution='50m')
+# Marcador de fim da fila de quadros
+_FIM = object()
 
-files = [os.path.join(input_directory, f) for f in os.listdir(input_directory) if f.endswith('.nc')]
 
-def update_frame(i):
-    ax.clear()
-    ax.set_extent( area )  
+def frame_windows(start, end, window_minutes):
+    """Inícios das janelas de tempo (alinhadas ao relógio) que formam os quadros de [start, end)."""
+    moment = window_start(start, window_minutes)
+    windows = []
+    while moment < end:
+        windows.append(moment)
+        moment += timedelta(minutes=window_minutes)
+    return windows
+
+
+def load_frames(index, windows, window_minutes, chunk_frames=36, region=None):
+    """Gera (início da janela, lons, lats) em ordem de tempo, consultando o índice um bloco de janelas por vez.
+
+    Com region, só os granulos de root/<region>/ são lidos, para regiões sobrepostas não repetirem pontos.
+    """
+    step = timedelta(minutes=window_minutes)
+    for first in range(0, len(windows), chunk_frames):
+        chunk = windows[first:first + chunk_frames]
+        flashes = index.query(tuple(area), chunk[0], chunk[-1] + step, columns=('flash_time', 'flash_lon', 'flash_lat'),
+                              region=region)
+        if len(flashes['flash_time']) == 0:
+            for moment in chunk:
+                yield moment, np.empty(0), np.empty(0)
+            continue
+        # O resultado vem ordenado por tempo: cada quadro é uma fatia contígua
+        edges = np.searchsorted(flashes['flash_time'], np.array([np.datetime64(moment, 'us') for moment in chunk + [chunk[-1] + step]]))
+        for moment, lo, hi in zip(chunk, edges[:-1], edges[1:]):
+            yield moment, flashes['flash_lon'][lo:hi], flashes['flash_lat'][lo:hi]
+
+
+def preload_frames(index_path, windows, window_minutes, queue_size=256, region=None):
+    """Carrega os quadros numa thread em segundo plano enquanto os anteriores são desenhados.
+
+    Um erro na thread de carga é passado pela fila e relançado aqui, para a animação não terminar
+    truncada como se tivesse dado certo.
+    """
+    frames = queue.Queue(maxsize=queue_size)
+
+    def producer():
+        try:
+            index = FlashIndex(index_path)
+            try:
+                for frame in load_frames(index, windows, window_minutes, region=region):
+                    frames.put(frame)
+            finally:
+                index.close()
+        except Exception as e:
+            frames.put(e)
+        finally:
+            frames.put(_FIM)
+
+    threading.Thread(target=producer, name='quadros', daemon=True).start()
+    while True:
+        frame = frames.get()
+        if frame is _FIM:
+            return
+        if isinstance(frame, Exception):
+            raise frame
+        yield frame
+
+
+def create_figure():
+    """Cria a figura com o mapa de fundo (desenhado uma única vez) e os artistas que mudam a cada quadro."""
+    fig, ax = plt.subplots(subplot_kw={'projection': ccrs.PlateCarree()})
+    ax.set_extent(area)
     ax.coastlines(resolution='50m')
-    
-    file_path = files[i]
-    with Dataset(file_path, 'r') as dataset:
-        lons = dataset.variables['flash_lon'][:]
-        lats = dataset.variables['flash_lat'][:]
+    scatter = ax.scatter(np.empty(0), np.empty(0), color='red', s=10, transform=ccrs.PlateCarree(), animated=True)
+    title = ax.set_title("Eventos GLM", animated=True)
+    return fig, ax, scatter, title
+
+
+def update_artists(scatter, title, moment, lons, lats):
+    """Atualiza os artistas do quadro sem redesenhar o mapa."""
+    scatter.set_offsets(np.column_stack((lons, lats)) if len(lons) else np.empty((0, 2)))
+    title.set_text(f"Eventos GLM - {moment.strftime('%Y-%m-%d %H:%M')} UTC ({len(lons)} flashes)")
+    return scatter, title
+
+
+def blit_frames(fig, ax, scatter, title, frames):
+    """Desenha os quadros sobre o mapa rasterizado uma única vez. Gera os pixels RGBA de cada quadro.
+
+    Cada quadro restaura o fundo guardado e desenha só o scatter e o título. O array gerado é uma visão
+    do buffer da figura: precisa ser consumido (gravado ou copiado) antes de pedir o próximo quadro.
+    """
+    fig.canvas.draw()
+    background = fig.canvas.copy_from_bbox(fig.bbox)
+    for moment, lons, lats in frames:
+        update_artists(scatter, title, moment, lons, lats)
+        fig.canvas.restore_region(background)
+        ax.draw_artist(scatter)
+        ax.draw_artist(title)
+        yield np.asarray(fig.canvas.buffer_rgba())
+
+
+def write_video(frames, output, fps):
+    """Grava quadros RGBA num GIF (Pillow) ou MP4 (ffmpeg lendo vídeo cru pela entrada padrão)."""
+    if output.endswith('.gif'):
+        images = [Image.fromarray(pixels).convert('RGB').convert('P', palette=Image.ADAPTIVE) for pixels in frames]
+        if images:
+            images[0].save(output, save_all=True, append_images=images[1:], duration=int(1000 / fps), loop=0)
+        return
+    ffmpeg = None
+    try:
+        for pixels in frames:
+            if ffmpeg is None:
+                height, width = pixels.shape[:2]
+                ffmpeg = subprocess.Popen(
+                    ['ffmpeg', '-y', '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', f"{width}x{height}", '-r', str(fps),
+                     '-i', '-', '-pix_fmt', 'yuv420p', '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', output],
+                    stdin=subprocess.PIPE
+                )
+            ffmpeg.stdin.write(pixels.tobytes())
+    finally:
+        if ffmpeg is not None:
+            ffmpeg.stdin.close()
+            if ffmpeg.wait() != 0:
+                raise subprocess.CalledProcessError(ffmpeg.returncode, 'ffmpeg')
+
+
+def animate(windows, window_minutes, output, fps=10, index_path=index_directory, show=False, region=None):
+    """Anima os quadros em sequência com blitting (blit_frames), gravando os pixels direto no GIF/MP4.
+
+    Não usa FuncAnimation.save, que desliga o blitting e redesenha o mapa inteiro em cada quadro. Com
+    show, a animação é mostrada depois na tela, onde o FuncAnimation faz o blitting de verdade.
+    """
+    if not show:
+        matplotlib.use('Agg')
+    fig, ax, scatter, title = create_figure()
+    frames = preload_frames(index_path, windows, window_minutes, region=region)
+    write_video(blit_frames(fig, ax, scatter, title, frames), output, fps)
+    print(f"Animação salva em {output}")
+    if show:
+        scatter.set_animated(True)
+        title.set_animated(True)
+        ani = FuncAnimation(fig, lambda frame: update_artists(scatter, title, *frame),
+                            frames=preload_frames(index_path, windows, window_minutes, region=region),
+                            save_count=len(windows), blit=True, repeat=False, cache_frame_data=False)
+        plt.show()
+
+
+def render_chunk(first_frame, windows, window_minutes, frames_directory, index_path=index_directory, timings=None, region=None):
+    """Desenha um bloco de quadros em PNGs numerados. Roda dentro dos processos do pool.
+
+    O mapa é rasterizado uma vez; cada quadro restaura esse fundo e desenha só o scatter e o título (blit_frames).
+    Com uma lista em timings, acrescenta nela o tempo de cada quadro (leitura, desenho e gravação).
+    """
+    matplotlib.use('Agg')
+    fig, ax, scatter, title = create_figure()
+    index = FlashIndex(index_path)
+    frame_started = time.perf_counter()
+    frames = load_frames(index, windows, window_minutes, region=region)
+    for offset, pixels in enumerate(blit_frames(fig, ax, scatter, title, frames)):
+        image = Image.fromarray(pixels).convert('RGB')
+        image.save(os.path.join(frames_directory, f"frame_{first_frame + offset:06d}.png"))
+        if timings is not None:
+            timings.append(time.perf_counter() - frame_started)
+            frame_started = time.perf_counter()
+    index.close()
+    plt.close(fig)
+    return len(windows)
+
+
+def assemble(frames_directory, output, fps):
+    """Junta os PNGs numerados num GIF (Pillow) ou MP4 (ffmpeg)."""
+    if output.endswith('.gif'):
+        paths = sorted(os.path.join(frames_directory, name) for name in os.listdir(frames_directory) if name.endswith('.png'))
+        images = [Image.open(path).convert('P', palette=Image.ADAPTIVE) for path in paths]
+        images[0].save(output, save_all=True, append_images=images[1:], duration=int(1000 / fps), loop=0)
+    else:
+        subprocess.run(['ffmpeg', '-y', '-framerate', str(fps), '-i', os.path.join(frames_directory, 'frame_%06d.png'),
+                        '-pix_fmt', 'yuv420p', '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', output], check=True)
+
+
+def animate_parallel(windows, window_minutes, output, fps=10, processes=None, chunk_frames=36, index_path=index_directory,
+                     region=None):
+    """Desenha blocos de quadros em paralelo num pool de processos e monta o GIF/MP4 no fim."""
+    frames_directory = tempfile.mkdtemp(prefix='glm_frames_')
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [
+                executor.submit(render_chunk, first, windows[first:first + chunk_frames], window_minutes, frames_directory, index_path,
+                                region=region)
+                for first in range(0, len(windows), chunk_frames)
+            ]
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+        assemble(frames_directory, output, fps)
+        print(f"Animação salva em {output}")
+    finally:
+        shutil.rmtree(frames_directory, ignore_errors=True)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Anima os flashes GLM da área de interesse em janelas de tempo.')
+    parser.add_argument('-b', '--start', default='2024-01-13', help='Início no formato YYYY-MM-DD ou YYYY-MM-DDTHH:MM[:SS] (UTC)')
+    parser.add_argument('-e', '--end', default='2024-01-13', help='Término no formato YYYY-MM-DD (dia inteiro, inclusive) ou YYYY-MM-DDTHH:MM[:SS] (exclusivo)')
+    parser.add_argument('-w', '--window', type=int, default=10, help='Duração de cada quadro em minutos')
+    parser.add_argument('-o', '--output', default='glm_animation.gif', help='Arquivo de saída (.gif ou .mp4)')
+    parser.add_argument('--fps', type=int, default=10, help='Quadros por segundo')
+    parser.add_argument('-j', '--processes', type=int, default=0, help='Processos para desenhar blocos de quadros em paralelo (0 desenha em sequência com blitting)')
+    parser.add_argument('--show', action='store_true', help='Mostra a animação na tela no modo sequencial')
+    parser.add_argument('-i', '--input', default=input_directory, help='Diretório com os granulos filtrados (subdiretórios AAAA-MM-DD)')
+    parser.add_argument('--index', default=index_directory, help='Diretório do índice espaço-temporal')
+    parser.add_argument('-r', '--region', help='Lê só os granulos gravados no subdiretório desta região')
+    args = parser.parse_args(argv[1:])
 
-        ax.scatter(lons, lats, color='red', s=10, transform=ccrs.PlateCarree(), label=f"Frame {i+1}")
-        ax.legend(loc='upper right')
+    start = parse_moment(args.start)
+    end = parse_moment(args.end, end=True)
+    assert start < end, "O início deve ser anterior ao término."
 
-    ax.set_title(f"Eventos GLM - " + date)
+    index = FlashIndex(args.index)
+    index.update(args.input)
+    index.close()
 
-ani = FuncAnimation(fig, update_frame, frames=len(files), repeat=True)
+    windows = frame_windows(start, end, args.window)
+    if args.processes > 0:
+        animate_parallel(windows, args.window, args.output, args.fps, args.processes, index_path=args.index, region=args.region)
+    else:
+        animate(windows, args.window, args.output, args.fps, index_path=args.index, show=args.show, region=args.region)
 
-ani.save("glm_animation.gif", writer='pillow', fps=10)
 
-plt.show()
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,204 @@
+import os
+import numpy as np
+from netCDF4 import Dataset, num2date
+from glm_filter import record_dimensions
+
+# Variáveis de identificação que precisam de deslocamento ao juntar granulos (variável → dimensão do id de origem)
+id_variables = {
+    'flash_id': 'number_of_flashes',
+    'group_id': 'number_of_groups',
+    'event_id': 'number_of_events',
+    'group_parent_flash_id': 'number_of_flashes',
+    'event_parent_group_id': 'number_of_groups',
+}
+
+# Atributos de empacotamento que deixam de valer quando gravamos os valores já decodificados
+packing_attributes = ('scale_factor', 'add_offset', '_FillValue', '_Unsigned', 'valid_range', 'missing_value')
+
+
+class GrowableArray:
+    """Buffer NumPy pré-alocado que dobra de capacidade quando enche."""
+
+    def __init__(self, dtype, capacity=4096):
+        self.data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+    def append(self, values):
+        values = np.asarray(values, dtype=self.data.dtype)
+        needed = self.size + values.size
+        if needed > self.data.size:
+            capacity = self.data.size
+            while capacity < needed:
+                capacity *= 2
+            grown = np.empty(capacity, dtype=self.data.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+        self.data[self.size:needed] = values
+        self.size = needed
+
+    def values(self):
+        return self.data[:self.size]
+
+    def clear(self):
+        self.size = 0
+
+
+class WindowAggregator:
+    """Agrega granulos de uma janela de tempo concatenando flashes, grupos e eventos.
+
+    Cada granulo é anexado a buffers por dimensão de registro, com os ids deslocados para continuarem
+    únicos na janela e os tempos convertidos para segundos desde o início da janela. Quando os buffers
+    passam de flush_records registros, eles são descarregados no arquivo da janela (dimensões ilimitadas),
+    então a memória não cresce com o número de granulos.
+    """
+
+    def __init__(self, output_directory, prefix='glm_agg', flush_records=1_000_000):
+        self.output_directory = output_directory
+        self.prefix = prefix
+        self.flush_records = flush_records
+        self.window = None
+        self.output = None
+        self.output_path = None
+        self._reset()
+
+    def _reset(self):
+        self.buffers = {}
+        self.attributes = {}
+        self.id_offsets = {dimension: 0 for dimension in record_dimensions}
+        self.granule_names = []
+        self.granule_starts = GrowableArray('f8', 64)
+
+    def start(self, window):
+        """Começa uma nova janela; a anterior precisa ter sido fechada com flush()."""
+        if self.window is not None:
+            raise RuntimeError(f"A janela {self.window} ainda não foi fechada com flush().")
+        self.window = window
+
+    def add_file(self, file_path):
+        """Anexa um granulo em disco à janela atual."""
+        with Dataset(file_path, 'r') as dataset:
+            self.add_dataset(dataset, os.path.basename(file_path))
+
+    def add_buffer(self, buffer, name):
+        """Anexa um granulo em memória à janela atual."""
+        with Dataset(name, 'r', memory=buffer) as dataset:
+            self.add_dataset(dataset, name)
+
+    def add_dataset(self, dataset, name):
+        """Anexa as variáveis de registro de um Dataset aberto à janela atual."""
+        if self.window is None:
+            raise RuntimeError("Nenhuma janela aberta: chame start() antes de adicionar granulos.")
+
+        for variable_name, variable in dataset.variables.items():
+            if len(variable.dimensions) != 1 or variable.dimensions[0] not in record_dimensions:
+                continue
+            values = self._decode(variable_name, variable)
+            if variable_name not in self.buffers:
+                self.buffers[variable_name] = GrowableArray(values.dtype)
+                self.attributes[variable_name] = (
+                    variable.dimensions[0],
+                    {attr: variable.getncattr(attr) for attr in variable.ncattrs() if attr not in packing_attributes},
+                )
+            self.buffers[variable_name].append(values)
+
+        # Os ids do próximo granulo começam depois do maior id deste
+        for dimension, variable_name in (('number_of_flashes', 'flash_id'),
+                                         ('number_of_groups', 'group_id'),
+                                         ('number_of_events', 'event_id')):
+            if variable_name in dataset.variables and dataset.dimensions[dimension].size > 0:
+                self.id_offsets[dimension] += int(np.ma.filled(dataset.variables[variable_name][:], 0).max()) + 1
+
+        product_time = dataset.variables.get('product_time')
+        if product_time is not None:
+            self.granule_starts.append([self._seconds_since_window(product_time, product_time[...])])
+        else:
+            self.granule_starts.append([np.nan])
+        self.granule_names.append(name)
+
+        if max((buffer.size for buffer in self.buffers.values()), default=0) >= self.flush_records:
+            self._spill()
+
+    def _seconds_since_window(self, variable, values):
+        """Converte valores 'segundos desde X' para segundos desde o início da janela."""
+        reference = num2date(0, variable.units, only_use_cftime_datetimes=False, only_use_python_datetimes=True)
+        return np.asarray(values, dtype='f8') + (reference - self.window).total_seconds()
+
+    def _decode(self, variable_name, variable):
+        """Lê uma variável de registro já decodificada e ajustada para a janela."""
+        values = variable[:]
+        if variable_name in id_variables:
+            values = np.ma.filled(values, -1).astype('i8')
+            return np.where(values >= 0, values + self.id_offsets[id_variables[variable_name]], -1)
+        if ' since ' in getattr(variable, 'units', ''):
+            return self._seconds_since_window(variable, np.ma.filled(values.astype('f8'), np.nan))
+        if values.dtype.kind == 'f':
+            return np.ma.filled(values, np.nan)
+        return np.ma.filled(values)
+
+    def _open_output(self):
+        """Cria o arquivo parcial da janela com dimensões de registro ilimitadas."""
+        os.makedirs(os.path.dirname(self._final_path()) or '.', exist_ok=True)
+        self.output_path = self._final_path() + '.part'
+        self.output = Dataset(self.output_path, 'w', format='NETCDF4')
+        self.output.setncattr('window_start', self.window.isoformat())
+        for dimension in record_dimensions + ('number_of_granules',):
+            self.output.createDimension(dimension, None)
+        names = self.output.createVariable('granule_name', str, ('number_of_granules',))
+        names.long_name = 'Nome do granulo de origem'
+        starts = self.output.createVariable('granule_start', 'f8', ('number_of_granules',), fill_value=np.nan)
+        starts.units = f"seconds since {self.window.strftime('%Y-%m-%d %H:%M:%S')}"
+
+    def _output_variable(self, variable_name):
+        """Retorna a variável do arquivo da janela, criando-a na primeira vez."""
+        if variable_name in self.output.variables:
+            return self.output.variables[variable_name]
+        dtype = self.buffers[variable_name].data.dtype
+        dimension, attributes = self.attributes[variable_name]
+        fill_value = np.nan if dtype.kind == 'f' else None
+        variable = self.output.createVariable(variable_name, dtype, (dimension,),
+                                              zlib=True, complevel=4, fill_value=fill_value)
+        variable.setncatts(attributes)
+        if ' since ' in str(attributes.get('units', '')):
+            variable.units = f"seconds since {self.window.strftime('%Y-%m-%d %H:%M:%S')}"
+        return variable
+
+    def _spill(self):
+        """Descarrega os buffers no fim do arquivo da janela e os esvazia."""
+        if self.output is None:
+            self._open_output()
+        for variable_name, buffer in self.buffers.items():
+            variable = self._output_variable(variable_name)
+            start = variable.shape[0]
+            variable[start:start + buffer.size] = buffer.values()
+            buffer.clear()
+        start = self.output.variables['granule_name'].shape[0]
+        for index, name in enumerate(self.granule_names):
+            self.output.variables['granule_name'][start + index] = name
+        self.output.variables['granule_start'][start:start + self.granule_starts.size] = self.granule_starts.values()
+        self.granule_names = []
+        self.granule_starts.clear()
+
+    def output_file(self, window):
+        """Caminho do agregado da janela que começa em `window`."""
+        return os.path.join(self.output_directory, f"{self.prefix}_{window.strftime('%Y%m%d_%H%M')}.nc")
+
+    def _final_path(self):
+        return self.output_file(self.window)
+
+    def flush(self):
+        """Fecha a janela atual, gravando o agregado. Retorna o caminho do arquivo, ou None se a janela estava vazia."""
+        output_file_path = None
+        if self.granule_names or self.output is not None:
+            self._spill()
+            self.output.close()
+            output_file_path = self._final_path()
+            os.replace(self.output_path, output_file_path)
+            print(f"Agrupamento salvo em {output_file_path}")
+        else:
+            print("Nenhum dado para agrupar nesta rodada.")
+
+        self.output = None
+        self.output_path = None
+        self.window = None
+        self._reset()
+        return output_file_path
@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import argparse
+from datetime import datetime, timedelta
+import numpy as np
+from glm_time import parse_moment
+from glm_index import FlashIndex, input_directory, index_directory
+from glm_regions import load_regions, regions_path
+
+# Arquivos consolidados, um diretório por região
+archive_directory = "data/goes16/glm_archive/"
+
+# Colunas do arquivo e seus tipos fixos; flash_time em microssegundos desde 1970
+archive_columns = {
+    'flash_time': 'i8',
+    'flash_lat': 'f4',
+    'flash_lon': 'f4',
+    'flash_energy': 'f4',
+    'flash_area': 'f4',
+    'flash_quality_flag': 'i2',
+}
+
+_hour = 3600 * 1000 * 1000
+
+
+def _microseconds(moment):
+    """Microssegundos desde 1970 de um datetime sem fuso (UTC)."""
+    return int(np.datetime64(moment, 'us').astype('i8'))
+
+
+class FlashArchive:
+    """Arquivo colunar de flashes em arquivos binários crus, ordenado por tempo e aberto por np.memmap.
+
+    Cada coluna é um arquivo de tipo fixo e um índice pequeno (hours.npy) guarda a posição do primeiro
+    flash de cada hora, então qualquer fatia de tempo é uma visão sem cópia dos memmaps. Os dados só
+    crescem no fim; meta.json guarda quantos registros são válidos e é gravado por último, então um
+    acréscimo interrompido é descartado na próxima abertura.
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.meta_path = os.path.join(directory, 'meta.json')
+        self.hours_path = os.path.join(directory, 'hours.npy')
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, encoding='utf-8') as meta_file:
+                self.meta = json.load(meta_file)
+        else:
+            self.meta = {'count': 0, 'columns': archive_columns, 'covered_until': None}
+        if os.path.exists(self.hours_path):
+            self.hours = np.load(self.hours_path)
+        else:
+            self.hours = np.empty((2, 0), dtype='i8')  # linha 0: hora (desde 1970), linha 1: posição do primeiro flash
+        self._discard_partial()
+        self.columns = None
+
+    @property
+    def count(self):
+        return self.meta['count']
+
+    @property
+    def covered_until(self):
+        """Até onde o arquivo já foi preenchido, ou None se está vazio."""
+        value = self.meta.get('covered_until')
+        return datetime.fromisoformat(value) if value else None
+
+    def _column_path(self, column):
+        return os.path.join(self.directory, f"{column}.{self.meta['columns'][column]}")
+
+    def _discard_partial(self):
+        """Corta as colunas e o índice horário no último total válido (sobras de um acréscimo interrompido)."""
+        self.hours = self.hours[:, self.hours[1] < self.count]
+        for column, dtype in self.meta['columns'].items():
+            path = self._column_path(column)
+            valid_bytes = self.count * np.dtype(dtype).itemsize
+            if os.path.exists(path) and os.path.getsize(path) > valid_bytes:
+                with open(path, 'r+b') as column_file:
+                    column_file.truncate(valid_bytes)
+
+    def append(self, flashes, covered_until=None):
+        """Acrescenta flashes (dicionário coluna → array, com flash_time datetime64) posteriores aos já gravados."""
+        times = np.asarray(flashes['flash_time'])
+        times = times.astype('datetime64[us]').astype('i8') if len(times) else np.empty(0, dtype='i8')
+        valid = times != np.iinfo('i8').min  # NaT
+        order = np.argsort(times[valid], kind='stable')
+        times = times[valid][order]
+
+        if len(times):
+            if self.count and times[0] < self._last_time():
+                raise ValueError(f"Os flashes acrescentados a {self.directory} precisam ser posteriores aos já gravados.")
+            for column, dtype in self.meta['columns'].items():
+                values = times if column == 'flash_time' else np.asarray(flashes[column])[valid][order]
+                with open(self._column_path(column), 'ab') as column_file:
+                    np.ascontiguousarray(values, dtype=dtype).tofile(column_file)
+
+            hours = times // _hour
+            new_hours, first_positions = np.unique(hours, return_index=True)
+            if self.hours.shape[1] and new_hours[0] == self.hours[0, -1]:
+                new_hours, first_positions = new_hours[1:], first_positions[1:]
+            self.hours = np.concatenate([self.hours, np.vstack([new_hours, first_positions + self.count])], axis=1)
+            np.save(self.hours_path + '.tmp.npy', self.hours)
+            os.replace(self.hours_path + '.tmp.npy', self.hours_path)
+            self.meta['count'] += len(times)
+
+        if covered_until is not None:
+            self.meta['covered_until'] = covered_until.isoformat()
+        with open(self.meta_path + '.tmp', 'w', encoding='utf-8') as meta_file:
+            json.dump(self.meta, meta_file)
+        os.replace(self.meta_path + '.tmp', self.meta_path)
+        self.columns = None
+
+    def _last_time(self):
+        with open(self._column_path('flash_time'), 'rb') as column_file:
+            column_file.seek((self.count - 1) * 8)
+            return int(np.frombuffer(column_file.read(8), dtype='i8')[0])
+
+    def open(self):
+        """Abre (uma vez) as colunas como memmaps somente leitura."""
+        if self.columns is None:
+            self.columns = {
+                column: np.memmap(self._column_path(column), dtype=dtype, mode='r', shape=(self.count,))
+                if self.count else np.empty(0, dtype=dtype)
+                for column, dtype in self.meta['columns'].items()
+            }
+        return self.columns
+
+    def bounds(self, start, end):
+        """Posições [lo, hi) dos flashes de [start, end): o índice horário limita a busca binária a poucas horas."""
+        if not self.count:
+            return 0, 0
+        times = self.open()['flash_time']
+        positions = []
+        for moment in (start, end):
+            moment = _microseconds(moment)
+            hour_index = np.searchsorted(self.hours[0], moment // _hour, side='right')
+            lo = self.hours[1, hour_index - 1] if hour_index > 0 else 0
+            hi = self.hours[1, hour_index] if hour_index < self.hours.shape[1] else self.count
+            positions.append(lo + int(np.searchsorted(times[lo:hi], moment)))
+        return positions[0], positions[1]
+
+    def slice(self, start, end, columns=None):
+        """Visões sem cópia das colunas para [start, end); flash_time volta como datetime64[us]."""
+        lo, hi = self.bounds(start, end)
+        arrays = self.open()
+        result = {}
+        for column in columns or arrays:
+            values = arrays[column][lo:hi]
+            result[column] = values.view('datetime64[us]') if column == 'flash_time' else values
+        return result
+
+
+def build_archive(region, start, end, directory=None, root=input_directory, index_path=index_directory):
+    """Estende o arquivo da região até end, lendo do índice só os dias que ainda não estão nele.
+
+    Um arquivo existente continua sempre de covered_until (começar depois deixaria um buraco que append
+    não aceita preencher) e só avança até o fim do último granulo indexado: o que ainda não foi baixado
+    ou indexado não é marcado como coberto.
+    """
+    directory = directory or os.path.join(archive_directory, region['name'])
+    archive = FlashArchive(directory)
+    if archive.covered_until is not None:
+        start = archive.covered_until
+
+    index = FlashIndex(index_path)
+    index.update(root)
+    indexed_until = index.indexed_until(region['name'])
+    end = min(end, indexed_until) if indexed_until is not None else start
+    day = start
+    while day < end:
+        day_end = min(datetime.combine(day.date(), datetime.min.time()) + timedelta(days=1), end)
+        flashes = index.query(region['bbox'], day, day_end, columns=tuple(archive_columns), region=region['name'])
+        archive.append(flashes, covered_until=day_end)
+        print(f"Arquivo {directory}: {day.isoformat()} a {day_end.isoformat()}, {len(flashes['flash_time'])} flashes.")
+        day = day_end
+    index.close()
+    return archive
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Consolida os flashes das regiões num arquivo colunar ordenado por tempo (np.memmap).')
+    parser.add_argument('-b', '--start', required=True, help='Início no formato YYYY-MM-DD ou YYYY-MM-DDTHH:MM[:SS] (UTC)')
+    parser.add_argument('-e', '--end', required=True, help='Término no formato YYYY-MM-DD (dia inteiro, inclusive) ou YYYY-MM-DDTHH:MM[:SS] (exclusivo)')
+    parser.add_argument('-r', '--region', action='append', help='Região do registro (pode repetir); sem ela, todas')
+    parser.add_argument('--regions_file', default=regions_path, help='Arquivo JSON com o registro de regiões')
+    parser.add_argument('-i', '--input', default=input_directory, help='Diretório com os granulos filtrados (subdiretórios AAAA-MM-DD)')
+    parser.add_argument('--index', default=index_directory, help='Diretório do índice espaço-temporal')
+    args = parser.parse_args(argv[1:])
+
+    start = parse_moment(args.start)
+    end = parse_moment(args.end, end=True)
+    assert start < end, "O início deve ser anterior ao término."
+
+    for region in load_regions(args.regions_file, args.region):
+        archive = build_archive(region, start, end, root=args.input, index_path=args.index)
+        print(f"{region['name']}: {archive.count} flashes até {archive.covered_until}.")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
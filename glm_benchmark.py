@@ -0,0 +1,381 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+from datetime import datetime, timedelta
+import numpy as np
+from netCDF4 import Dataset
+from fsspec.implementations.local import LocalFileSystem
+from fsspec.implementations.dirfs import DirFileSystem
+from glm_listing import bucket_root, hour_prefix, listing_hours
+from glm_pipeline import run_pipeline
+from glm_aggregator import WindowAggregator
+from glm_grid import GridAccumulator
+from glm_index import FlashIndex
+from glm_time import granule_times, window_start
+
+# bbox padrão do benchmark (Rio de Janeiro, cidade)
+benchmark_bbox = (-43.7, -43.0, -23.2, -22.7)
+
+# Área coberta pelos flashes sintéticos fora do bbox (disco aproximado do GOES-16 Leste)
+full_disk = (-135.0, -15.0, -55.0, 55.0)
+
+# Relatório de referência para o modo de regressão
+baseline_path = "benchmark_baseline.json"
+
+# Métricas em que um valor maior é melhor; nas demais (tempos), menor é melhor
+higher_is_better = ('granules_per_second', 'megabytes_per_second')
+
+# Segundos desde a época das variáveis de tempo do LCFA
+_j2000 = datetime(2000, 1, 1, 12)
+
+
+def granule_name(start):
+    """Nome de um granulo LCFA de 20 s que começa em start."""
+    end = start + timedelta(seconds=20)
+    created = end + timedelta(seconds=14)
+
+    def field(prefix, moment):
+        return f"{prefix}{moment.strftime('%Y%j%H%M%S')}{moment.microsecond // 100000}"
+
+    return f"OR_GLM-L2-LCFA_G16_{field('s', start)}_{field('e', end)}_{field('c', created)}.nc"
+
+
+def _packed(dataset, name, dimension, values, dtype, scale, offset=0.0, unsigned=False, units=None):
+    """Cria uma variável empacotada como no LCFA (scale_factor/add_offset e, se for o caso, _Unsigned)."""
+    variable = dataset.createVariable(name, dtype, (dimension,), zlib=True, complevel=4)
+    variable.scale_factor = np.float32(scale)
+    variable.add_offset = np.float32(offset)
+    if unsigned:
+        variable._Unsigned = 'true'
+    if units:
+        variable.units = units
+    variable[:] = values
+    return variable
+
+
+def synthetic_granule(start, flash_count, inside_fraction, bbox=benchmark_bbox, seed=0, groups_per_flash=4, events_per_group=3):
+    """Gera os bytes de um granulo com a estrutura do LCFA: flashes, grupos e eventos ligados por ids.
+
+    Uma fração inside_fraction dos flashes cai dentro do bbox; o resto se espalha pelo disco completo.
+    """
+    random = np.random.default_rng(seed)
+    inside = random.random(flash_count) < inside_fraction
+    area = np.where(inside[:, None], np.array(bbox), np.array(full_disk))
+    flash_lon = random.uniform(area[:, 0], area[:, 1]).astype('f4')
+    flash_lat = random.uniform(area[:, 2], area[:, 3]).astype('f4')
+    flash_id = np.arange(1, flash_count + 1, dtype='i4')
+
+    group_count = flash_count * groups_per_flash
+    group_parent = np.repeat(flash_id, groups_per_flash)
+    group_id = np.arange(1, group_count + 1, dtype='i4')
+    event_count = group_count * events_per_group
+    event_parent = np.repeat(group_id, events_per_group)
+
+    first_offset = random.uniform(0, 19.5, flash_count)
+    last_offset = np.minimum(first_offset + random.uniform(0, 0.5, flash_count), 19.99)
+    group_offset = np.repeat(first_offset, groups_per_flash)
+    time_units = f"seconds since {start.strftime('%Y-%m-%d %H:%M:%S')}"
+
+    dataset = Dataset(granule_name(start), 'w', memory=1024, format='NETCDF4')
+    dataset.title = 'GLM L2+ Lightning Detection: event, group, flash (sintético)'
+    dataset.time_coverage_start = start.strftime('%Y-%m-%dT%H:%M:%S.0Z')
+    dataset.createDimension('number_of_flashes', flash_count)
+    dataset.createDimension('number_of_groups', group_count)
+    dataset.createDimension('number_of_events', event_count)
+
+    product_time = dataset.createVariable('product_time', 'f8')
+    product_time.units = 'seconds since 2000-01-01 12:00:00'
+    product_time[...] = (start - _j2000).total_seconds()
+
+    dataset.createVariable('flash_id', 'i4', ('number_of_flashes',), zlib=True)[:] = flash_id
+    dataset.createVariable('flash_lat', 'f4', ('number_of_flashes',), zlib=True)[:] = flash_lat
+    dataset.createVariable('flash_lon', 'f4', ('number_of_flashes',), zlib=True)[:] = flash_lon
+    _packed(dataset, 'flash_time_offset_of_first_event', 'number_of_flashes', first_offset, 'i2', 0.0003814756, -5.0, True, time_units)
+    _packed(dataset, 'flash_time_offset_of_last_event', 'number_of_flashes', last_offset, 'i2', 0.0003814756, -5.0, True, time_units)
+    _packed(dataset, 'flash_energy', 'number_of_flashes', random.uniform(1e-15, 5e-14, flash_count), 'i2', 1.526e-15, 0.0, True, 'J')
+    _packed(dataset, 'flash_area', 'number_of_flashes', random.uniform(1e8, 2e9, flash_count), 'i2', 152601.9, 0.0, True, 'm2')
+    dataset.createVariable('flash_quality_flag', 'i2', ('number_of_flashes',), zlib=True)[:] = 0
+
+    dataset.createVariable('group_id', 'i4', ('number_of_groups',), zlib=True)[:] = group_id
+    dataset.createVariable('group_parent_flash_id', 'i4', ('number_of_groups',), zlib=True)[:] = group_parent
+    dataset.createVariable('group_lat', 'f4', ('number_of_groups',), zlib=True)[:] = np.repeat(flash_lat, groups_per_flash)
+    dataset.createVariable('group_lon', 'f4', ('number_of_groups',), zlib=True)[:] = np.repeat(flash_lon, groups_per_flash)
+    _packed(dataset, 'group_time_offset', 'number_of_groups', group_offset, 'i2', 0.0003814756, -5.0, True, time_units)
+
+    dataset.createVariable('event_id', 'i4', ('number_of_events',), zlib=True)[:] = np.arange(1, event_count + 1, dtype='i4')
+    dataset.createVariable('event_parent_group_id', 'i4', ('number_of_events',), zlib=True)[:] = event_parent
+    dataset.createVariable('event_lat', 'f4', ('number_of_events',), zlib=True)[:] = np.repeat(np.repeat(flash_lat, groups_per_flash), events_per_group)
+    dataset.createVariable('event_lon', 'f4', ('number_of_events',), zlib=True)[:] = np.repeat(np.repeat(flash_lon, groups_per_flash), events_per_group)
+    _packed(dataset, 'event_time_offset', 'number_of_events', np.repeat(group_offset, events_per_group), 'i2', 0.0003814756, -5.0, True, time_units)
+
+    return bytes(dataset.close())
+
+
+def build_fake_bucket(directory, start, granules, flash_count, inside_fraction, seed=0):
+    """Grava granulos sintéticos consecutivos (20 s cada) num diretório com o layout do bucket. Retorna o total de bytes.
+
+    Todas as horas que o pipeline lista existem, mesmo vazias (inclusive a anterior ao início, vista por
+    listing_hours): um prefixo ausente faria o safe_ls esperar as novas tentativas dentro do tempo medido.
+    """
+    for hour_start in listing_hours(start, start + timedelta(seconds=20 * granules)):
+        os.makedirs(os.path.join(directory, hour_prefix(hour_start, bucket_root)), exist_ok=True)
+    total = 0
+    for number in range(granules):
+        moment = start + timedelta(seconds=20 * number)
+        prefix = os.path.join(directory, hour_prefix(moment, bucket_root))
+        os.makedirs(prefix, exist_ok=True)
+        content = synthetic_granule(moment, flash_count, inside_fraction, seed=seed + number)
+        with open(os.path.join(prefix, granule_name(moment)), 'wb') as granule_file:
+            granule_file.write(content)
+        total += len(content)
+    return total
+
+
+def fake_bucket(directory):
+    """Sistema de arquivos fsspec que serve o diretório como se fosse a raiz do S3 (noaa-goes16/...)."""
+    return DirFileSystem(path=directory, fs=LocalFileSystem())
+
+
+def peak_rss_megabytes():
+    """Pico de memória residente deste processo e dos filhos já encerrados, em MB (ru_maxrss em KB no Linux).
+
+    É o pico desde o início do processo, não de um caminho: fica só no relatório geral, fora da comparação.
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    scale = 1 / 1024 / 1024 if sys.platform == 'darwin' else 1 / 1024
+    return max(own, children) * scale
+
+
+def percentiles(timings):
+    """p50/p90/p99 e máximo de uma lista de tempos, em milissegundos."""
+    if not timings:
+        return {}
+    values = np.asarray(timings) * 1000
+    return {
+        'p50_ms': float(np.percentile(values, 50)),
+        'p90_ms': float(np.percentile(values, 90)),
+        'p99_ms': float(np.percentile(values, 99)),
+        'max_ms': float(values.max()),
+    }
+
+
+def measure(function, items, total_bytes=None):
+    """Roda function sobre cada item medindo o tempo de cada chamada. Retorna o relatório do caminho."""
+    timings = []
+    started = time.perf_counter()
+    for item in items:
+        item_started = time.perf_counter()
+        function(item)
+        timings.append(time.perf_counter() - item_started)
+    return report(len(timings), time.perf_counter() - started, total_bytes, {'item': timings})
+
+
+def report(count, elapsed, total_bytes, stage_timings):
+    """Monta o relatório de um caminho: vazão e percentis por estágio."""
+    result = {
+        'items': count,
+        'seconds': elapsed,
+        'granules_per_second': count / elapsed if elapsed else 0.0,
+        'stages': {name: percentiles(timings) for name, timings in stage_timings.items()},
+    }
+    if total_bytes is not None:
+        result['megabytes_per_second'] = total_bytes / 1e6 / elapsed if elapsed else 0.0
+    return result
+
+
+def benchmark_ingest(bucket_directory, output_directory, start, end, total_bytes, granules, crop=False, filter_processes=0):
+    """Pipeline completo (listagem, download, filtro, gravação) contra o bucket local."""
+    timings = {}
+    started = time.perf_counter()
+    run_pipeline(start, end, benchmark_bbox, output_directory, fs=fake_bucket(bucket_directory), crop=crop,
+                 filter_processes=filter_processes, timings=timings)
+    elapsed = time.perf_counter() - started
+    # Listar um diretório local é quase instantâneo; se a listagem domina, houve espera (ex.: novas tentativas)
+    listing_seconds = max(timings.get('listagem') or [0.0])
+    assert listing_seconds < 0.5 * elapsed, f"A listagem levou {listing_seconds:.1f} s de {elapsed:.1f} s do ingest."
+    return report(granules, elapsed, total_bytes, timings)
+
+
+def output_files(output_directory):
+    """Granulos gravados pelo pipeline, em ordem de tempo."""
+    paths = []
+    for day in sorted(os.listdir(output_directory)):
+        day_directory = os.path.join(output_directory, day)
+        paths.extend(os.path.join(day_directory, name) for name in os.listdir(day_directory) if name.endswith('.nc'))
+    return sorted(paths, key=lambda path: granule_times(path)[0])
+
+
+def benchmark_aggregation(files, aggregate_directory, window_minutes=10):
+    """Agregação por janelas de tempo (WindowAggregator) dos granulos gravados."""
+    aggregator = WindowAggregator(aggregate_directory)
+
+    def add(path):
+        window = window_start(granule_times(path)[0], window_minutes)
+        if aggregator.window is not None and aggregator.window != window:
+            aggregator.flush()
+        if aggregator.window is None:
+            aggregator.start(window)
+        aggregator.add_file(path)
+
+    result = measure(add, files, sum(os.path.getsize(path) for path in files))
+    if aggregator.window is not None:
+        aggregator.flush()
+    return result
+
+
+def benchmark_gridding(files, resolutions=((10, 10), (200, 200))):
+    """Acúmulo das grades de densidade granulo a granulo."""
+    accumulator = GridAccumulator(benchmark_bbox, resolutions)
+    return measure(accumulator.add_file, files, sum(os.path.getsize(path) for path in files))
+
+
+def benchmark_animation(output_directory, index_path, cache_directory, frames_directory, start, end, window_minutes=1):
+    """Indexação dos granulos e desenho dos quadros da animação (sem montar o GIF)."""
+    import animation  # Importado aqui: cartopy/matplotlib só são necessários para este caminho
+
+    index_started = time.perf_counter()
+    index = FlashIndex(index_path, flash_cache=cache_directory)
+    index.update(output_directory)
+    index.close()
+    index_seconds = time.perf_counter() - index_started
+
+    animation.area = list(benchmark_bbox)
+    windows = animation.frame_windows(start, end, window_minutes)
+    frame_timings = []
+    started = time.perf_counter()
+    animation.render_chunk(0, windows, window_minutes, frames_directory, index_path, timings=frame_timings)
+    result = report(len(windows), time.perf_counter() - started, None, {'frame': frame_timings})
+    result['index_seconds'] = index_seconds
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """Compara com a referência; retorna a lista de regressões maiores que tolerance (fração)."""
+    regressions = []
+    for path, metrics in results['paths'].items():
+        reference = baseline.get('paths', {}).get(path)
+        if not reference:
+            continue
+        for metric in ('granules_per_second', 'megabytes_per_second'):
+            if metric not in metrics or not reference.get(metric):
+                continue
+            change = (metrics[metric] - reference[metric]) / reference[metric]
+            if (metric in higher_is_better and change < -tolerance) or (metric not in higher_is_better and change > tolerance):
+                regressions.append(f"{path}.{metric}: {reference[metric]:.2f} → {metrics[metric]:.2f} ({change:+.0%})")
+    return regressions
+
+
+def run_benchmarks(granules=180, flash_count=2000, inside_fraction=0.05, paths=('ingest', 'aggregation', 'gridding', 'animation'),
+                   crop=False, filter_processes=0, seed=0, keep=False):
+    """Gera o bucket sintético e mede os caminhos pedidos. Retorna o relatório completo."""
+    workspace = tempfile.mkdtemp(prefix='glm_benchmark_')
+    bucket_directory = os.path.join(workspace, 'bucket')
+    output_directory = os.path.join(workspace, 'glm_files')
+    start = datetime(2023, 11, 18, 18)
+    end = start + timedelta(seconds=20 * granules)
+
+    try:
+        generation_started = time.perf_counter()
+        total_bytes = build_fake_bucket(bucket_directory, start, granules, flash_count, inside_fraction, seed)
+        results = {
+            'parameters': {
+                'granules': granules, 'flash_count': flash_count, 'inside_fraction': inside_fraction,
+                'crop': crop, 'filter_processes': filter_processes, 'seed': seed,
+                'bucket_mb': total_bytes / 1e6, 'generation_seconds': time.perf_counter() - generation_started,
+            },
+            'paths': {},
+        }
+
+        # Os outros caminhos usam a saída do ingest
+        results['paths']['ingest'] = benchmark_ingest(bucket_directory, output_directory, start, end, total_bytes, granules,
+                                                      crop, filter_processes)
+        files = output_files(output_directory) if os.path.isdir(output_directory) else []
+        if 'aggregation' in paths:
+            results['paths']['aggregation'] = benchmark_aggregation(files, os.path.join(workspace, 'aggregated'))
+        if 'gridding' in paths:
+            results['paths']['gridding'] = benchmark_gridding(files)
+        if 'animation' in paths:
+            frames_directory = os.path.join(workspace, 'frames')
+            os.makedirs(frames_directory)
+            results['paths']['animation'] = benchmark_animation(
+                output_directory, os.path.join(workspace, 'index'), os.path.join(workspace, 'cache'), frames_directory, start, end
+            )
+        if 'ingest' not in paths:
+            del results['paths']['ingest']
+        results['peak_rss_mb'] = peak_rss_megabytes()
+        return results
+    finally:
+        if keep:
+            print(f"Arquivos do benchmark mantidos em {workspace}")
+        else:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+
+def print_report(results):
+    """Mostra o relatório em forma de tabela."""
+    parameters = results['parameters']
+    print(f"\n{parameters['granules']} granulos sintéticos, {parameters['flash_count']} flashes cada, "
+          f"{parameters['inside_fraction']:.0%} no bbox, {parameters['bucket_mb']:.1f} MB")
+    for path, metrics in results['paths'].items():
+        rate = f"{metrics['granules_per_second']:.1f} itens/s"
+        if 'megabytes_per_second' in metrics:
+            rate += f", {metrics['megabytes_per_second']:.1f} MB/s"
+        print(f"{path:12s} {metrics['seconds']:8.2f} s  {rate}")
+        for stage, values in metrics['stages'].items():
+            if values:
+                print(f"  {stage:12s} p50 {values['p50_ms']:8.2f} ms  p90 {values['p90_ms']:8.2f} ms  "
+                      f"p99 {values['p99_ms']:8.2f} ms  máx {values['max_ms']:8.2f} ms")
+    print(f"Pico de RSS do processo: {results['peak_rss_mb']:.0f} MB")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark offline do ingest, agregação, grades e animação com granulos GLM sintéticos.')
+    parser.add_argument('-n', '--granules', type=int, default=180, help='Número de granulos sintéticos (20 s cada)')
+    parser.add_argument('-f', '--flashes', type=int, default=2000, help='Flashes por granulo')
+    parser.add_argument('--inside', type=float, default=0.05, help='Fração dos flashes dentro do bbox')
+    parser.add_argument('--path', action='append', choices=['ingest', 'aggregation', 'gridding', 'animation'], help='Caminho a medir (pode repetir; padrão: todos)')
+    parser.add_argument('-c', '--crop', action='store_true', help='Mede o ingest com recorte ao bbox')
+    parser.add_argument('--filter_processes', default=0, help="Processos do filtro no ingest: inteiro ou 'auto'")
+    parser.add_argument('--seed', type=int, default=0, help='Semente dos granulos sintéticos')
+    parser.add_argument('-o', '--output', help='Grava o relatório em JSON neste arquivo')
+    parser.add_argument('--save_baseline', action='store_true', help='Grava o relatório como nova referência')
+    parser.add_argument('--baseline', default=baseline_path, help='Arquivo JSON de referência para o modo de regressão')
+    parser.add_argument('--regression', action='store_true', help='Compara com a referência e sai com erro se algo piorou além da tolerância')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Piora máxima aceita no modo de regressão (fração)')
+    parser.add_argument('--keep', action='store_true', help='Mantém o bucket e as saídas gerados')
+    args = parser.parse_args(argv[1:])
+
+    results = run_benchmarks(args.granules, args.flashes, args.inside, tuple(args.path or ('ingest', 'aggregation', 'gridding', 'animation')),
+                             args.crop, args.filter_processes, args.seed, args.keep)
+    print_report(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(results, output_file, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print(f"Referência gravada em {args.baseline}")
+
+    if args.regression:
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get('parameters', {}).get('granules') != results['parameters']['granules']:
+            print("Aviso: a referência foi gerada com outros parâmetros.")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\nRegressões:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nSem regressões em relação à referência.")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,163 @@
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from netCDF4 import Dataset
+from glm_regions import flash_variables, flash_columns
+
+# Cache padrão dos flashes decodificados, ao lado dos dados
+cache_directory = "data/goes16/glm_flash_cache/"
+
+# Conjunto de colunas guardado por granulo (o mesmo que glm_regions.flash_columns extrai)
+cached_columns = tuple(flash_variables)
+
+# Um cache aberto por processo e diretório (os processos do pool de filtro abrem o seu)
+_open_caches = {}
+
+
+def open_cache(directory):
+    """Retorna o FlashCache do diretório, abrindo-o uma única vez por processo."""
+    if directory not in _open_caches:
+        _open_caches[directory] = FlashCache(directory)
+    return _open_caches[directory]
+
+
+class FlashCache:
+    """Cache em disco dos flashes decodificados de cada granulo gravado.
+
+    A chave é o hash do conteúdo do arquivo (o mesmo granulo recortado para regiões diferentes, ou
+    regravado com outro recorte, gera arquivos diferentes) e o conjunto de colunas. Cada entrada é um diretório de
+    .npy, aberto por memmap, e as entradas mais recentes ficam também num LRU em memória. Quando o
+    total passa de max_bytes, as entradas usadas há mais tempo são apagadas.
+    """
+
+    def __init__(self, directory=cache_directory, max_bytes=2 * 1024 ** 3, memory_entries=256):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(os.path.join(directory, 'entries.sqlite'), check_same_thread=False, timeout=60)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    bytes INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )"""
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+
+    @staticmethod
+    def digest(content):
+        """Hash do conteúdo (bytes) de um arquivo gravado, que identifica as suas entradas no cache."""
+        return hashlib.sha1(content).hexdigest()
+
+    @staticmethod
+    def key(digest, columns=cached_columns):
+        """Chave da entrada: hash do conteúdo do arquivo e colunas."""
+        text = f"{digest}|{','.join(sorted(columns))}"
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def _entry_directory(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, digest, columns=cached_columns):
+        """Retorna as colunas decodificadas (memmaps) do arquivo com esse hash, ou None se não estão no cache."""
+        key = self.key(digest, columns)
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+            row = self.connection.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            directory = self._entry_directory(key)
+            try:
+                arrays = {column: np.load(os.path.join(directory, f"{column}.npy"), mmap_mode='r') for column in columns}
+            except (OSError, ValueError):
+                # Entrada apagada por outro processo ou incompleta: trata como ausente
+                with self.connection:
+                    self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            with self.connection:
+                self.connection.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._remember(key, arrays)
+            return arrays
+
+    def put(self, name, digest, arrays):
+        """Grava as colunas decodificadas de um granulo (nome e hash do arquivo) e apaga as entradas antigas se o cache passou do limite."""
+        # Colunas que o granulo não tem ficam como NaN, para a chave ser sempre a do conjunto completo
+        count = len(next(iter(arrays.values()))) if arrays else 0
+        arrays = {column: arrays[column] if column in arrays else np.full(count, np.nan) for column in cached_columns}
+        key = self.key(digest, arrays)
+        directory = self._entry_directory(key)
+        temporary = f"{directory}.{os.getpid()}.{threading.get_ident()}.tmp"
+        os.makedirs(temporary, exist_ok=True)
+        total = 0
+        for column, values in arrays.items():
+            path = os.path.join(temporary, f"{column}.npy")
+            np.save(path, np.asarray(values))
+            total += os.path.getsize(path)
+
+        with self.lock:
+            if os.path.isdir(directory):
+                shutil.rmtree(temporary, ignore_errors=True)
+            else:
+                os.replace(temporary, directory)
+            with self.connection:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", (key, os.path.basename(name), total, time.time())
+                )
+            self.memory.pop(key, None)
+            self._evict()
+
+    def _remember(self, key, arrays):
+        self.memory[key] = arrays
+        if len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def _evict(self):
+        """Apaga as entradas usadas há mais tempo até o total caber em max_bytes."""
+        total = self.connection.execute("SELECT COALESCE(SUM(bytes), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self.connection.execute("SELECT key, bytes FROM entries ORDER BY last_access").fetchall()
+        removed = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self._entry_directory(key), ignore_errors=True)
+            self.memory.pop(key, None)
+            removed.append((key,))
+            total -= size
+        with self.connection:
+            self.connection.executemany("DELETE FROM entries WHERE key = ?", removed)
+
+    def load(self, file_path, columns=None):
+        """Colunas decodificadas de um granulo em disco: do cache se possível, senão decodifica e guarda."""
+        with open(file_path, 'rb') as input_file:
+            content = input_file.read()
+        digest = self.digest(content)
+        arrays = self.get(digest)
+        if arrays is None:
+            with Dataset(file_path, 'r', memory=content) as dataset:
+                count = dataset.dimensions['number_of_flashes'].size
+                decoded = flash_columns(dataset, np.ones(count, dtype=bool))
+            self.put(file_path, digest, decoded)
+            arrays = self.get(digest) or decoded
+        if columns is None:
+            return arrays
+        return {column: arrays[column] for column in columns}
+
+    def close(self):
+        """Fecha a conexão com o banco."""
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,221 @@
+import os
+import shutil
+import threading
+import uuid
+from datetime import datetime, timedelta
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from glm_listing import hours_between, granule_margin
+from glm_time import granule_times, overlaps
+
+# Raiz padrão do armazenamento colunar, ao lado dos NetCDF filtrados
+store_directory = "data/goes16/glm_flashes/"
+
+# Esquema das colunas por flash (ver glm_regions.flash_variables)
+flash_schema = pa.schema([
+    ('flash_time', pa.timestamp('us')),
+    ('flash_end_time', pa.timestamp('us')),
+    ('flash_lat', pa.float32()),
+    ('flash_lon', pa.float32()),
+    ('flash_energy', pa.float32()),
+    ('flash_area', pa.float32()),
+    ('flash_quality_flag', pa.int16()),
+    ('flash_id', pa.int32()),
+    ('granule', pa.dictionary(pa.int32(), pa.string())),
+])
+
+# Esquema das partições: diretórios date=AAAA-MM-DD/hour=HH
+partition_schema = pa.schema([('date', pa.string()), ('hour', pa.int32())])
+
+
+def partition_directory(root, region_name, moment):
+    """Diretório da partição (data/hora) que contém o instante, dentro da região (se houver)."""
+    base = os.path.join(root, region_name) if region_name else root
+    return os.path.join(base, f"date={moment.strftime('%Y-%m-%d')}", f"hour={moment.hour:02d}")
+
+
+def partition_filter(start, end):
+    """Expressão que seleciona só as partições de hora que intersectam [start, end)."""
+    first = start.replace(minute=0, second=0, microsecond=0)
+    last = (end - timedelta(microseconds=1)).replace(minute=0, second=0, microsecond=0)
+    date, hour = ds.field('date'), ds.field('hour')
+    first_date, last_date = first.strftime('%Y-%m-%d'), last.strftime('%Y-%m-%d')
+    if first_date == last_date:
+        return (date == first_date) & (hour >= first.hour) & (hour <= last.hour)
+    middle = sorted({moment.strftime('%Y-%m-%d') for moment in hours_between(first, last)} - {first_date, last_date})
+    expression = ((date == first_date) & (hour >= first.hour)) | ((date == last_date) & (hour <= last.hour))
+    if middle:
+        expression = expression | date.isin(middle)
+    return expression
+
+
+class FlashStore:
+    """Armazenamento colunar (Parquet) dos flashes filtrados, particionado por região, data e hora.
+
+    As colunas de cada granulo ficam em memória por partição e só são gravadas quando a partição junta
+    row_group_size flashes, quando o total em memória passa de max_buffered_rows ou em flush(), sempre
+    ordenadas por tempo; assim cada arquivo tem poucos row groups grandes, com estatísticas de mín./máx.
+    que permitem pular o que está fora do intervalo consultado.
+    """
+
+    def __init__(self, root=store_directory, row_group_size=256 * 1024, max_buffered_rows=4 * 1024 * 1024):
+        self.root = root
+        self.row_group_size = row_group_size
+        self.max_buffered_rows = max_buffered_rows
+        self.lock = threading.Lock()
+        self.pending = {}  # diretório da partição → ([tabelas], [[token, partes pendentes]])
+        self.buffered_rows = 0
+
+    def append(self, region_name, columns, token=None):
+        """Acrescenta as colunas de um granulo às partições das horas dos seus flashes.
+
+        Retorna os tokens dos appends cujas colunas acabaram de ser gravadas por completo em disco, para
+        que o chamador só marque os granulos como processados depois que os dados estão gravados.
+        """
+        table = self._table(columns)
+        # Um granulo pode atravessar a virada da hora: cada flash vai para a partição da sua própria hora
+        hours = columns['flash_time'].astype('datetime64[h]')
+        pieces = [(hour, np.flatnonzero(hours == hour)) for hour in np.unique(hours[~np.isnat(hours)])]
+        if not pieces:
+            return [token]
+        holder = [token, len(pieces)]
+
+        written = []
+        with self.lock:
+            for hour, indices in pieces:
+                directory = partition_directory(self.root, region_name, hour.astype(datetime))
+                tables, holders = self.pending.setdefault(directory, ([], []))
+                tables.append(table.take(indices))
+                holders.append(holder)
+                self.buffered_rows += len(indices)
+                if sum(pending.num_rows for pending in tables) >= self.row_group_size:
+                    written.extend(self._write(directory))
+            if self.buffered_rows >= self.max_buffered_rows:
+                written.extend(self._write_all())
+        return written
+
+    @staticmethod
+    def _table(columns):
+        """Monta a tabela Arrow no esquema completo; colunas ausentes no granulo ficam nulas."""
+        size = len(columns['flash_time'])
+        arrays = []
+        for field in flash_schema:
+            if field.name not in columns:
+                arrays.append(pa.nulls(size, field.type))
+            elif pa.types.is_dictionary(field.type):
+                arrays.append(pa.array(columns[field.name], type=pa.string()).dictionary_encode())
+            else:
+                arrays.append(pa.array(columns[field.name], type=field.type))
+        return pa.Table.from_arrays(arrays, schema=flash_schema)
+
+    def flush(self):
+        """Grava todas as partições pendentes. Retorna os tokens gravados."""
+        with self.lock:
+            return self._write_all()
+
+    def _write_all(self):
+        written = []
+        for directory in list(self.pending):
+            written.extend(self._write(directory))
+        return written
+
+    def _write(self, directory):
+        """Grava as colunas pendentes de uma partição num novo arquivo Parquet, ordenadas por tempo."""
+        tables, holders = self.pending.pop(directory)
+        table = pa.concat_tables(tables).unify_dictionaries().sort_by('flash_time')
+        self.buffered_rows -= table.num_rows
+
+        os.makedirs(directory, exist_ok=True)
+        part_path = os.path.join(directory, f"part-{uuid.uuid4().hex}.parquet")
+        pq.write_table(table, part_path + '.tmp', row_group_size=self.row_group_size,
+                       compression='zstd', write_statistics=True)
+        os.replace(part_path + '.tmp', part_path)
+
+        written = []
+        for holder in holders:
+            holder[1] -= 1
+            if holder[1] == 0:
+                written.append(holder[0])
+        return written
+
+    def drop_range(self, start, end, region_name=None):
+        """Apaga os flashes dos granulos que intersectam [start, end), os mesmos que Manifest.forget_range esquece.
+
+        As horas inteiramente dentro do intervalo são apagadas de uma vez; nas horas das bordas (inclusive a
+        anterior e a seguinte, alcançadas pelos granulos que atravessam o início ou o fim), só as linhas
+        desses granulos saem dos arquivos, para não duplicá-las quando forem regravadas.
+        """
+        for hour_start in hours_between(start - granule_margin, end + granule_margin):
+            directory = partition_directory(self.root, region_name, hour_start)
+            if not os.path.isdir(directory):
+                continue
+            if start <= hour_start and hour_start + timedelta(hours=1) <= end:
+                shutil.rmtree(directory)
+                continue
+            for name in sorted(os.listdir(directory)):
+                if not name.endswith('.parquet'):
+                    continue
+                part_path = os.path.join(directory, name)
+                table = pq.read_table(part_path)
+                granules = table.column('granule').cast(pa.string())
+                reprocessed = [
+                    granule for granule in pc.unique(granules).to_pylist()
+                    if granule and overlaps(*granule_times(granule)[:2], start, end)
+                ]
+                if not reprocessed:
+                    continue
+                table = table.filter(pc.invert(pc.fill_null(pc.is_in(granules, value_set=pa.array(reprocessed)), False)))
+                if table.num_rows:
+                    pq.write_table(table, part_path + '.tmp', row_group_size=self.row_group_size,
+                                   compression='zstd', write_statistics=True)
+                    os.replace(part_path + '.tmp', part_path)
+                else:
+                    os.remove(part_path)
+
+    def compact(self, region_name=None, start=None, end=None):
+        """Junta os arquivos de cada partição num único arquivo ordenado por tempo."""
+        base = os.path.join(self.root, region_name) if region_name else self.root
+        for date_entry in sorted(os.listdir(base)) if os.path.isdir(base) else []:
+            if not date_entry.startswith('date='):
+                continue
+            for hour_entry in sorted(os.listdir(os.path.join(base, date_entry))):
+                directory = os.path.join(base, date_entry, hour_entry)
+                hour_start = datetime.strptime(f"{date_entry[5:]} {hour_entry[5:]}", '%Y-%m-%d %H')
+                if (start is not None and hour_start + timedelta(hours=1) <= start) or (end is not None and hour_start >= end):
+                    continue
+                parts = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.parquet')]
+                if len(parts) < 2:
+                    continue
+                table = pa.concat_tables([pq.read_table(part) for part in parts]).unify_dictionaries().sort_by('flash_time')
+                part_path = os.path.join(directory, f"part-{uuid.uuid4().hex}.parquet")
+                pq.write_table(table, part_path + '.tmp', row_group_size=self.row_group_size,
+                               compression='zstd', write_statistics=True)
+                os.replace(part_path + '.tmp', part_path)
+                for part in parts:
+                    os.remove(part)
+
+
+def read_flashes(start, end, bbox=None, columns=None, root=store_directory, region_name=None):
+    """Lê os flashes de [start, end) (e do bbox, se dado) do armazenamento colunar.
+
+    Só as partições de hora do intervalo são abertas, e dentro delas os row groups são descartados
+    pelas estatísticas de flash_time/flash_lat/flash_lon. Retorna um dicionário coluna → array NumPy.
+    """
+    base = os.path.join(root, region_name) if region_name else root
+    dataset = ds.dataset(base, format='parquet', schema=pa.unify_schemas([flash_schema, partition_schema]),
+                         partitioning=ds.partitioning(partition_schema, flavor='hive'))
+
+    expression = partition_filter(start, end)
+    expression &= (ds.field('flash_time') >= pa.scalar(start, pa.timestamp('us')))
+    expression &= (ds.field('flash_time') < pa.scalar(end, pa.timestamp('us')))
+    if bbox is not None:
+        lon_min, lon_max, lat_min, lat_max = bbox
+        expression &= (ds.field('flash_lon') >= lon_min) & (ds.field('flash_lon') <= lon_max)
+        expression &= (ds.field('flash_lat') >= lat_min) & (ds.field('flash_lat') <= lat_max)
+
+    table = dataset.to_table(columns=columns or [field.name for field in flash_schema], filter=expression)
+    table = table.sort_by('flash_time') if 'flash_time' in table.column_names else table
+    return {name: np.asarray(table.column(name).to_numpy(zero_copy_only=False)) for name in table.column_names}
@@ -0,0 +1,209 @@
+import os
+import sys
+import argparse
+from datetime import datetime, timedelta
+import numpy as np
+from netCDF4 import Dataset
+from glm_time import window_start, parse_moment
+from glm_grid import cell_indices, parse_resolution
+from glm_index import FlashIndex, input_directory, index_directory
+from glm_regions import load_regions, regions_path
+
+# Cubos de densidade, um arquivo por região/passo/resolução
+cube_directory = "data/goes16/glm_cubes/"
+
+_epoch = datetime(1970, 1, 1)
+
+
+def bin_flashes(times, longitudes, latitudes, energies, bbox, resolution, start, step_minutes, steps):
+    """Conta os flashes (e soma a energia) por passo de tempo e célula numa única passada vetorizada.
+
+    Retorna (counts, energy), ambos com forma (steps, linhas, colunas); o passo 0 começa em start.
+    """
+    rows, columns = resolution
+    cells, inside = cell_indices(longitudes, latitudes, bbox, resolution)
+    step_index = (np.asarray(times, dtype='datetime64[us]')[inside] - np.datetime64(start, 'us')) // np.timedelta64(step_minutes, 'm')
+    valid = (step_index >= 0) & (step_index < steps)
+    flat = step_index[valid].astype('i8') * rows * columns + cells[valid]
+    counts = np.bincount(flat, minlength=steps * rows * columns).reshape(steps, rows, columns)
+    energy = None
+    if energies is not None:
+        weights = np.nan_to_num(np.ma.filled(np.ma.asarray(energies, dtype='f8'), 0.0))[inside][valid]
+        energy = np.bincount(flat, weights=weights, minlength=steps * rows * columns).reshape(steps, rows, columns)
+    return counts, energy
+
+
+class DensityCube:
+    """Cubo (tempo, lat, lon) de contagens e energia de flashes gravado em NetCDF com dimensão de tempo ilimitada.
+
+    Os passos são alinhados ao relógio e gravados em blocos (chunks) de chunk_steps passos, então
+    acrescentar o período mais recente só escreve os blocos novos. O atributo covered_until marca até
+    onde o cubo já foi calculado.
+    """
+
+    def __init__(self, path, bbox=None, resolution=None, step_minutes=10, chunk_steps=12):
+        if (24 * 60) % step_minutes:
+            # Os passos são alinhados à meia-noite: um passo que não divide o dia atravessaria a virada
+            raise ValueError(f"O passo ({step_minutes} min) precisa dividir o dia (1440 min).")
+        self.path = path
+        if os.path.exists(path):
+            self.dataset = Dataset(path, 'a')
+            self.bbox = tuple(float(value) for value in self.dataset.bbox)
+            self.resolution = (self.dataset.dimensions['lat'].size, self.dataset.dimensions['lon'].size)
+            self.step_minutes = int(self.dataset.step_minutes)
+            if bbox is not None and not np.allclose(bbox, self.bbox):
+                raise ValueError(f"O bbox de {path} ({self.bbox}) é diferente do pedido ({tuple(bbox)}).")
+            if resolution is not None and tuple(resolution) != self.resolution:
+                raise ValueError(f"A resolução de {path} ({self.resolution}) é diferente da pedida ({tuple(resolution)}).")
+            if step_minutes != self.step_minutes:
+                raise ValueError(f"O passo de {path} ({self.step_minutes} min) é diferente do pedido ({step_minutes} min).")
+            return
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.bbox = tuple(float(value) for value in bbox)
+        self.resolution = tuple(resolution)
+        self.step_minutes = step_minutes
+        rows, columns = self.resolution
+        lon_min, lon_max, lat_min, lat_max = self.bbox
+
+        self.dataset = Dataset(path, 'w', format='NETCDF4')
+        self.dataset.bbox = np.array(self.bbox)
+        self.dataset.step_minutes = step_minutes
+        self.dataset.createDimension('time', None)
+        self.dataset.createDimension('lat', rows)
+        self.dataset.createDimension('lon', columns)
+
+        time_variable = self.dataset.createVariable('time', 'f8', ('time',), chunksizes=(chunk_steps,))
+        time_variable.units = 'seconds since 1970-01-01 00:00:00'
+        time_variable.long_name = 'Início do passo de tempo'
+        lat_step = (lat_max - lat_min) / rows
+        lon_step = (lon_max - lon_min) / columns
+        self.dataset.createVariable('lat', 'f8', ('lat',))[:] = lat_min + lat_step * (np.arange(rows) + 0.5)
+        self.dataset.createVariable('lon', 'f8', ('lon',))[:] = lon_min + lon_step * (np.arange(columns) + 0.5)
+
+        counts = self.dataset.createVariable('flash_count', 'i4', ('time', 'lat', 'lon'), zlib=True, complevel=4,
+                                             chunksizes=(chunk_steps, rows, columns), fill_value=-1)
+        counts.long_name = 'Número de flashes no passo e na célula'
+        energy = self.dataset.createVariable('flash_energy', 'f4', ('time', 'lat', 'lon'), zlib=True, complevel=4,
+                                             chunksizes=(chunk_steps, rows, columns), fill_value=np.nan)
+        energy.long_name = 'Soma de flash_energy no passo e na célula'
+        energy.units = 'J'
+
+    @property
+    def origin(self):
+        """Início do primeiro passo do cubo, ou None se ele ainda está vazio."""
+        if self.dataset.dimensions['time'].size == 0:
+            return None
+        return _epoch + timedelta(seconds=float(self.dataset.variables['time'][0]))
+
+    @property
+    def covered_until(self):
+        """Fim do último passo já calculado, ou None se o cubo está vazio."""
+        if 'covered_until' not in self.dataset.ncattrs():
+            return None
+        return datetime.fromisoformat(self.dataset.covered_until)
+
+    def step_index(self, moment):
+        """Posição no eixo de tempo do passo que começa em moment."""
+        return int((moment - self.origin) // timedelta(minutes=self.step_minutes))
+
+    def append(self, start, end, flashes):
+        """Bina os flashes (dicionário com flash_time, flash_lon, flash_lat e, opcionalmente, flash_energy) em [start, end) e grava os passos.
+
+        start e end são alinhados para baixo aos passos (um passo incompleto fica para a próxima vez); start
+        precisa continuar o cubo (ser igual a covered_until).
+        """
+        start = window_start(start, self.step_minutes)
+        end = window_start(end, self.step_minutes)
+        if self.covered_until is not None and start != self.covered_until:
+            raise ValueError(f"O cubo {self.path} vai até {self.covered_until}; não dá para acrescentar a partir de {start}.")
+        steps = int((end - start) // timedelta(minutes=self.step_minutes))
+        if steps <= 0:
+            return
+
+        counts, energy = bin_flashes(flashes['flash_time'], flashes['flash_lon'], flashes['flash_lat'],
+                                     flashes.get('flash_energy'), self.bbox, self.resolution, start,
+                                     self.step_minutes, steps)
+        first = 0 if self.origin is None else self.step_index(start)
+        step_starts = [(start - _epoch).total_seconds() + 60 * self.step_minutes * step for step in range(steps)]
+        self.dataset.variables['time'][first:first + steps] = step_starts
+        self.dataset.variables['flash_count'][first:first + steps] = counts
+        if energy is not None:
+            self.dataset.variables['flash_energy'][first:first + steps] = energy
+        self.dataset.covered_until = end.isoformat()
+        self.dataset.sync()
+
+    def read(self, start=None, end=None):
+        """Lê os passos de [start, end) do cubo. Retorna (times, counts, energy)."""
+        if self.origin is None:
+            empty = np.empty((0,) + self.resolution)
+            return np.empty(0, dtype='datetime64[us]'), empty, empty
+        first = 0 if start is None else max(self.step_index(window_start(start, self.step_minutes)), 0)
+        last = self.dataset.dimensions['time'].size if end is None else max(self.step_index(end), 0)
+        times = self.dataset.variables['time'][first:last]
+        times = np.datetime64('1970-01-01', 'us') + (np.asarray(times) * 1e6).astype('i8').astype('timedelta64[us]')
+        return times, self.dataset.variables['flash_count'][first:last], self.dataset.variables['flash_energy'][first:last]
+
+    def close(self):
+        """Fecha o arquivo do cubo."""
+        self.dataset.close()
+
+
+def build_cube(region, start, end, resolution, step_minutes=10, path=None, root=input_directory, index_path=index_directory):
+    """Estende o cubo da região até end, lendo do índice só os dias que ainda não estão no cubo.
+
+    O cubo só avança até o último passo inteiro antes do fim do último granulo indexado: o que ainda não
+    foi baixado ou indexado não é marcado como coberto.
+    """
+    if path is None:
+        path = os.path.join(cube_directory, f"{region['name']}_{step_minutes}min_{resolution[0]}x{resolution[1]}.nc")
+    cube = DensityCube(path, region['bbox'], resolution, step_minutes)
+    if cube.covered_until is not None:
+        if start < cube.origin:
+            cube.close()
+            raise ValueError(f"O cubo {path} começa em {cube.origin}; para incluir {start} crie um cubo novo.")
+        start = cube.covered_until
+    else:
+        # O primeiro passo começa alinhado: a consulta precisa cobri-lo inteiro, senão ele fica incompleto
+        start = window_start(start, step_minutes)
+
+    index = FlashIndex(index_path)
+    index.update(root)
+    indexed_until = index.indexed_until(region['name'])
+    end = window_start(min(end, indexed_until), step_minutes) if indexed_until is not None else start
+    day = start
+    while day < end:
+        day_end = min(datetime.combine(day.date(), datetime.min.time()) + timedelta(days=1), end)
+        flashes = index.query(region['bbox'], day, day_end, columns=('flash_time', 'flash_lat', 'flash_lon', 'flash_energy'),
+                              region=region['name'])
+        cube.append(day, day_end, flashes)
+        print(f"Cubo {path}: {day.isoformat()} a {day_end.isoformat()}, {len(flashes['flash_time'])} flashes.")
+        day = cube.covered_until
+    index.close()
+    cube.close()
+    return path
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Gera cubos de densidade de flashes GLM (tempo x lat x lon) para as regiões do registro.')
+    parser.add_argument('-b', '--start', required=True, help='Início no formato YYYY-MM-DD ou YYYY-MM-DDTHH:MM[:SS] (UTC)')
+    parser.add_argument('-e', '--end', required=True, help='Término no formato YYYY-MM-DD (dia inteiro, inclusive) ou YYYY-MM-DDTHH:MM[:SS] (exclusivo)')
+    parser.add_argument('-r', '--region', action='append', help='Região do registro (pode repetir); sem ela, todas')
+    parser.add_argument('--regions_file', default=regions_path, help='Arquivo JSON com o registro de regiões')
+    parser.add_argument('-s', '--step', type=int, default=10, help='Passo de tempo em minutos (divisor de 1440)')
+    parser.add_argument('--resolution', default='0.05', help="Resolução da grade: '10x10', graus ('0.05') ou '1km'")
+    parser.add_argument('-i', '--input', default=input_directory, help='Diretório com os granulos filtrados (subdiretórios AAAA-MM-DD)')
+    parser.add_argument('--index', default=index_directory, help='Diretório do índice espaço-temporal')
+    args = parser.parse_args(argv[1:])
+
+    start = parse_moment(args.start)
+    end = parse_moment(args.end, end=True)
+    assert start < end, "O início deve ser anterior ao término."
+
+    for region in load_regions(args.regions_file, args.region):
+        build_cube(region, start, end, parse_resolution(args.resolution, region['bbox']), args.step,
+                   root=args.input, index_path=args.index)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,184 @@
+import os
+import sys
+import argparse
+from datetime import datetime, timedelta
+import numpy as np
+import xarray as xr
+import dask
+import dask.array as da
+from glm_time import granule_times, overlaps, parse_moment
+from glm_regions import flash_variables
+
+# Saídas que podem ser abertas: agregados por janela e granulos filtrados por dia
+aggregate_directory = "data/goes16/aggregated_glm_files/"
+granule_directory = "data/goes16/glm_files/"
+
+# Variável do LCFA → nome da coluna (o mesmo do armazenamento colunar e do cache de flashes)
+column_names = {variable: column for column, variable in flash_variables.items()}
+
+# Flashes por bloco do dask: limita a memória de cada tarefa
+default_chunk = 200_000
+
+
+def aggregate_files(start, end, directory=aggregate_directory, prefix='glm_agg', window_minutes=10):
+    """Agregados (prefix_AAAAMMDD_HHMM.nc) cujas janelas intersectam [start, end), pelo nome do arquivo."""
+    paths = []
+    if not os.path.isdir(directory):
+        return paths
+    for name in sorted(os.listdir(directory)):
+        if not (name.startswith(prefix + '_') and name.endswith('.nc')):
+            continue
+        try:
+            window = datetime.strptime(name[len(prefix) + 1:-3], '%Y%m%d_%H%M')
+        except ValueError:
+            continue
+        if overlaps(window, window + timedelta(minutes=window_minutes), start, end):
+            paths.append(os.path.join(directory, name))
+    return paths
+
+
+def granule_files(start, end, directory=granule_directory, region_name=None):
+    """Granulos filtrados (subdiretórios AAAA-MM-DD) cujo tempo intersecta [start, end), pelo nome do arquivo."""
+    if region_name:
+        directory = os.path.join(directory, region_name)
+    paths = []
+    # Um granulo é gravado no dia em que começa; o que cruza a meia-noite fica no diretório do dia anterior
+    day = (start - timedelta(minutes=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    while day < end:
+        day_directory = os.path.join(directory, day.strftime('%Y-%m-%d'))
+        if os.path.isdir(day_directory):
+            for name in sorted(os.listdir(day_directory)):
+                if not name.endswith('.nc'):
+                    continue
+                try:
+                    granule_start, granule_end, _ = granule_times(name)
+                except ValueError:
+                    continue
+                if overlaps(granule_start, granule_end, start, end):
+                    paths.append(os.path.join(day_directory, name))
+        day += timedelta(days=1)
+    return sorted(paths, key=lambda path: granule_times(path)[0])
+
+
+def _select(dataset, start, end, bbox):
+    """Mantém só as variáveis por flash, com nomes de coluna, e só os flashes de [start, end) dentro do bbox.
+
+    Roda sobre cada arquivo antes da concatenação: só tempo, lat e lon do arquivo são lidos para montar a máscara.
+    """
+    names = [name for name, variable in dataset.variables.items() if variable.dims == ('number_of_flashes',)]
+    dataset = dataset[names].rename({name: column_names[name] for name in names if name in column_names})
+    if 'flash_time' not in dataset:
+        raise ValueError("O arquivo não tem o tempo dos flashes (flash_time_offset_of_first_event).")
+
+    times = dataset['flash_time'].values
+    mask = (times >= np.datetime64(start)) & (times < np.datetime64(end))
+    if bbox is not None:
+        lon_min, lon_max, lat_min, lat_max = bbox
+        longitudes = dataset['flash_lon'].values
+        latitudes = dataset['flash_lat'].values
+        mask &= (longitudes >= lon_min) & (longitudes <= lon_max) & (latitudes >= lat_min) & (latitudes <= lat_max)
+    return dataset.isel(number_of_flashes=np.flatnonzero(mask))
+
+
+def open_flashes(start, end, bbox=None, source='aggregated', directory=None, region_name=None,
+                 chunk_size=default_chunk, window_minutes=10, parallel=True):
+    """Abre os flashes de [start, end) (e do bbox, se dado) de vários arquivos como um único Dataset preguiçoso.
+
+    source='aggregated' usa os agregados por janela (glm_agg_*.nc); source='granules' usa os granulos
+    filtrados de cada dia. Os arquivos fora do intervalo são descartados pelo nome, sem abrir; em cada
+    arquivo aberto, só os flashes do intervalo e do bbox seguem adiante. O resultado é concatenado ao longo
+    de number_of_flashes em blocos de chunk_size flashes (dask), com os tempos já em datetime64 e os nomes
+    das colunas iguais aos do armazenamento colunar. Com parallel, os arquivos são abertos em paralelo.
+    """
+    if source == 'aggregated':
+        paths = aggregate_files(start, end, directory or aggregate_directory, window_minutes=window_minutes)
+    elif source == 'granules':
+        paths = granule_files(start, end, directory or granule_directory, region_name)
+    else:
+        raise ValueError(f"Fonte desconhecida: {source}. Use 'aggregated' ou 'granules'.")
+    if not paths:
+        raise FileNotFoundError(f"Nenhum arquivo de {start.isoformat()} a {end.isoformat()} em {directory or source}.")
+
+    dataset = xr.open_mfdataset(
+        paths, combine='nested', concat_dim='number_of_flashes', data_vars='minimal', coords='minimal',
+        compat='override', join='override', parallel=parallel, chunks={'number_of_flashes': chunk_size},
+        preprocess=lambda part: _select(part, start, end, bbox), mask_and_scale=True, decode_times=True,
+    )
+    # Os arquivos têm tamanhos diferentes: blocos uniformes mantêm a memória de cada tarefa previsível
+    dataset = dataset.chunk({'number_of_flashes': chunk_size})
+    dataset.attrs.update({'start': start.isoformat(), 'end': end.isoformat(), 'files': len(paths)})
+    if bbox is not None:
+        dataset.attrs['bbox'] = list(bbox)
+    return dataset
+
+
+def summarize(dataset, start, end, workers=None):
+    """Resumo dos flashes calculado bloco a bloco em paralelo: contagem, estatísticas de energia e área e histograma por hora.
+
+    Todas as reduções são montadas antes e calculadas numa única passada do dask sobre os blocos, então
+    cada bloco é lido uma vez e a memória fica limitada a alguns blocos por thread.
+    """
+    hours = int(np.ceil((end - start) / timedelta(hours=1)))
+    times = dataset['flash_time'].data
+    if not isinstance(times, da.Array):
+        times = da.from_array(times, chunks=default_chunk)
+    hour_index = (times - np.datetime64(start, 'ns')) // np.timedelta64(1, 'h')
+
+    # A seleção em cada arquivo já descartou os tempos inválidos e os fora do intervalo
+    reductions = {
+        'per_hour': da.bincount(da.clip(hour_index.astype('i8'), 0, max(hours - 1, 0)), minlength=hours),
+    }
+    for column in ('flash_energy', 'flash_area'):
+        if column in dataset:
+            values = dataset[column].data
+            reductions[f'{column}_sum'] = da.nansum(values)
+            reductions[f'{column}_mean'] = da.nanmean(values)
+            reductions[f'{column}_min'] = da.nanmin(values)
+            reductions[f'{column}_max'] = da.nanmax(values)
+
+    summary = {'count': dataset.sizes.get('number_of_flashes', 0), 'per_hour': np.zeros(hours, dtype='i8')}
+    if summary['count']:
+        with dask.config.set(scheduler='threads', num_workers=workers):
+            values, = dask.compute(reductions)
+        summary.update({name: value.item() if np.ndim(value) == 0 else value for name, value in values.items()})
+    summary['hour_starts'] = [start + timedelta(hours=hour) for hour in range(hours)]
+    return summary
+
+
+def print_summary(summary):
+    """Mostra o resumo no terminal."""
+    print(f"Flashes: {summary['count']}")
+    for column, label, unit in (('flash_energy', 'Energia', 'J'), ('flash_area', 'Área', 'm²')):
+        if f'{column}_sum' in summary:
+            print(f"{label}: total {summary[column + '_sum']:.3e} {unit}, média {summary[column + '_mean']:.3e}, "
+                  f"mín {summary[column + '_min']:.3e}, máx {summary[column + '_max']:.3e}")
+    print("Flashes por hora:")
+    for hour_start, count in zip(summary['hour_starts'], summary['per_hour']):
+        print(f"  {hour_start.strftime('%Y-%m-%d %H:%M')}  {int(count)}")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Abre um intervalo de saídas GLM como um único dataset preguiçoso e resume os flashes.')
+    parser.add_argument('-b', '--start', required=True, help='Início no formato YYYY-MM-DD ou YYYY-MM-DDTHH:MM[:SS] (UTC)')
+    parser.add_argument('-e', '--end', required=True, help='Término no formato YYYY-MM-DD (dia inteiro, inclusive) ou YYYY-MM-DDTHH:MM[:SS] (exclusivo)')
+    parser.add_argument('-s', '--source', choices=['aggregated', 'granules'], default='aggregated', help='Agregados por janela ou granulos filtrados por dia')
+    parser.add_argument('-d', '--directory', help='Diretório das saídas (padrão depende da fonte)')
+    parser.add_argument('-r', '--region', help='Região (subdiretório) dos granulos filtrados')
+    parser.add_argument('--bbox', type=float, nargs=4, metavar=('LON_MIN', 'LON_MAX', 'LAT_MIN', 'LAT_MAX'), help='Só os flashes dentro do bbox')
+    parser.add_argument('-w', '--window', type=int, default=10, help='Tamanho da janela dos agregados em minutos')
+    parser.add_argument('--chunk', type=int, default=default_chunk, help='Flashes por bloco')
+    parser.add_argument('-j', '--workers', type=int, help='Threads para o resumo (padrão: uma por núcleo)')
+    args = parser.parse_args(argv[1:])
+
+    start = parse_moment(args.start)
+    end = parse_moment(args.end, end=True)
+    assert start < end, "O início deve ser anterior ao término."
+
+    dataset = open_flashes(start, end, args.bbox, args.source, args.directory, args.region, args.chunk, args.window)
+    print(dataset)
+    print_summary(summarize(dataset, start, end, args.workers))
+    dataset.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
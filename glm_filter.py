@@ -0,0 +1,186 @@
+import os
+import numpy as np
+import h5py
+from netCDF4 import Dataset
+
+# Blocos pequenos: um granulo LCFA tem poucas centenas de KB, e o bloco padrão
+# do s3fs (5 MB) acabaria trazendo o arquivo inteiro na primeira leitura.
+probe_block_size = 64 * 1024
+
+# Dimensões de registro do LCFA que são recortadas pelo bbox
+record_dimensions = ('number_of_flashes', 'number_of_groups', 'number_of_events')
+
+
+def bbox_mask(longitudes, latitudes, bbox):
+    """Retorna a máscara booleana dos pontos dentro do bbox (lon_min, lon_max, lat_min, lat_max)."""
+    lon_min, lon_max, lat_min, lat_max = bbox
+    return (
+        (longitudes >= lon_min) & (longitudes <= lon_max) &
+        (latitudes >= lat_min) & (latitudes <= lat_max)
+    )
+
+
+def _read_h5_variable(h5, name):
+    """Lê uma variável NetCDF4 via h5py aplicando _FillValue, _Unsigned e scale_factor/add_offset."""
+    variable = h5[name]
+    values = variable[()]
+    attrs = variable.attrs
+
+    unsigned = attrs.get('_Unsigned', 'false')
+    if isinstance(unsigned, bytes):
+        unsigned = unsigned.decode()
+    if unsigned.lower() == 'true' and values.dtype.kind == 'i':
+        values = values.view(values.dtype.str.replace('i', 'u'))
+
+    fill_value = attrs.get('_FillValue')
+    valid = np.ones(values.shape, dtype=bool) if fill_value is None else values != fill_value
+
+    scale = attrs.get('scale_factor')
+    offset = attrs.get('add_offset')
+    if scale is not None or offset is not None:
+        values = values * (1.0 if scale is None else scale) + (0.0 if offset is None else offset)
+
+    return np.ma.masked_array(values, mask=~valid)
+
+
+def read_remote_coordinates(fs, remote_path, block_size=probe_block_size):
+    """Lê apenas flash_lat/flash_lon de um granulo remoto usando leituras por faixa de bytes do fsspec."""
+    with fs.open(remote_path, 'rb', block_size=block_size, cache_type='blockcache') as remote_file:
+        with h5py.File(remote_file, 'r') as h5:
+            longitudes = _read_h5_variable(h5, 'flash_lon')
+            latitudes = _read_h5_variable(h5, 'flash_lat')
+    return longitudes, latitudes
+
+
+def probe_coordinates(fs, remote_path, bbox, block_size=probe_block_size):
+    """Verifica, sem baixar o granulo inteiro, se há flashes dentro do bbox."""
+    try:
+        longitudes, latitudes = read_remote_coordinates(fs, remote_path, block_size)
+    except Exception as e:
+        # Na dúvida, baixa o arquivo completo e deixa o filtro normal decidir
+        print(f"Erro ao sondar o arquivo {remote_path}: {e}. Baixando completo.")
+        return True
+
+    return bool(np.any(bbox_mask(longitudes, latitudes, bbox)))
+
+
+def filter_buffer(buffer, bbox, name='granule.nc'):
+    """Aplica o filtro de bbox sobre os bytes de um granulo aberto em memória, sem tocar no disco."""
+    with Dataset(name, 'r', memory=buffer) as dataset:
+        longitudes = dataset.variables['flash_lon'][:]
+        latitudes = dataset.variables['flash_lat'][:]
+
+    return bool(np.any(bbox_mask(longitudes, latitudes, bbox)))
+
+
+def crop_indices(dataset, bbox):
+    """Calcula os índices dos flashes no bbox e dos grupos e eventos ligados a eles (evento→grupo→flash)."""
+    longitudes = dataset.variables['flash_lon'][:]
+    latitudes = dataset.variables['flash_lat'][:]
+    flash_mask = np.ma.filled(bbox_mask(longitudes, latitudes, bbox), False)
+    return crop_indices_from_mask(dataset, flash_mask)
+
+
+def crop_indices_from_mask(dataset, flash_mask):
+    """Como crop_indices, mas a partir de uma máscara de flashes já calculada."""
+    flash_ids = np.asarray(dataset.variables['flash_id'][:])[flash_mask]
+    group_mask = np.isin(np.asarray(dataset.variables['group_parent_flash_id'][:]), flash_ids)
+
+    group_ids = np.asarray(dataset.variables['group_id'][:])[group_mask]
+    event_mask = np.isin(np.asarray(dataset.variables['event_parent_group_id'][:]), group_ids)
+
+    return {
+        'number_of_flashes': np.flatnonzero(flash_mask),
+        'number_of_groups': np.flatnonzero(group_mask),
+        'number_of_events': np.flatnonzero(event_mask),
+    }
+
+
+def copy_cropped(source, target, indices):
+    """Copia dimensões, atributos e variáveis de source para target, mantendo só os índices dados nas dimensões de registro."""
+    source.set_auto_maskandscale(False)
+    target.set_auto_maskandscale(False)
+
+    target.setncatts({name: source.getncattr(name) for name in source.ncattrs()})
+
+    for name, dimension in source.dimensions.items():
+        if name in indices:
+            target.createDimension(name, len(indices[name]))
+        else:
+            target.createDimension(name, None if dimension.isunlimited() else len(dimension))
+
+    for name, variable in source.variables.items():
+        attrs = {attr: variable.getncattr(attr) for attr in variable.ncattrs()}
+        fill_value = attrs.pop('_FillValue', None)
+        new_variable = target.createVariable(name, variable.dtype, variable.dimensions,
+                                             zlib=bool(variable.dimensions), complevel=4, fill_value=fill_value)
+        new_variable.setncatts(attrs)
+
+        data = variable[...]
+        for axis, dimension in enumerate(variable.dimensions):
+            if dimension in indices:
+                data = np.take(data, indices[dimension], axis=axis)
+        new_variable[...] = data
+
+
+def crop_buffer(buffer, bbox, name='granule.nc'):
+    """Recorta um granulo em memória ao bbox. Retorna os bytes do granulo compacto, ou None se não houver flashes no bbox."""
+    with Dataset(name, 'r', memory=buffer) as source:
+        indices = crop_indices(source, bbox)
+        if indices['number_of_flashes'].size == 0:
+            return None
+
+        target = Dataset(name, 'w', memory=len(buffer), format='NETCDF4')
+        copy_cropped(source, target, indices)
+        content = target.close()
+
+    return bytes(content)
+
+
+def crop_file(source_path, target_path, bbox):
+    """Grava em target_path o granulo recortado ao bbox. Retorna False se não houver flashes no bbox."""
+    with open(source_path, 'rb') as source_file:
+        content = crop_buffer(source_file.read(), bbox, os.path.basename(source_path))
+
+    if content is None:
+        return False
+
+    write_bytes(target_path, content)
+    return True
+
+
+def write_bytes(local_path, content):
+    """Grava os bytes no destino de forma atômica (arquivo parcial + os.replace)."""
+    os.makedirs(os.path.dirname(local_path) or '.', exist_ok=True)
+    partial_path = local_path + '.part'
+    with open(partial_path, 'wb') as local_file:
+        local_file.write(content)
+    os.replace(partial_path, local_path)
+
+
+def download_filtered_in_memory(fs, remote_path, local_path, bbox, crop=False):
+    """Baixa o granulo para um buffer, filtra em memória e grava em disco apenas se houver flashes no bbox.
+
+    Com crop=True, grava só os flashes, grupos e eventos dentro do bbox em vez do granulo completo.
+    Retorna 'written' (gravado), 'empty' (nenhum flash no bbox) ou 'error' (falha no download ou no
+    filtro); só 'empty' diz algo sobre o conteúdo do granulo.
+    """
+    name = os.path.basename(local_path)
+
+    try:
+        buffer = fs.cat_file(remote_path)
+        if crop:
+            content = crop_buffer(buffer, bbox, name)
+        else:
+            content = buffer if filter_buffer(buffer, bbox, name) else None
+    except Exception as e:
+        print(f"Erro ao filtrar o arquivo {remote_path}: {e}")
+        return 'error'
+
+    if content is None:
+        print(f"Nenhum evento dentro do filtro encontrado em {remote_path}.")
+        return 'empty'
+
+    print(f"Eventos dentro do filtro encontrados em {remote_path}. Gravando em {local_path}.")
+    write_bytes(local_path, content)
+    return 'written'
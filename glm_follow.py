@@ -0,0 +1,279 @@
+import os
+import sys
+import time
+import argparse
+import threading
+import concurrent.futures
+from datetime import timedelta
+import s3fs
+from fsspec.implementations.local import LocalFileSystem
+from fsspec.implementations.dirfs import DirFileSystem
+from glm_filter import write_bytes
+from glm_listing import bucket_root, hour_prefix, _utcnow
+from glm_pipeline import safe_cat
+from glm_regions import bbox_region, filter_buffer_regions
+from glm_time import granule_times, window_start
+from glm_aggregator import WindowAggregator
+from glm_grid import GridAccumulator, grid_path, parse_resolution
+from glm_manifest import Manifest, manifest_path, job_identity
+from glm_cache import open_cache, cache_directory
+from glm_metrics import metrics, update_pass_ratio, MetricsExporter
+
+# Limites de coordenadas de interesse (Rio de Janeiro), os mesmos do index4.py
+lon_min, lon_max = -43.7, -43
+lat_min, lat_max = -23.2, -22.7
+
+# Diretórios de saída, os mesmos dos scripts de backfill
+output_directory = "data/goes16/glm_files/"
+aggregate_directory = "data/goes16/aggregated_glm_files/"
+
+# Tempo depois do fim de uma janela de agregação até ela ser fechada (granulos chegam com atraso)
+settle_time = timedelta(minutes=2)
+
+
+def local_bucket(directory):
+    """Sistema de arquivos fsspec que serve um diretório local como a raiz do bucket (noaa-goes16/...)."""
+    return DirFileSystem(path=directory, fs=LocalFileSystem())
+
+
+class Follower:
+    """Acompanha o bucket em tempo quase real: a cada poll lista só a hora atual e a anterior.
+
+    Os nomes listados são comparados com os já vistos; os granulos novos são baixados e filtrados (ou
+    recortados) em paralelo assim que aparecem, gravados como no backfill (output_directory/<data>/),
+    anexados ao agregado da sua janela de tempo e somados às grades, que são regravadas a cada poll.
+    Uma janela de agregação é fechada quando o relógio passa do seu fim mais settle_time.
+
+    Com um Manifest, granulos processados em execuções anteriores não são baixados de novo; com o
+    agregador ligado, só contam os que já entraram num agregado fechado, então uma janela interrompida
+    é refeita por inteiro na execução seguinte.
+
+    fs pode ser qualquer sistema de arquivos fsspec com o layout do bucket (ex.: local_bucket) e clock
+    a função que dá o horário UTC atual, para testar contra um diretório local com tempos simulados.
+    """
+
+    def __init__(self, fs, bbox, output_directory=output_directory, root=bucket_root, crop=True, manifest=None,
+                 aggregate_directory=None, window_minutes=10, grid_file=None, resolutions=((10, 10),),
+                 fetch_workers=8, flash_cache_directory=None, clock=_utcnow, quiet=False):
+        self.fs = fs
+        self.region = bbox_region(bbox)
+        self.output_directory = output_directory
+        self.root = root
+        self.crop = crop
+        self.manifest = manifest
+        self.window_minutes = window_minutes
+        self.flash_cache_directory = flash_cache_directory
+        self.clock = clock
+        self.log = (lambda message: None) if quiet else print
+        self.seen = {}  # chave no bucket → início da hora em que foi listada
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=fetch_workers)
+
+        self.aggregator = WindowAggregator(aggregate_directory) if aggregate_directory else None
+        if aggregate_directory:
+            os.makedirs(aggregate_directory, exist_ok=True)
+        self.window_keys = []
+        self.grid = GridAccumulator(bbox, resolutions, grid_file) if grid_file else None
+
+    def hours(self):
+        """Início da hora anterior e da atual, segundo o relógio."""
+        current = self.clock().replace(minute=0, second=0, microsecond=0)
+        return [current - timedelta(hours=1), current]
+
+    def list_new(self):
+        """Granulos das duas últimas horas que ainda não foram vistos, em ordem de tempo."""
+        hours = self.hours()
+        new = []
+        for hour_start in hours:
+            prefix = hour_prefix(hour_start, self.root)
+            # O s3fs guarda as listagens em cache; a hora atual muda a cada poll
+            self.fs.invalidate_cache(prefix)
+            # Sem novas tentativas: a hora atual não existe até o primeiro granulo dela ser publicado,
+            # e um erro passageiro só adia a listagem para o próximo poll
+            try:
+                entries = self.fs.ls(prefix, detail=True)
+            except FileNotFoundError:
+                continue  # A hora ainda não tem nenhum granulo publicado
+            except Exception as e:
+                metrics.increment('stage_errors_total', stage='listagem')
+                print(f"Erro ao listar {prefix}: {e}")
+                continue
+            for entry in entries:
+                key = entry['name']
+                if key in self.seen:
+                    continue
+                try:
+                    granule_start, granule_end, _ = granule_times(key)
+                except ValueError:
+                    self.seen[key] = hour_start
+                    continue  # Ignora objetos que não são granulos GLM
+                granule = {'key': key, 'size': entry.get('size'), 'etag': entry.get('ETag'),
+                           'start': granule_start, 'end': granule_end, 'hour': hour_start}
+                if self.manifest is not None and self.manifest.is_done(
+                    key, granule['size'], granule['etag'], require_aggregate=self.aggregator is not None
+                ):
+                    self.seen[key] = hour_start
+                    continue
+                new.append(granule)
+
+        # Esquece o que saiu da janela de listagem
+        self.seen = {key: hour_start for key, hour_start in self.seen.items() if hour_start >= hours[0]}
+        return sorted(new, key=lambda granule: granule['start'])
+
+    def fetch(self, granule):
+        """Baixa e filtra um granulo. Roda nas threads do executor."""
+        file_name = granule['key'].split('/')[-1]
+        with metrics.timer('stage_seconds', stage='download'):
+            buffer = safe_cat(self.fs, granule['key'])
+        cache = open_cache(self.flash_cache_directory) if self.flash_cache_directory else None
+        with metrics.timer('stage_seconds', stage='filtro'):
+            outputs, _ = filter_buffer_regions(buffer, [self.region], file_name, self.crop, cache)
+        return file_name, outputs.get(self.region['name'])
+
+    def poll(self):
+        """Processa os granulos novos. Retorna a lista de (chave, arquivo gravado ou None)."""
+        granules = self.list_new()
+        if granules:
+            self.log(f"{len(granules)} granulos novos.")
+        futures = [self.executor.submit(self.fetch, granule) for granule in granules]
+
+        processed = []
+        grid_changed = False
+        # Os resultados são consumidos em ordem de tempo, para o agregador receber as janelas em sequência
+        for granule, future in zip(granules, futures):
+            try:
+                file_name, content = future.result()
+            except Exception as e:
+                # Não marca como visto: tenta de novo no próximo poll
+                metrics.increment('stage_errors_total', stage='follow')
+                print(f"Erro ao processar o granulo {granule['key']}: {e}")
+                continue
+            self.seen[granule['key']] = granule['hour']
+
+            local_file_path = None
+            if content is not None:
+                local_file_path = os.path.join(self.output_directory, granule['start'].strftime('%Y-%m-%d'), file_name)
+                write_bytes(local_file_path, content)
+                metrics.increment('granules_total', result='passed')
+                self.log(f"Eventos dentro do filtro encontrados em {file_name}. Gravado em {local_file_path}")
+            else:
+                metrics.increment('granules_total', result='rejected', reason='filter')
+            if self.manifest is not None:
+                self.manifest.record(granule['key'], granule['size'], granule['etag'],
+                                     passed=content is not None, output=local_file_path)
+
+            if self.aggregator is not None:
+                self.aggregate(granule, file_name, content)
+            if self.grid is not None and local_file_path is not None:
+                grid_changed = self.grid.add_file(local_file_path) or grid_changed
+
+            metrics.observe('follow_latency_seconds', max((self.clock() - granule['end']).total_seconds(), 0.0))
+            processed.append((granule['key'], local_file_path))
+
+        if grid_changed:
+            self.grid.save()
+        self.close_settled_window()
+        metrics.increment('follow_polls_total')
+        return processed
+
+    def aggregate(self, granule, file_name, content):
+        """Anexa o granulo ao agregado da sua janela, fechando a janela anterior se ele já é da próxima."""
+        granule_window = window_start(granule['start'], self.window_minutes)
+        # Uma janela fechada nesta execução ou numa anterior (o agregado já existe) não é regravada, senão
+        # o arquivo ficaria só com os granulos novos: o granulo fica só no arquivo individual e nas grades
+        closed = (granule_window < self.aggregator.window if self.aggregator.window is not None
+                  else os.path.exists(self.aggregator.output_file(granule_window)))
+        if closed:
+            self.log(f"Granulo {file_name} chegou depois do fechamento da janela {granule_window}. Fora do agregado.")
+            if self.manifest is not None:
+                self.manifest.set_aggregate([granule['key']], '')
+            return
+        if self.aggregator.window is not None and granule_window > self.aggregator.window:
+            self.flush_window()
+        if self.aggregator.window is None:
+            self.aggregator.start(granule_window)
+        if content is not None:
+            self.aggregator.add_buffer(content, file_name)
+        self.window_keys.append(granule['key'])
+
+    def flush_window(self):
+        """Grava o agregado da janela atual e registra no manifesto quais granulos entraram nele."""
+        output_file_path = self.aggregator.flush()
+        if self.manifest is not None:
+            self.manifest.set_aggregate(self.window_keys, output_file_path or '')
+        self.window_keys = []
+
+    def close_settled_window(self):
+        """Fecha a janela atual quando o relógio já passou do seu fim mais settle_time."""
+        if self.aggregator is None or self.aggregator.window is None:
+            return
+        window_end = self.aggregator.window + timedelta(minutes=self.window_minutes)
+        if self.clock() >= window_end + settle_time:
+            self.flush_window()
+
+    def run(self, poll_interval=5.0, stop=None, max_polls=None):
+        """Faz polls a cada poll_interval segundos até stop (threading.Event) ser sinalizado ou max_polls polls."""
+        stop = stop or threading.Event()
+        polls = 0
+        while not stop.is_set() and (max_polls is None or polls < max_polls):
+            started = time.monotonic()
+            with metrics.timer('stage_seconds', stage='poll'):
+                self.poll()
+            polls += 1
+            stop.wait(max(poll_interval - (time.monotonic() - started), 0))
+
+    def close(self):
+        """Para o executor e grava as grades. Uma janela ainda aberta não é fechada: será refeita na próxima execução."""
+        self.executor.shutdown()
+        if self.grid is not None:
+            self.grid.save()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Acompanha o bucket GLM e processa cada granulo novo assim que é publicado.')
+    parser.add_argument('--interval', type=float, default=5.0, help='Segundos entre as listagens')
+    parser.add_argument('--local', help='Diretório local com o layout do bucket (noaa-goes16/GLM-L2-LCFA/...) em vez do S3')
+    parser.add_argument('--no_crop', action='store_true', help='Grava o granulo inteiro em vez de recortá-lo ao bbox')
+    parser.add_argument('-w', '--window', type=int, default=10, help='Tamanho da janela de agrupamento em minutos')
+    parser.add_argument('--no_aggregate', action='store_true', help='Não monta os agregados por janela')
+    parser.add_argument('--grid', default=grid_path, help='Arquivo .npz das grades acumuladas')
+    parser.add_argument('--resolution', action='append', help="Resolução das grades (pode repetir): 'LINHASxCOLUNAS', graus ou 'Nkm'")
+    parser.add_argument('--no_grid', action='store_true', help='Não acumula as grades')
+    parser.add_argument('--fetch_workers', type=int, default=8, help='Threads de download')
+    parser.add_argument('--manifest', default=manifest_path, help='Arquivo SQLite com o registro dos granulos já processados')
+    parser.add_argument('--flash_cache', default=cache_directory, help='Diretório do cache de flashes decodificados')
+    parser.add_argument('--no_flash_cache', action='store_true', help='Não guarda os flashes decodificados no cache')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Não imprime uma mensagem por arquivo')
+    parser.add_argument('--metrics', help='Arquivo para exportar as métricas (latência, tempos, granulos aprovados/rejeitados)')
+    parser.add_argument('--metrics_format', choices=['jsonl', 'prometheus'], default='jsonl', help='Formato das métricas: JSON lines ou textfile do Prometheus')
+    args = parser.parse_args(argv[1:])
+
+    bbox = (lon_min, lon_max, lat_min, lat_max)
+    fs = local_bucket(args.local) if args.local else s3fs.S3FileSystem(anon=True)
+    manifest = Manifest(args.manifest, job_identity(
+        'follow', [bbox_region(bbox)], not args.no_crop, output=output_directory,
+        aggregate=None if args.no_aggregate else aggregate_directory, window_minutes=args.window
+    ))
+    follower = Follower(
+        fs, bbox, output_directory, crop=not args.no_crop, manifest=manifest,
+        aggregate_directory=None if args.no_aggregate else aggregate_directory, window_minutes=args.window,
+        grid_file=None if args.no_grid else args.grid,
+        resolutions=[parse_resolution(text, bbox) for text in args.resolution or ['10x10']],
+        fetch_workers=args.fetch_workers, flash_cache_directory=None if args.no_flash_cache else args.flash_cache,
+        quiet=args.quiet
+    )
+    exporter = MetricsExporter(args.metrics, args.metrics_format, sample=update_pass_ratio).start() if args.metrics else None
+
+    print(f"Acompanhando {'o diretório ' + args.local if args.local else 'o bucket'} a cada {args.interval:g} s. Ctrl+C para parar.")
+    try:
+        follower.run(args.interval)
+    except KeyboardInterrupt:
+        print("Interrompido.")
+    finally:
+        follower.close()
+        manifest.close()
+        if exporter is not None:
+            exporter.stop()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
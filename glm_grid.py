@@ -0,0 +1,217 @@
+import os
+import sys
+import argparse
+import numpy as np
+from netCDF4 import Dataset
+from glm_time import parse_moment, granule_times
+from glm_regions import flash_columns
+from glm_index import FlashIndex, input_directory, index_directory
+from glm_cache import cache_directory
+
+# Grades acumuladas padrão, ao lado dos dados
+grid_path = "data/goes16/glm_grid.npz"
+
+# Aproximadamente 1 km em graus de latitude (em longitude, 1 km são km_degrees / cos(lat) graus)
+km_degrees = 1 / 111.32
+
+
+def grid_shape(bbox, cell_size, lon_cell_size=None):
+    """Número de linhas (latitude) e colunas (longitude) de células que cobrem o bbox.
+
+    As células têm cell_size graus de latitude e lon_cell_size (por padrão, cell_size) graus de longitude.
+    """
+    lon_min, lon_max, lat_min, lat_max = bbox
+    lon_cell_size = lon_cell_size or cell_size
+    return int(np.ceil((lat_max - lat_min) / cell_size)), int(np.ceil((lon_max - lon_min) / lon_cell_size))
+
+
+def parse_resolution(text, bbox):
+    """Converte '10x10' (divisões lat x lon), '0.05' (graus) ou '1km' no formato (linhas, colunas)."""
+    if 'x' in text:
+        rows, columns = text.split('x')
+        return int(rows), int(columns)
+    if text.endswith('km'):
+        # Células quadradas no centro do bbox: o grau de longitude encolhe com cos(lat)
+        cell_size = float(text[:-2]) * km_degrees
+        middle_latitude = np.radians((bbox[2] + bbox[3]) / 2)
+        return grid_shape(bbox, cell_size, cell_size / np.cos(middle_latitude))
+    return grid_shape(bbox, float(text))
+
+
+def cell_indices(longitudes, latitudes, bbox, resolution):
+    """Retorna (cells, inside): a célula (linha * colunas + coluna) de cada ponto dentro do bbox e a máscara desses pontos.
+
+    Como no np.histogram2d, a última borda entra na última célula.
+    """
+    rows, columns = resolution
+    lon_min, lon_max, lat_min, lat_max = bbox
+    longitudes = np.ma.filled(np.ma.asarray(longitudes, dtype='f8'), np.nan)
+    latitudes = np.ma.filled(np.ma.asarray(latitudes, dtype='f8'), np.nan)
+    inside = (longitudes >= lon_min) & (longitudes <= lon_max) & (latitudes >= lat_min) & (latitudes <= lat_max)
+    row = np.minimum(((latitudes[inside] - lat_min) / (lat_max - lat_min) * rows).astype('i8'), rows - 1)
+    column = np.minimum(((longitudes[inside] - lon_min) / (lon_max - lon_min) * columns).astype('i8'), columns - 1)
+    return row * columns + column, inside
+
+
+class GridAccumulator:
+    """Contagens (e somas de energia) de flashes num bbox, em várias resoluções ao mesmo tempo.
+
+    Os flashes são somados granulo a granulo com np.bincount, então a memória depende só do tamanho
+    das grades. As grades e os nomes dos granulos já somados podem ser gravados em path e retomados
+    depois, para acrescentar novos granulos sem reler os antigos.
+    """
+
+    def __init__(self, bbox, resolutions=((10, 10),), path=None):
+        self.bbox = tuple(float(value) for value in bbox)
+        self.resolutions = [tuple(int(value) for value in resolution) for resolution in resolutions]
+        self.path = path
+        self.counts = [np.zeros(resolution, dtype='i8') for resolution in self.resolutions]
+        self.energy = [np.zeros(resolution, dtype='f8') for resolution in self.resolutions]
+        self.sources = set()
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def edges(self, resolution):
+        """Bordas das células (lat_bins, lon_bins) de uma das resoluções."""
+        rows, columns = resolution
+        lon_min, lon_max, lat_min, lat_max = self.bbox
+        return np.linspace(lat_min, lat_max, rows + 1), np.linspace(lon_min, lon_max, columns + 1)
+
+    def add(self, longitudes, latitudes, energies=None, source=None):
+        """Soma um lote de flashes às grades. Com source, um lote com o mesmo nome não é somado duas vezes."""
+        if source is not None:
+            if source in self.sources:
+                return False
+            self.sources.add(source)
+
+        if energies is not None:
+            energies = np.nan_to_num(np.ma.filled(np.ma.asarray(energies, dtype='f8'), 0.0))
+
+        for (rows, columns), counts, energy in zip(self.resolutions, self.counts, self.energy):
+            cells, inside = cell_indices(longitudes, latitudes, self.bbox, (rows, columns))
+            counts += np.bincount(cells, minlength=rows * columns).reshape(rows, columns)
+            if energies is not None:
+                energy += np.bincount(cells, weights=energies[inside], minlength=rows * columns).reshape(rows, columns)
+        return True
+
+    def add_dataset(self, dataset, source=None):
+        """Soma os flashes de um granulo aberto."""
+        energies = dataset.variables['flash_energy'][:] if 'flash_energy' in dataset.variables else None
+        return self.add(dataset.variables['flash_lon'][:], dataset.variables['flash_lat'][:], energies, source)
+
+    def add_file(self, file_path, flash_cache=None, start=None, end=None):
+        """Soma os flashes de um granulo em disco, identificado pelo nome do arquivo (lidos pelo FlashCache, se dado).
+
+        Com start/end, só os flashes de [start, end) são somados; um granulo cortado pelo intervalo é
+        identificado pelo nome e pelo trecho somado, para o resto dele poder ser somado depois.
+        """
+        source = os.path.basename(file_path)
+        if start is not None or end is not None:
+            granule_start, granule_end, _ = granule_times(source)
+            start = start if start is not None and start > granule_start else None
+            end = end if end is not None and end < granule_end else None
+            if start is not None or end is not None:
+                source = f"{source}[{(start or granule_start).isoformat()},{(end or granule_end).isoformat()})"
+        if source in self.sources:
+            return False
+        if start is not None or end is not None:
+            if flash_cache is not None:
+                columns = flash_cache.load(file_path, ('flash_time', 'flash_lon', 'flash_lat', 'flash_energy'))
+            else:
+                with Dataset(file_path, 'r') as dataset:
+                    columns = flash_columns(dataset, np.ones(dataset.dimensions['number_of_flashes'].size, dtype=bool))
+            mask = np.ones(len(columns['flash_time']), dtype=bool)
+            if start is not None:
+                mask &= columns['flash_time'] >= np.datetime64(start, 'us')
+            if end is not None:
+                mask &= columns['flash_time'] < np.datetime64(end, 'us')
+            energies = columns['flash_energy'][mask] if 'flash_energy' in columns else None
+            return self.add(columns['flash_lon'][mask], columns['flash_lat'][mask], energies, source)
+        if flash_cache is not None:
+            columns = flash_cache.load(file_path, ('flash_lon', 'flash_lat', 'flash_energy'))
+            return self.add(columns['flash_lon'], columns['flash_lat'], columns['flash_energy'], source)
+        with Dataset(file_path, 'r') as dataset:
+            return self.add_dataset(dataset, source)
+
+    def grid(self, resolution):
+        """Retorna (counts, energy) de uma das resoluções acumuladas."""
+        index = self.resolutions.index(tuple(resolution))
+        return self.counts[index], self.energy[index]
+
+    def save(self, path=None):
+        """Grava as grades e os granulos já somados (escrita atômica)."""
+        path = path or self.path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        arrays = {'bbox': np.array(self.bbox), 'sources': np.array(sorted(self.sources), dtype=str)}
+        for index, resolution in enumerate(self.resolutions):
+            arrays[f"counts_{index}"] = self.counts[index]
+            arrays[f"energy_{index}"] = self.energy[index]
+        with open(path + '.part', 'wb') as output_file:
+            np.savez_compressed(output_file, **arrays)
+        os.replace(path + '.part', path)
+
+    def load(self, path):
+        """Retoma grades gravadas; uma resolução que não está no arquivo só pode ser acumulada num arquivo novo."""
+        with np.load(path) as saved:
+            if not np.allclose(saved['bbox'], self.bbox):
+                raise ValueError(f"O bbox de {path} ({tuple(saved['bbox'])}) é diferente do pedido ({self.bbox}).")
+            saved_grids = {}
+            index = 0
+            while f"counts_{index}" in saved:
+                counts = saved[f"counts_{index}"]
+                saved_grids[counts.shape] = (counts, saved[f"energy_{index}"])
+                index += 1
+            self.sources = set(saved['sources'].tolist())
+
+        missing = [resolution for resolution in self.resolutions if resolution not in saved_grids]
+        if missing and self.sources:
+            raise ValueError(f"As resoluções {missing} não existem em {path}; use outro arquivo para acumulá-las desde o início.")
+        for resolution, (counts, energy) in saved_grids.items():
+            if resolution not in self.resolutions:
+                # Mantém as resoluções gravadas que não foram pedidas desta vez
+                self.resolutions.append(resolution)
+                self.counts.append(counts)
+                self.energy.append(energy)
+            else:
+                index = self.resolutions.index(resolution)
+                self.counts[index], self.energy[index] = counts, energy
+
+
+def accumulate(bbox, start, end, resolutions, path=grid_path, root=input_directory, index_path=index_directory,
+               flash_cache=cache_directory, region=None):
+    """Soma às grades de path os flashes de [start, end) no bbox dos granulos que ainda não foram somados.
+
+    Com region, só os granulos de root/<region>/ são lidos (FlashIndex.granules), para o recorte de uma
+    região menor sobreposta não tomar o lugar do granulo da região pedida.
+    """
+    accumulator = GridAccumulator(bbox, resolutions, path)
+    index = FlashIndex(index_path, flash_cache=flash_cache)
+    index.update(root)
+    cache = index.flash_cache
+    added = sum(accumulator.add_file(granule_path, cache, start, end) for granule_path, _ in index.granules(bbox, start, end, region))
+    index.close()
+    accumulator.save()
+    print(f"{added} granulos novos somados às grades em {path}.")
+    return accumulator
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Acumula grades de densidade de flashes GLM em várias resoluções.')
+    parser.add_argument('-b', '--start', required=True, help='Início no formato YYYY-MM-DD ou YYYY-MM-DDTHH:MM[:SS] (UTC)')
+    parser.add_argument('-e', '--end', required=True, help='Término no formato YYYY-MM-DD (dia inteiro, inclusive) ou YYYY-MM-DDTHH:MM[:SS] (exclusivo)')
+    parser.add_argument('--bbox', type=float, nargs=4, default=[-43.7, -43, -23.2, -22.7], metavar=('LON_MIN', 'LON_MAX', 'LAT_MIN', 'LAT_MAX'), help='Área das grades')
+    parser.add_argument('-r', '--resolution', action='append', help="Resolução a acumular (pode repetir): '10x10', graus ('0.05') ou '1km'")
+    parser.add_argument('--grid', default=grid_path, help='Arquivo .npz com as grades acumuladas')
+    parser.add_argument('-i', '--input', default=input_directory, help='Diretório com os granulos filtrados (subdiretórios AAAA-MM-DD)')
+    parser.add_argument('--index', default=index_directory, help='Diretório do índice espaço-temporal')
+    parser.add_argument('--region', help='Lê só os granulos gravados no subdiretório desta região')
+    args = parser.parse_args(argv[1:])
+
+    bbox = tuple(args.bbox)
+    resolutions = [parse_resolution(text, bbox) for text in args.resolution or ['10x10']]
+    accumulate(bbox, parse_moment(args.start), parse_moment(args.end, end=True), resolutions,
+               path=args.grid, root=args.input, index_path=args.index, region=args.region)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,323 @@
+import os
+import re
+import sys
+import time
+import shutil
+import sqlite3
+import argparse
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import numpy as np
+from glm_time import granule_times, parse_moment
+from glm_cache import FlashCache, cache_directory
+
+# Granulos filtrados gravados pelo pipeline (um diretório AAAA-MM-DD por dia, ou <região>/AAAA-MM-DD com regiões)
+input_directory = "data/goes16/glm_files/"
+
+# Índice espaço-temporal, ao lado dos dados
+index_directory = "data/goes16/glm_index/"
+
+# Colunas guardadas por flash nos blocos diários do índice
+indexed_columns = ('flash_time', 'flash_lat', 'flash_lon', 'flash_energy', 'flash_area', 'flash_quality_flag')
+
+day_pattern = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+_epoch = datetime(1970, 1, 1)
+
+
+def _seconds(moment):
+    """Segundos desde 1970 de um datetime sem fuso (UTC)."""
+    return (moment - _epoch).total_seconds()
+
+
+class FlashIndex:
+    """Índice espaço-temporal dos flashes filtrados.
+
+    Dois níveis: uma R-tree SQLite com o bbox e o intervalo de tempo de cada granulo (para achar os
+    granulos e os dias candidatos) e, por dia, colunas NumPy dos flashes ordenadas por célula de uma
+    grade regular de cell_size graus. Uma consulta lê, por memmap, só as faixas de células do bbox.
+    Os granulos são lidos pelo cache de flashes decodificados (glm_cache). Os blocos são identificados
+    pelo caminho do dia relativo à raiz: 'AAAA-MM-DD' ou, com regiões, '<região>/AAAA-MM-DD'.
+    """
+
+    def __init__(self, directory=index_directory, cell_size=0.1, cached_days=64, flash_cache=cache_directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(os.path.join(directory, 'granules.sqlite'), check_same_thread=False, timeout=60)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value REAL NOT NULL)")
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS granule_files (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT UNIQUE NOT NULL,
+                    day TEXT NOT NULL,
+                    mtime REAL NOT NULL,
+                    start REAL NOT NULL,
+                    end REAL NOT NULL,
+                    flash_count INTEGER NOT NULL
+                )"""
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS granule_files_day ON granule_files (day)")
+            self.connection.execute(
+                """CREATE VIRTUAL TABLE IF NOT EXISTS granule_bounds USING rtree(
+                    id, start, end, lon_min, lon_max, lat_min, lat_max
+                )"""
+            )
+            # O tamanho da célula fica gravado: um índice existente continua com a grade com que foi construído
+            self.connection.execute("INSERT OR IGNORE INTO settings VALUES ('cell_size', ?)", (cell_size,))
+            self.cell_size = self.connection.execute("SELECT value FROM settings WHERE name = 'cell_size'").fetchone()[0]
+        self.columns_count = int(np.ceil(360 / self.cell_size))
+        self.cached_days = cached_days
+        self.shards = OrderedDict()
+        self.flash_cache = FlashCache(flash_cache)
+
+    def _cells(self, longitudes, latitudes):
+        """Número da célula da grade global de cada ponto."""
+        columns = np.clip(np.floor((longitudes + 180) / self.cell_size), 0, self.columns_count - 1).astype('i8')
+        rows = np.floor((latitudes + 90) / self.cell_size).astype('i8')
+        return rows * self.columns_count + columns
+
+    def _shard_directory(self, day):
+        return os.path.join(self.directory, 'days', day)
+
+    @staticmethod
+    def _day_directories(root):
+        """Lista (dia, diretório) de root/AAAA-MM-DD e root/<região>/AAAA-MM-DD."""
+        if not os.path.isdir(root):
+            return []
+        days = []
+        for entry in sorted(os.listdir(root)):
+            path = os.path.join(root, entry)
+            if day_pattern.match(entry):
+                days.append((entry, path))
+            elif os.path.isdir(path):
+                days.extend((f"{entry}/{day}", os.path.join(path, day))
+                            for day in sorted(os.listdir(path)) if day_pattern.match(day))
+        return days
+
+    def update(self, root=input_directory):
+        """Indexa os dias de root que mudaram desde a última atualização e remove os que sumiram do disco."""
+        days = self._day_directories(root)
+        for day, day_directory in days:
+            files = {
+                os.path.join(day_directory, name): os.path.getmtime(os.path.join(day_directory, name))
+                for name in os.listdir(day_directory) if name.endswith('.nc')
+            }
+            with self.lock:
+                indexed = dict(self.connection.execute("SELECT path, mtime FROM granule_files WHERE day = ?", (day,)))
+            if indexed != files:
+                self.index_day(day, files)
+
+        with self.lock:
+            indexed_days = {row[0] for row in self.connection.execute("SELECT DISTINCT day FROM granule_files")}
+        for day in sorted(indexed_days - {day for day, _ in days}):
+            self.drop_day(day)
+
+    def _delete_rows(self, day):
+        """Apaga os granulos de um dia das tabelas. Chamado com o lock e dentro de uma transação."""
+        old_ids = [row[0] for row in self.connection.execute("SELECT id FROM granule_files WHERE day = ?", (day,))]
+        self.connection.executemany("DELETE FROM granule_bounds WHERE id = ?", [(granule_id,) for granule_id in old_ids])
+        self.connection.execute("DELETE FROM granule_files WHERE day = ?", (day,))
+
+    def drop_day(self, day):
+        """Remove do índice um dia cujo diretório não existe mais."""
+        with self.lock:
+            self.shards.pop(day, None)
+            with self.connection:
+                self._delete_rows(day)
+            shutil.rmtree(self._shard_directory(day), ignore_errors=True)
+        print(f"Dia {day} removido do índice.")
+
+    def index_day(self, day, files):
+        """Reconstrói o bloco de um dia a partir dos seus granulos (caminho → mtime)."""
+        started = time.time()
+        parts = {column: [] for column in indexed_columns}
+        granules = []
+        for path, mtime in sorted(files.items()):
+            try:
+                granule_start, granule_end, _ = granule_times(os.path.basename(path))
+                columns = self.flash_cache.load(path, indexed_columns)
+                count = len(columns['flash_time'])
+            except Exception as e:
+                print(f"Erro ao indexar o arquivo {path}: {e}")
+                # Registrado sem flashes para não ser relido até mudar no disco
+                granules.append((path, mtime, 0.0, 0.0, 0, None))
+                continue
+            if count:
+                for column in indexed_columns:
+                    parts[column].append(columns[column])
+                bounds = (float(columns['flash_lon'].min()), float(columns['flash_lon'].max()),
+                          float(columns['flash_lat'].min()), float(columns['flash_lat'].max()))
+            else:
+                bounds = None
+            granules.append((path, mtime, _seconds(granule_start), _seconds(granule_end), count, bounds))
+
+        shard = {column: np.concatenate(parts[column]) if parts[column] else np.empty(0) for column in indexed_columns}
+        if parts['flash_time']:
+            cells = self._cells(shard['flash_lon'], shard['flash_lat'])
+            order = np.lexsort((shard['flash_time'], cells))
+            shard = {column: values[order] for column, values in shard.items()}
+            shard['cell'] = cells[order]
+        else:
+            shard['cell'] = np.empty(0, dtype='i8')
+
+        # Grava o bloco novo ao lado e troca os diretórios, para uma consulta nunca ver um bloco pela metade
+        directory = self._shard_directory(day)
+        os.makedirs(os.path.dirname(directory), exist_ok=True)
+        for leftover in (directory + '.tmp', directory + '.old'):
+            if os.path.isdir(leftover):
+                shutil.rmtree(leftover)
+        os.makedirs(directory + '.tmp')
+        for column, values in shard.items():
+            np.save(os.path.join(directory + '.tmp', f"{column}.npy"), values)
+
+        with self.lock:
+            self.shards.pop(day, None)
+            if os.path.isdir(directory):
+                os.replace(directory, directory + '.old')
+            os.replace(directory + '.tmp', directory)
+            shutil.rmtree(directory + '.old', ignore_errors=True)
+
+            with self.connection:
+                self._delete_rows(day)
+                for path, mtime, granule_start, granule_end, count, bounds in granules:
+                    cursor = self.connection.execute(
+                        "INSERT INTO granule_files (path, day, mtime, start, end, flash_count) VALUES (?, ?, ?, ?, ?, ?)",
+                        (path, day, mtime, granule_start, granule_end, count)
+                    )
+                    if bounds is not None:
+                        self.connection.execute(
+                            "INSERT INTO granule_bounds VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (cursor.lastrowid, granule_start, granule_end, *bounds)
+                        )
+
+        print(f"Dia {day} indexado: {len(granules)} granulos, {len(shard['cell'])} flashes em {time.time() - started:.1f} s.")
+
+    def granules(self, bbox, start, end, region=None):
+        """Retorna (caminho, dia) dos granulos com flashes no bbox e tempo intersectando [start, end).
+
+        Com region, só os granulos de root/<region>/ contam, se o índice tiver esse subdiretório (regiões
+        que se sobrepõem gravam os mesmos flashes em mais de um subdiretório).
+        """
+        lon_min, lon_max, lat_min, lat_max = bbox
+        with self.lock:
+            # A R-tree guarda float32 arredondado para fora; o teste exato de tempo fica na tabela principal
+            rows = self.connection.execute(
+                """SELECT f.path, f.day FROM granule_bounds b JOIN granule_files f ON f.id = b.id
+                   WHERE b.start < ? AND b.end > ? AND b.lon_min <= ? AND b.lon_max >= ?
+                     AND b.lat_min <= ? AND b.lat_max >= ? AND f.start < ? AND f.end > ?
+                   ORDER BY f.start""",
+                (_seconds(end), _seconds(start), lon_max, lon_min, lat_max, lat_min, _seconds(end), _seconds(start))
+            ).fetchall()
+            if self._has_region(region):
+                rows = [row for row in rows if row[1].startswith(f"{region}/")]
+        return rows
+
+    def _has_region(self, region):
+        """Diz se o índice tem granulos de root/<region>/. Chamado com o lock."""
+        return region is not None and self.connection.execute(
+            "SELECT 1 FROM granule_files WHERE day LIKE ? LIMIT 1", (f"{region}/%",)
+        ).fetchone() is not None
+
+    def indexed_until(self, region=None):
+        """Fim do último granulo indexado (só de root/<region>/, como em granules), ou None se o índice está vazio."""
+        with self.lock:
+            if self._has_region(region):
+                row = self.connection.execute("SELECT MAX(end) FROM granule_files WHERE day LIKE ?", (f"{region}/%",)).fetchone()
+            else:
+                row = self.connection.execute("SELECT MAX(end) FROM granule_files").fetchone()
+        return _epoch + timedelta(seconds=row[0]) if row[0] else None
+
+    def _shard(self, day):
+        """Colunas de um dia, abertas por memmap e mantidas num cache LRU."""
+        with self.lock:
+            if day in self.shards:
+                self.shards.move_to_end(day)
+                return self.shards[day]
+            directory = self._shard_directory(day)
+            shard = {
+                column: np.load(os.path.join(directory, f"{column}.npy"), mmap_mode='r')
+                for column in indexed_columns + ('cell',)
+            }
+            self.shards[day] = shard
+            if len(self.shards) > self.cached_days:
+                self.shards.popitem(last=False)
+            return shard
+
+    def query(self, bbox, start, end, columns=indexed_columns, region=None):
+        """Retorna os flashes no bbox (lon_min, lon_max, lat_min, lat_max) e em [start, end) como arrays NumPy.
+
+        Só os dias com algum granulo candidato na R-tree são abertos, e de cada um só são lidas as
+        faixas de células das linhas da grade que cortam o bbox. region restringe os dias como em granules.
+        """
+        lon_min, lon_max, lat_min, lat_max = bbox
+        days = sorted({day for _, day in self.granules(bbox, start, end, region)})
+        t0, t1 = np.datetime64(start, 'us'), np.datetime64(end, 'us')
+        corners = self._cells(np.array([lon_min, lon_max]), np.array([lat_min, lat_max]))
+        first_row, last_row = corners // self.columns_count
+        first_column, last_column = corners % self.columns_count
+
+        parts = {column: [] for column in columns}
+        for day in days:
+            shard = self._shard(day)
+            for row in range(first_row, last_row + 1):
+                lo, hi = np.searchsorted(shard['cell'], [row * self.columns_count + first_column,
+                                                         row * self.columns_count + last_column + 1])
+                if lo == hi:
+                    continue
+                longitudes, latitudes, times = (shard[name][lo:hi] for name in ('flash_lon', 'flash_lat', 'flash_time'))
+                mask = (
+                    (longitudes >= lon_min) & (longitudes <= lon_max) &
+                    (latitudes >= lat_min) & (latitudes <= lat_max) &
+                    (times >= t0) & (times < t1)
+                )
+                selected = lo + np.flatnonzero(mask)
+                for column in columns:
+                    parts[column].append(np.asarray(shard[column][selected]))
+
+        result = {column: np.concatenate(parts[column]) if parts[column] else np.empty(0) for column in columns}
+        if 'flash_time' in result and len(result['flash_time']):
+            order = np.argsort(result['flash_time'], kind='stable')
+            result = {column: values[order] for column, values in result.items()}
+        return result
+
+    def close(self):
+        """Fecha as conexões com os bancos."""
+        with self.lock:
+            self.connection.close()
+        self.flash_cache.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Constrói o índice espaço-temporal dos flashes filtrados e faz consultas por bbox e tempo.')
+    parser.add_argument('-i', '--input', default=input_directory, help='Diretório com os granulos filtrados (subdiretórios AAAA-MM-DD ou <região>/AAAA-MM-DD)')
+    parser.add_argument('--index', default=index_directory, help='Diretório do índice')
+    parser.add_argument('--cell_size', type=float, default=0.1, help='Tamanho da célula da grade em graus (só vale para um índice novo)')
+    parser.add_argument('--no_update', action='store_true', help='Não reindexa os dias que mudaram antes de consultar')
+    parser.add_argument('-q', '--bbox', type=float, nargs=4, metavar=('LON_MIN', 'LON_MAX', 'LAT_MIN', 'LAT_MAX'), help='Consulta os flashes deste bbox')
+    parser.add_argument('-r', '--region', help='Consulta só os granulos gravados no subdiretório desta região')
+    parser.add_argument('-b', '--start', help='Início da consulta no formato YYYY-MM-DD ou YYYY-MM-DDTHH:MM[:SS] (UTC)')
+    parser.add_argument('-e', '--end', help='Término da consulta no formato YYYY-MM-DD (dia inteiro, inclusive) ou YYYY-MM-DDTHH:MM[:SS] (exclusivo)')
+    args = parser.parse_args(argv[1:])
+
+    index = FlashIndex(args.index, cell_size=args.cell_size)
+    if not args.no_update:
+        index.update(args.input)
+
+    if args.bbox:
+        assert args.start and args.end, "A consulta precisa de --start e --end."
+        start = parse_moment(args.start)
+        end = parse_moment(args.end, end=True)
+        started = time.perf_counter()
+        flashes = index.query(tuple(args.bbox), start, end, region=args.region)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"{len(flashes['flash_time'])} flashes em {elapsed:.1f} ms.")
+
+    index.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
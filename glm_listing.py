@@ -0,0 +1,177 @@
+import os
+import sqlite3
+import threading
+import time
+import concurrent.futures
+from datetime import datetime, timedelta, timezone
+import tenacity
+from glm_time import granule_times
+from glm_metrics import metrics, count_retries
+
+# Raiz dos granulos LCFA no bucket público do GOES-16
+bucket_root = 'noaa-goes16/GLM-L2-LCFA'
+
+# Índice local das listagens do bucket
+listing_cache_path = "data/goes16/glm_listing.sqlite"
+
+# Granulos duram 20 s e ficam no prefixo da hora em que começam: um que intersecta o início pedido
+# começou no máximo esta margem antes dele, talvez ainda na hora anterior
+granule_margin = timedelta(minutes=1)
+
+# Uma hora só é considerada fechada depois desta margem, para dar tempo aos últimos granulos publicados
+closed_margin = timedelta(minutes=30)
+
+
+@tenacity.retry(
+    retry=tenacity.retry_if_exception_type(FileNotFoundError),
+    wait=tenacity.wait_exponential(multiplier=1, min=2, max=10),
+    stop=tenacity.stop_after_attempt(5),
+    before_sleep=count_retries('ls'),
+    reraise=True
+)
+def safe_ls(fs, path, detail=False):
+    """Função segura para listar arquivos usando tenacity."""
+    with metrics.timer('request_seconds', operation='ls'):
+        return fs.ls(path, detail=detail)
+
+
+def hour_prefix(hour_start, root=bucket_root):
+    """Retorna o prefixo do bucket (raiz/AAAA/DDD/HH/) da hora que contém hour_start."""
+    return f"{root}/{hour_start.year}/{hour_start.timetuple().tm_yday:03d}/{hour_start.hour:02d}/"
+
+
+def hours_between(start, end):
+    """Gera o início de cada hora que intersecta o intervalo [start, end)."""
+    hour_start = start.replace(minute=0, second=0, microsecond=0)
+    while hour_start < end:
+        yield hour_start
+        hour_start += timedelta(hours=1)
+
+
+def listing_hours(start, end):
+    """Horas a listar para achar todos os granulos que intersectam [start, end), incluindo a anterior quando
+    um granulo dela pode atravessar o início. O filtro por granulo (glm_time.overlaps) descarta o resto."""
+    return hours_between(start - granule_margin, end)
+
+
+def _utcnow():
+    """Horário UTC atual sem fuso, no mesmo formato dos tempos dos granulos."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class ListingCache:
+    """Índice local (SQLite) das listagens horárias do bucket GLM.
+
+    Horas já fechadas são listadas uma única vez; só horas recentes voltam a ser consultadas no bucket.
+    """
+
+    def __init__(self, fs, path=listing_cache_path, root=bucket_root):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.fs = fs
+        self.root = root
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS prefixes (
+                    prefix TEXT PRIMARY KEY,
+                    closed INTEGER NOT NULL,
+                    listed_at REAL NOT NULL
+                )"""
+            )
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS granules (
+                    key TEXT PRIMARY KEY,
+                    prefix TEXT NOT NULL,
+                    size INTEGER,
+                    etag TEXT,
+                    start TEXT NOT NULL,
+                    end TEXT NOT NULL,
+                    created TEXT NOT NULL
+                )"""
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS granules_start ON granules (start)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS granules_prefix ON granules (prefix)")
+
+    def is_closed(self, hour_start):
+        """Diz se a listagem da hora já está no índice e não pode mais mudar."""
+        with self.lock:
+            cursor = self.connection.execute(
+                "SELECT closed FROM prefixes WHERE prefix = ?", (hour_prefix(hour_start, self.root),)
+            )
+            row = cursor.fetchone()
+        return row is not None and bool(row[0])
+
+    def refresh_hour(self, hour_start):
+        """Lista a hora no bucket e grava o resultado no índice."""
+        prefix = hour_prefix(hour_start, self.root)
+        try:
+            entries = safe_ls(self.fs, prefix, detail=True)
+        except FileNotFoundError:
+            print(f"Prefixo {prefix} não encontrado no bucket. Pulando...")
+            entries = []
+
+        rows = []
+        for entry in entries:
+            name = entry['name']
+            try:
+                start, end, created = granule_times(name)
+            except ValueError:
+                continue  # Ignora objetos que não são granulos GLM
+            rows.append((name, prefix, entry.get('size'), entry.get('ETag'),
+                         start.isoformat(), end.isoformat(), created.isoformat()))
+
+        # Uma hora vazia pode só não ter sido publicada ainda; só fecha se já passou da margem
+        closed = hour_start + timedelta(hours=1) + closed_margin < _utcnow()
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM granules WHERE prefix = ?", (prefix,))
+            self.connection.executemany("INSERT OR REPLACE INTO granules VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self.connection.execute(
+                "INSERT OR REPLACE INTO prefixes VALUES (?, ?, ?)", (prefix, int(closed), time.time())
+            )
+
+    def list_hour(self, hour_start):
+        """Retorna os granulos da hora (dicionários no formato de fs.ls(detail=True) com 'start' e 'end')."""
+        if not self.is_closed(hour_start):
+            self.refresh_hour(hour_start)
+        with self.lock:
+            cursor = self.connection.execute(
+                "SELECT key, size, etag, start, end FROM granules WHERE prefix = ? ORDER BY start",
+                (hour_prefix(hour_start, self.root),)
+            )
+            rows = cursor.fetchall()
+        return [self._entry(row) for row in rows]
+
+    def query(self, start, end, workers=8):
+        """Retorna os granulos que intersectam [start, end), listando em paralelo só as horas que faltam no índice."""
+        missing = [hour_start for hour_start in listing_hours(start, end) if not self.is_closed(hour_start)]
+        if missing:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(self.refresh_hour, missing))
+
+        with self.lock:
+            cursor = self.connection.execute(
+                """SELECT key, size, etag, start, end FROM granules
+                   WHERE start < ? AND start >= ? AND end > ? ORDER BY start""",
+                (end.isoformat(), (start - granule_margin).isoformat(), start.isoformat())
+            )
+            rows = cursor.fetchall()
+        return [self._entry(row) for row in rows]
+
+    @staticmethod
+    def _entry(row):
+        key, size, etag, start, end = row
+        return {
+            'name': key,
+            'size': size,
+            'ETag': etag,
+            'start': datetime.fromisoformat(start),
+            'end': datetime.fromisoformat(end),
+        }
+
+    def close(self):
+        """Fecha a conexão com o banco."""
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,178 @@
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+import time
+from glm_listing import hour_prefix, listing_hours
+from glm_time import granule_times, overlaps
+
+# Manifesto padrão, ao lado dos dados baixados
+manifest_path = "data/goes16/glm_manifest.sqlite"
+
+
+def job_identity(kind, regions, crop=False, **options):
+    """Identidade de um job para o manifesto: tipo de saída, regiões (nome, bbox e polígono), recorte e opções.
+
+    Jobs com bboxes, regiões ou saídas diferentes têm identidades diferentes, então o que um já processou
+    não faz o outro pular granulos.
+    """
+    description = json.dumps({
+        'kind': kind,
+        'regions': [[region['name'], [float(value) for value in region['bbox']], region.get('polygon')] for region in regions],
+        'crop': bool(crop),
+        'options': options,
+    }, sort_keys=True)
+    return f"{kind}-{hashlib.sha1(description.encode()).hexdigest()[:12]}"
+
+
+class Manifest:
+    """Registro persistente (SQLite) dos granulos já processados, para retomar execuções interrompidas.
+
+    Com job (ver job_identity), os registros ficam separados por job: vários scripts e regiões podem
+    compartilhar o mesmo arquivo sem um pular o que só o outro processou.
+    """
+
+    def __init__(self, path=manifest_path, job=None):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.prefix = f"{job}|" if job else ''
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS granules (
+                    key TEXT PRIMARY KEY,
+                    size INTEGER,
+                    etag TEXT,
+                    passed INTEGER NOT NULL,
+                    output TEXT,
+                    aggregate TEXT,
+                    processed_at REAL NOT NULL
+                )"""
+            )
+
+    def get(self, key):
+        """Retorna o registro do granulo como dicionário, ou None se ele ainda não foi processado."""
+        with self.lock:
+            cursor = self.connection.execute(
+                "SELECT key, size, etag, passed, output, aggregate, processed_at FROM granules WHERE key = ?",
+                (self.prefix + key,)
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip(('key', 'size', 'etag', 'passed', 'output', 'aggregate', 'processed_at'), (key,) + row[1:]))
+
+    def is_done(self, key, size=None, etag=None, require_aggregate=False):
+        """Diz se o granulo já foi processado e não mudou no bucket (mesmo tamanho e ETag, quando conhecidos)."""
+        record = self.get(key)
+        if record is None:
+            return False
+        if size is not None and record['size'] is not None and record['size'] != size:
+            return False
+        if etag is not None and record['etag'] is not None and record['etag'] != etag:
+            return False
+        if require_aggregate and record['aggregate'] is None:
+            return False
+        return True
+
+    def record(self, key, size=None, etag=None, passed=False, output=None):
+        """Registra o resultado do filtro de um granulo e o arquivo gerado, se houver."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                """INSERT INTO granules (key, size, etag, passed, output, aggregate, processed_at)
+                   VALUES (?, ?, ?, ?, ?, NULL, ?)
+                   ON CONFLICT(key) DO UPDATE SET size = excluded.size, etag = excluded.etag,
+                       passed = excluded.passed, output = excluded.output, aggregate = NULL,
+                       processed_at = excluded.processed_at""",
+                (self.prefix + key, size, etag, int(bool(passed)), output, time.time())
+            )
+
+    def set_aggregate(self, keys, aggregate):
+        """Marca em qual arquivo agregado os granulos foram incluídos."""
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "UPDATE granules SET aggregate = ? WHERE key = ?", [(aggregate, self.prefix + key) for key in keys]
+            )
+
+    def forget_range(self, start, end):
+        """Remove os registros dos granulos cujo tempo intersecta [start, end) (chaves no formato .../AAAA/DDD/HH/...).
+
+        Como em listing_hours, a hora anterior também é vista, pelo granulo que atravessa o início: são os
+        mesmos granulos que o pipeline baixa de novo e cujos flashes FlashStore.drop_range apaga.
+        """
+        with self.lock, self.connection:
+            keys = []
+            for hour_start in listing_hours(start, end):
+                pattern = f"{self.prefix}%{hour_prefix(hour_start, '')}%"
+                keys.extend(row[0] for row in self.connection.execute("SELECT key FROM granules WHERE key LIKE ?", (pattern,)))
+            forgotten = []
+            for key in keys:
+                try:
+                    granule_start, granule_end, _ = granule_times(key)
+                except ValueError:
+                    continue
+                if overlaps(granule_start, granule_end, start, end):
+                    forgotten.append((key,))
+            self.connection.executemany("DELETE FROM granules WHERE key = ?", forgotten)
+
+    def close(self):
+        """Fecha a conexão com o banco."""
+        with self.lock:
+            self.connection.close()
+
+
+# Cache negativo compartilhado entre jobs e regiões
+negative_cache_path = "data/goes16/glm_negative_cache.sqlite"
+
+
+class NegativeCache:
+    """Registro compacto dos granulos sem flashes em um bbox, para não baixá-los de novo.
+
+    Um granulo vazio em um bbox também é vazio em qualquer bbox contido nele, então a consulta
+    aproveita resultados de jobs com regiões maiores.
+    """
+
+    def __init__(self, path=negative_cache_path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS empty_granules (
+                    name TEXT NOT NULL,
+                    lon_min REAL NOT NULL,
+                    lon_max REAL NOT NULL,
+                    lat_min REAL NOT NULL,
+                    lat_max REAL NOT NULL,
+                    PRIMARY KEY (name, lon_min, lon_max, lat_min, lat_max)
+                ) WITHOUT ROWID"""
+            )
+
+    def is_known_empty(self, name, bbox):
+        """Diz se já se sabe que o granulo não tem flashes no bbox (lon_min, lon_max, lat_min, lat_max)."""
+        lon_min, lon_max, lat_min, lat_max = bbox
+        with self.lock:
+            cursor = self.connection.execute(
+                """SELECT 1 FROM empty_granules
+                   WHERE name = ? AND lon_min <= ? AND lon_max >= ? AND lat_min <= ? AND lat_max >= ?
+                   LIMIT 1""",
+                (name.split('/')[-1], lon_min, lon_max, lat_min, lat_max)
+            )
+            return cursor.fetchone() is not None
+
+    def add(self, name, bbox):
+        """Registra que o granulo não tem flashes no bbox."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO empty_granules VALUES (?, ?, ?, ?, ?)", (name.split('/')[-1], *bbox)
+            )
+
+    def close(self):
+        """Fecha a conexão com o banco."""
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# Prefixo dos nomes das métricas no formato Prometheus
+metric_prefix = 'glm_'
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+class Metrics:
+    """Registro de métricas do processo: contadores, medidores (gauges) e cronômetros, com rótulos opcionais.
+
+    Todas as operações são protegidas por um lock, então as threads dos estágios do pipeline podem
+    registrar diretamente. Os cronômetros guardam só total, soma e máximo por série.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.timers = {}
+
+    def increment(self, name, value=1, **labels):
+        """Soma value ao contador name."""
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        """Define o valor atual do medidor name."""
+        with self.lock:
+            self.gauges[_key(name, labels)] = value
+
+    def observe(self, name, seconds, **labels):
+        """Registra uma duração (em segundos) no cronômetro name."""
+        key = _key(name, labels)
+        with self.lock:
+            count, total, maximum = self.timers.get(key, (0, 0.0, 0.0))
+            self.timers[key] = (count + 1, total + seconds, max(maximum, seconds))
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Mede o tempo do bloco with e registra no cronômetro name."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def counter(self, name, **labels):
+        """Valor atual de um contador (0 se nunca foi incrementado)."""
+        with self.lock:
+            return self.counters.get(_key(name, labels), 0)
+
+    def reset(self):
+        """Zera todas as séries."""
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.timers.clear()
+
+    def snapshot(self):
+        """Cópia das séries como dicionário serializável em JSON."""
+        with self.lock:
+            return {
+                'time': time.time(),
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in self.counters.items()],
+                'gauges': [{'name': name, 'labels': dict(labels), 'value': value}
+                           for (name, labels), value in self.gauges.items()],
+                'timers': [{'name': name, 'labels': dict(labels), 'count': count, 'sum': total, 'max': maximum}
+                           for (name, labels), (count, total, maximum) in self.timers.items()],
+            }
+
+    def write_jsonl(self, path):
+        """Acrescenta uma linha com o estado atual ao arquivo JSON lines."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as metrics_file:
+            metrics_file.write(json.dumps(self.snapshot()) + '\n')
+
+    def write_prometheus(self, path):
+        """Grava o estado atual no formato de texto do Prometheus (para o textfile collector do node_exporter).
+
+        O arquivo é substituído atomicamente, então o coletor nunca lê uma gravação pela metade.
+        """
+        lines = []
+        with self.lock:
+            series = (
+                ('counter', sorted(self.counters.items())),
+                ('gauge', sorted(self.gauges.items())),
+            )
+            timers = sorted(self.timers.items())
+        for kind, items in series:
+            declared = set()
+            for (name, labels), value in items:
+                full_name = metric_prefix + name
+                if full_name not in declared:
+                    lines.append(f"# TYPE {full_name} {kind}")
+                    declared.add(full_name)
+                lines.append(f"{full_name}{_label_text(labels)} {value}")
+        # Cronômetros: um summary (total e soma) e um medidor separado com o máximo
+        declared = set()
+        for (name, labels), (count, total, maximum) in timers:
+            full_name = metric_prefix + name
+            if full_name not in declared:
+                lines.append(f"# TYPE {full_name} summary")
+                declared.add(full_name)
+            lines.append(f"{full_name}_count{_label_text(labels)} {count}")
+            lines.append(f"{full_name}_sum{_label_text(labels)} {total}")
+        declared = set()
+        for (name, labels), (count, total, maximum) in timers:
+            full_name = f"{metric_prefix}{name}_max"
+            if full_name not in declared:
+                lines.append(f"# TYPE {full_name} gauge")
+                declared.add(full_name)
+            lines.append(f"{full_name}{_label_text(labels)} {maximum}")
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as metrics_file:
+            metrics_file.write('\n'.join(lines) + '\n')
+        os.replace(temporary, path)
+
+    def export(self, path, metrics_format='jsonl'):
+        """Exporta no formato pedido: 'jsonl' ou 'prometheus'."""
+        if metrics_format == 'prometheus':
+            self.write_prometheus(path)
+        else:
+            self.write_jsonl(path)
+
+
+# Registro único do processo, usado pelas funções com tenacity e pelos estágios do pipeline
+metrics = Metrics()
+
+
+def count_retries(operation):
+    """Callback before_sleep do tenacity que conta cada nova tentativa da operação."""
+    def before_sleep(retry_state):
+        metrics.increment('retries_total', operation=operation)
+    return before_sleep
+
+
+def update_pass_ratio(registry=metrics):
+    """Atualiza o medidor pass_ratio: fração dos granulos filtrados (aprovados + rejeitados) que passou no filtro."""
+    with registry.lock:
+        totals = {}
+        for (name, labels), value in registry.counters.items():
+            if name == 'granules_total':
+                result = dict(labels).get('result')
+                totals[result] = totals.get(result, 0) + value
+    decided = totals.get('passed', 0) + totals.get('rejected', 0)
+    if decided:
+        registry.set_gauge('pass_ratio', totals.get('passed', 0) / decided)
+
+
+class MetricsExporter:
+    """Thread que exporta o registro a cada interval segundos e uma última vez no stop().
+
+    sample, se dado, é chamado antes de cada exportação para atualizar medidores (ex.: profundidade das filas).
+    """
+
+    def __init__(self, path, metrics_format='jsonl', interval=10.0, sample=None, registry=metrics):
+        self.path = path
+        self.metrics_format = metrics_format
+        self.interval = interval
+        self.sample = sample
+        self.registry = registry
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='metricas', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _export(self):
+        if self.sample is not None:
+            self.sample()
+        self.registry.export(self.path, self.metrics_format)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self._export()
+            except OSError as e:
+                print(f"Erro ao exportar as métricas para {self.path}: {e}")
+
+    def stop(self):
+        """Para a thread e grava o estado final."""
+        self.stopped.set()
+        self.thread.join()
+        self._export()
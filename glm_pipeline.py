@@ -0,0 +1,312 @@
+import os
+import time
+import queue
+import threading
+import concurrent.futures
+import s3fs
+import tenacity
+from glm_filter import probe_coordinates, write_bytes
+from glm_listing import bucket_root, safe_ls, hour_prefix, listing_hours
+from glm_time import granule_times, overlaps
+from glm_regions import bbox_region, union_bbox, filter_buffer_regions, flash_columns_regions
+from glm_cache import open_cache
+from glm_metrics import metrics, count_retries, update_pass_ratio, MetricsExporter
+
+# Marcador de fim de fila entre os estágios
+_FIM = object()
+
+
+@tenacity.retry(
+    retry=tenacity.retry_if_exception_type(OSError),
+    wait=tenacity.wait_exponential(multiplier=1, min=2, max=10),
+    stop=tenacity.stop_after_attempt(5),
+    before_sleep=count_retries('cat'),
+    reraise=True
+)
+def safe_cat(fs, remote_path):
+    """Função segura para baixar o conteúdo de um arquivo para a memória usando tenacity."""
+    with metrics.timer('request_seconds', operation='cat'):
+        content = fs.cat_file(remote_path)
+    metrics.increment('bytes_downloaded_total', len(content))
+    return content
+
+
+def resolve_workers(value):
+    """Converte a configuração de workers ('auto' ou um inteiro) no número de processos a usar."""
+    if value == 'auto':
+        return os.cpu_count() or 1
+    return int(value)
+
+
+def filter_granule(buffer, regions, file_name, crop, cache_directory=None):
+    """Decodifica e filtra (ou recorta) um granulo em memória contra todas as regiões. Roda dentro dos processos do pool de filtro.
+
+    Com cache_directory, os flashes decodificados das saídas vão para o cache de flashes do processo.
+    """
+    cache = open_cache(cache_directory) if cache_directory else None
+    return filter_buffer_regions(buffer, regions, file_name, crop, cache)
+
+
+def extract_granule(buffer, regions, file_name):
+    """Decodifica um granulo em memória e extrai as colunas por flash de cada região. Roda dentro dos processos do pool de filtro."""
+    return flash_columns_regions(buffer, regions, file_name)
+
+
+def _run_stage(name, function, input_queue, output_queue, workers, consumers, timings=None, errors=None):
+    """Roda `workers` threads que consomem input_queue e põem em output_queue tudo o que `function` gerar.
+
+    Quando todas as threads terminam, envia um marcador de fim para cada um dos `consumers` do próximo estágio.
+    O tempo de trabalho de cada item (sem a espera nas filas) vai para o cronômetro stage_seconds do
+    registro de métricas e, com uma lista em timings, também é acrescentado nela. Um item que falha é
+    contado em stage_errors_total e, com uma lista em errors, acrescentado nela.
+    Retorna a thread coordenadora, que termina junto com o estágio.
+    """
+    def worker():
+        while True:
+            item = input_queue.get()
+            if item is _FIM:
+                break
+            busy = 0.0
+            started = time.perf_counter()
+            try:
+                for result in function(item):
+                    busy += time.perf_counter() - started
+                    if output_queue is not None:
+                        output_queue.put(result)  # Bloqueia se o próximo estágio estiver atrasado
+                    started = time.perf_counter()
+            except Exception as e:
+                metrics.increment('stage_errors_total', stage=name)
+                print(f"Erro no estágio {name} ao processar {item}: {e}")
+                if errors is not None:
+                    errors.append((name, item))
+            busy += time.perf_counter() - started
+            metrics.observe('stage_seconds', busy, stage=name)
+            if timings is not None:
+                timings.append(busy)
+
+    threads = [threading.Thread(target=worker, name=f"{name}-{i}", daemon=True) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    def finish():
+        for thread in threads:
+            thread.join()
+        if output_queue is not None:
+            for _ in range(consumers):
+                output_queue.put(_FIM)
+
+    coordinator = threading.Thread(target=finish, name=f"{name}-fim", daemon=True)
+    coordinator.start()
+    return coordinator
+
+
+def run_pipeline(start, end, bbox, output_directory, fs=None, root=bucket_root,
+                 probe=False, crop=False, list_workers=2, fetch_workers=16, filter_workers=4,
+                 write_workers=2, queue_size=64, filter_processes=0, manifest=None, negative_cache=None,
+                 listing_cache=None, regions=None, flash_store=None, flash_cache_directory=None, timings=None,
+                 quiet=False, metrics_path=None, metrics_format='jsonl', metrics_interval=10.0):
+    """Executa o pipeline listagem → download → filtro → gravação sobre o intervalo [start, end).
+
+    Só as horas que intersectam o intervalo são listadas (mais a anterior, se um granulo dela pode
+    atravessar o início), e só os granulos cujo tempo (início/fim no
+    nome do arquivo) intersecta o intervalo são baixados.
+
+    Os estágios são ligados por filas limitadas (backpressure) e cada um tem sua própria concorrência,
+    então a listagem do próximo dia corre enquanto o anterior ainda está sendo baixado e filtrado.
+    Com filter_processes > 0 (ou 'auto', um por núcleo), a decodificação HDF5 e o filtro rodam em um
+    pool de processos alimentado pelas threads de filtro, fora do GIL.
+    Com um Manifest, granulos já processados são pulados e cada resultado é registrado nele; com um
+    NegativeCache, granulos sabidamente sem flashes no bbox nem chegam a ser baixados; com um
+    ListingCache, horas já fechadas são lidas do índice local em vez de listadas no bucket.
+
+    Com uma lista de regiões (glm_regions.load_regions), cada granulo é baixado uma única vez e testado
+    contra todas elas; a saída de cada região vai para output_directory/<região>/<data>/. Sem regiões,
+    usa só o bbox e grava em output_directory/<data>/.
+
+    Com um FlashStore (glm_columnar), em vez de um NetCDF por granulo, os flashes de cada região são
+    acrescentados ao armazenamento colunar particionado por data/hora; o granulo só é marcado no
+    manifesto depois que as suas colunas foram gravadas em disco.
+
+    Com flash_cache_directory, os flashes decodificados durante o filtro são guardados no cache de
+    flashes (glm_cache), para as ferramentas de análise não decodificarem os mesmos arquivos de novo.
+
+    Com um dicionário em timings, cada estágio acrescenta em timings[nome] o tempo de trabalho de cada item.
+
+    Tempos por estágio e por requisição, bytes baixados e gravados, novas tentativas do tenacity,
+    profundidade das filas e granulos aprovados/rejeitados vão para o registro glm_metrics.metrics;
+    com metrics_path, ele é exportado a cada metrics_interval segundos e no fim, em JSON lines ou no
+    formato de texto do Prometheus (metrics_format). Com quiet, as mensagens por arquivo não são impressas.
+
+    Retorna o número de itens que falharam em algum estágio nesta execução; eles não são registrados no
+    manifesto, então uma nova execução tenta de novo.
+    """
+    log = (lambda message: None) if quiet else print
+    if regions is None:
+        regions = [bbox_region(bbox)]
+    probe_bbox = union_bbox(regions)
+    if fs is None:
+        fs = s3fs.S3FileSystem(anon=True)
+
+    filter_processes = resolve_workers(filter_processes)
+    pool = None
+    if filter_processes > 0:
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=filter_processes)
+        # Duas threads por processo mantêm o pool ocupado enquanto os buffers são serializados
+        filter_workers = 2 * filter_processes
+
+    def list_stage(hour_start):
+        if listing_cache is not None:
+            entries = listing_cache.list_hour(hour_start)
+        else:
+            prefix = hour_prefix(hour_start, root)
+            try:
+                entries = safe_ls(fs, prefix, detail=True)
+            except FileNotFoundError:
+                print(f"Prefixo {prefix} não encontrado no bucket. Pulando...")
+                return
+        for entry in entries:
+            if 'start' in entry:
+                granule_start, granule_end = entry['start'], entry['end']
+            else:
+                try:
+                    granule_start, granule_end, _ = granule_times(entry['name'])
+                except ValueError:
+                    continue  # Ignora objetos que não são granulos GLM
+            if not overlaps(granule_start, granule_end, start, end):
+                continue
+            granule = {
+                'date': hour_start,
+                'key': entry['name'],
+                'size': entry.get('size'),
+                'etag': entry.get('ETag'),
+            }
+            # Com o manifesto, só segue adiante o que ainda não foi processado (ou mudou no bucket)
+            if manifest is not None and manifest.is_done(granule['key'], granule['size'], granule['etag']):
+                metrics.increment('granules_total', result='skipped')
+                continue
+            if negative_cache is not None and all(
+                negative_cache.is_known_empty(granule['key'], region['bbox']) for region in regions
+            ):
+                reject(granule, reason='negative_cache')
+                continue
+            metrics.increment('granules_total', result='listed')
+            yield granule
+
+    def reject(granule, empty_bboxes=(), reason='filter'):
+        """Registra um granulo sem flashes nas regiões no manifesto e os bboxes vazios no cache negativo."""
+        metrics.increment('granules_total', result='rejected', reason=reason)
+        if manifest is not None:
+            manifest.record(granule['key'], granule['size'], granule['etag'], passed=False)
+        if negative_cache is not None:
+            for empty_bbox in empty_bboxes:
+                negative_cache.add(granule['key'], empty_bbox)
+
+    def fetch_stage(granule):
+        # No modo sonda, lê só flash_lat/flash_lon por faixa de bytes antes de baixar
+        if probe and not probe_coordinates(fs, granule['key'], probe_bbox):
+            reject(granule, [region['bbox'] for region in regions], reason='probe')
+            return
+        log(f"Baixando: {granule['key']}")
+        granule['buffer'] = safe_cat(fs, granule['key'])
+        yield granule
+
+    def filter_stage(granule):
+        file_name = granule['key'].split('/')[-1]
+        buffer = granule.pop('buffer')
+        if flash_store is not None:
+            function, arguments = extract_granule, (buffer, regions, file_name)
+        else:
+            function, arguments = filter_granule, (buffer, regions, file_name, crop, flash_cache_directory)
+        if pool is not None:
+            outputs, empty_bboxes = pool.submit(function, *arguments).result()
+        else:
+            outputs, empty_bboxes = function(*arguments)
+        if not outputs:
+            reject(granule, empty_bboxes)
+            return
+        if negative_cache is not None:
+            for empty_bbox in empty_bboxes:
+                negative_cache.add(granule['key'], empty_bbox)
+        granule['file_name'] = file_name
+        granule['outputs'] = outputs
+        yield granule
+
+    store_lock = threading.Lock()
+
+    def stored(granules):
+        """Registra no manifesto os granulos cujas colunas já foram gravadas em todas as regiões."""
+        for granule in granules:
+            with store_lock:
+                granule['pending'] -= 1
+                done = granule['pending'] == 0
+            if done and manifest is not None:
+                manifest.record(granule['key'], granule['size'], granule['etag'], passed=True, output=flash_store.root)
+
+    def store_stage(granule):
+        outputs = granule.pop('outputs')
+        granule['pending'] = len(outputs)
+        for region_name, columns in outputs.items():
+            stored(flash_store.append(region_name, columns, token=granule))
+        metrics.increment('granules_total', result='passed')
+        log(f"Eventos dentro do filtro encontrados em {granule['file_name']}. Acrescentados a {flash_store.root}")
+        return ()
+
+    def write_stage(granule):
+        local_file_paths = []
+        for region_name, content in granule.pop('outputs').items():
+            region_directory = os.path.join(output_directory, region_name) if region_name else output_directory
+            local_file_path = os.path.join(region_directory, granule['date'].strftime('%Y-%m-%d'), granule['file_name'])
+            write_bytes(local_file_path, content)
+            metrics.increment('bytes_written_total', len(content))
+            local_file_paths.append(local_file_path)
+        if manifest is not None:
+            manifest.record(granule['key'], granule['size'], granule['etag'], passed=True, output=';'.join(local_file_paths))
+        metrics.increment('granules_total', result='passed')
+        log(f"Eventos dentro do filtro encontrados em {granule['file_name']}. Gravado em {', '.join(local_file_paths)}")
+        return ()
+
+    prefix_queue = queue.Queue()
+    file_queue = queue.Queue(maxsize=queue_size)
+    buffer_queue = queue.Queue(maxsize=queue_size)
+    output_queue = queue.Queue(maxsize=queue_size)
+
+    if timings is not None:
+        for name in ('listagem', 'download', 'filtro', 'gravacao'):
+            timings.setdefault(name, [])
+    stage_timings = timings.get if timings is not None else (lambda name: None)
+    errors = []
+
+    stages = [
+        _run_stage('listagem', list_stage, prefix_queue, file_queue, list_workers, fetch_workers, stage_timings('listagem'), errors),
+        _run_stage('download', fetch_stage, file_queue, buffer_queue, fetch_workers, filter_workers, stage_timings('download'), errors),
+        _run_stage('filtro', filter_stage, buffer_queue, output_queue, filter_workers, write_workers, stage_timings('filtro'), errors),
+        _run_stage('gravacao', store_stage if flash_store is not None else write_stage, output_queue, None, write_workers, 0,
+                   stage_timings('gravacao'), errors),
+    ]
+
+    queues = {'horas': prefix_queue, 'granulos': file_queue, 'buffers': buffer_queue, 'saidas': output_queue}
+
+    def sample():
+        """Atualiza a profundidade das filas e a fração de granulos aprovados no filtro."""
+        for queue_name, stage_queue in queues.items():
+            metrics.set_gauge('queue_depth', stage_queue.qsize(), queue=queue_name)
+        update_pass_ratio()
+
+    exporter = MetricsExporter(metrics_path, metrics_format, metrics_interval, sample).start() if metrics_path else None
+
+    for hour_start in listing_hours(start, end):
+        prefix_queue.put(hour_start)
+    for _ in range(list_workers):
+        prefix_queue.put(_FIM)
+
+    try:
+        for stage in stages:
+            stage.join()
+    finally:
+        if flash_store is not None:
+            stored(flash_store.flush())
+        if pool is not None:
+            pool.shutdown()
+        if exporter is not None:
+            exporter.stop()
+    return len(errors)
@@ -0,0 +1,168 @@
+import json
+import numpy as np
+from netCDF4 import Dataset, num2date
+from glm_filter import copy_cropped, crop_indices_from_mask
+
+# Registro padrão das regiões de interesse
+regions_path = "regions.json"
+
+
+def load_regions(path=regions_path, names=None):
+    """Lê o registro de regiões (nome → {"bbox": [lon_min, lon_max, lat_min, lat_max]} ou {"polygon": [[lon, lat], ...]}).
+
+    Retorna uma lista de dicionários com 'name', 'bbox' e 'polygon' (None para regiões retangulares).
+    """
+    with open(path, encoding='utf-8') as config_file:
+        config = json.load(config_file)
+
+    regions = []
+    for name, definition in config.items():
+        if names and name not in names:
+            continue
+        polygon = definition.get('polygon')
+        if polygon is not None:
+            points = np.asarray(polygon, dtype=float)
+            bbox = (points[:, 0].min(), points[:, 0].max(), points[:, 1].min(), points[:, 1].max())
+        else:
+            bbox = tuple(definition['bbox'])
+        regions.append({'name': name, 'bbox': tuple(float(value) for value in bbox), 'polygon': polygon})
+
+    missing = set(names or ()) - {region['name'] for region in regions}
+    if missing:
+        raise KeyError(f"Regiões não encontradas em {path}: {', '.join(sorted(missing))}")
+    return regions
+
+
+def bbox_region(bbox, name=None):
+    """Monta uma região retangular a partir de um bbox (lon_min, lon_max, lat_min, lat_max)."""
+    return {'name': name, 'bbox': tuple(bbox), 'polygon': None}
+
+
+def union_bbox(regions):
+    """Retorna o menor bbox que contém todas as regiões."""
+    bounds = np.array([region['bbox'] for region in regions])
+    return (bounds[:, 0].min(), bounds[:, 1].max(), bounds[:, 2].min(), bounds[:, 3].max())
+
+
+def points_in_polygon(longitudes, latitudes, polygon):
+    """Teste ponto-em-polígono (ray casting) vetorizado sobre os pontos; o laço é só sobre as arestas."""
+    vertices = np.asarray(polygon, dtype=float)
+    inside = np.zeros(longitudes.shape, dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for (x0, y0), (x1, y1) in zip(vertices, np.roll(vertices, -1, axis=0)):
+            crosses = (y0 > latitudes) != (y1 > latitudes)
+            x_cross = x0 + (latitudes - y0) * (x1 - x0) / (y1 - y0)
+            inside ^= crosses & (longitudes < x_cross)
+    return inside
+
+
+def region_masks(longitudes, latitudes, regions):
+    """Testa todos os pontos contra todas as regiões de uma vez.
+
+    Retorna (masks, bbox_hits): masks tem forma (regiões, pontos) e bbox_hits diz, por região, se algum
+    ponto caiu no bbox dela (para regiões poligonais o bbox pode ter pontos sem que o polígono tenha).
+    """
+    longitudes = np.ma.filled(np.ma.asarray(longitudes, dtype=float), np.nan)
+    latitudes = np.ma.filled(np.ma.asarray(latitudes, dtype=float), np.nan)
+    bounds = np.array([region['bbox'] for region in regions], dtype=float)
+
+    masks = (
+        (longitudes[None, :] >= bounds[:, 0, None]) & (longitudes[None, :] <= bounds[:, 1, None]) &
+        (latitudes[None, :] >= bounds[:, 2, None]) & (latitudes[None, :] <= bounds[:, 3, None])
+    )
+    bbox_hits = masks.any(axis=1)
+
+    for index, region in enumerate(regions):
+        if region['polygon'] is not None and bbox_hits[index]:
+            candidates = np.flatnonzero(masks[index])
+            masks[index, candidates] = points_in_polygon(longitudes[candidates], latitudes[candidates], region['polygon'])
+
+    return masks, bbox_hits
+
+
+def filter_buffer_regions(buffer, regions, name='granule.nc', crop=False, cache=None):
+    """Filtra um granulo em memória contra várias regiões numa única passada sobre flash_lat/flash_lon.
+
+    Retorna (outputs, empty_bboxes): outputs mapeia o nome de cada região atingida para os bytes a gravar
+    (o granulo recortado, com crop=True, ou o granulo inteiro); empty_bboxes lista os bboxes sem nenhum flash.
+    Com um FlashCache (glm_cache), os flashes já decodificados de cada saída são guardados nele.
+    """
+    outputs = {}
+    with Dataset(name, 'r', memory=buffer) as source:
+        masks, bbox_hits = region_masks(source.variables['flash_lon'][:], source.variables['flash_lat'][:], regions)
+        hits = [(region, mask) for region, mask in zip(regions, masks) if mask.any()]
+
+        if crop:
+            indices = [(region, crop_indices_from_mask(source, mask)) for region, mask in hits]
+            # Decodifica antes de copiar: copy_cropped desliga a decodificação automática do source
+            decoded = [flash_columns(source, mask) for _, mask in hits] if cache is not None else None
+            for position, (region, region_indices) in enumerate(indices):
+                target = Dataset(name, 'w', memory=len(buffer), format='NETCDF4')
+                copy_cropped(source, target, region_indices)
+                outputs[region['name']] = bytes(target.close())
+                if cache is not None:
+                    cache.put(name, cache.digest(outputs[region['name']]), decoded[position])
+        else:
+            for region, _ in hits:
+                outputs[region['name']] = buffer
+            if cache is not None and hits:
+                cache.put(name, cache.digest(buffer), flash_columns(source, np.ones(len(masks[0]), dtype=bool)))
+
+    empty_bboxes = [region['bbox'] for region, hit in zip(regions, bbox_hits) if not hit]
+    return outputs, empty_bboxes
+
+
+# Colunas por flash extraídas para o armazenamento colunar (coluna → variável do LCFA)
+flash_variables = {
+    'flash_id': 'flash_id',
+    'flash_time': 'flash_time_offset_of_first_event',
+    'flash_end_time': 'flash_time_offset_of_last_event',
+    'flash_lat': 'flash_lat',
+    'flash_lon': 'flash_lon',
+    'flash_energy': 'flash_energy',
+    'flash_area': 'flash_area',
+    'flash_quality_flag': 'flash_quality_flag',
+}
+
+
+def _decode_time(variable, values):
+    """Converte valores 'segundos desde X' em datetime64[us]."""
+    reference = num2date(0, variable.units, only_use_cftime_datetimes=False, only_use_python_datetimes=True)
+    seconds = np.ma.filled(np.ma.asarray(values, dtype='f8'), np.nan)
+    return np.datetime64(reference, 'us') + np.round(seconds * 1e6).astype('i8').astype('timedelta64[us]')
+
+
+def flash_columns(dataset, mask):
+    """Extrai as colunas por flash (tempo, posição, energia, área, qualidade) dos flashes selecionados pela máscara."""
+    columns = {}
+    for column, variable_name in flash_variables.items():
+        if variable_name not in dataset.variables:
+            continue
+        variable = dataset.variables[variable_name]
+        values = variable[:][mask]
+        if ' since ' in getattr(variable, 'units', ''):
+            columns[column] = _decode_time(variable, values)
+        elif values.dtype.kind == 'f':
+            columns[column] = np.ma.filled(values.astype('f4'), np.nan)
+        else:
+            columns[column] = np.ma.filled(values, -1)
+    return columns
+
+
+def flash_columns_regions(buffer, regions, name='granule.nc'):
+    """Como filter_buffer_regions, mas devolve as colunas por flash de cada região em vez de bytes NetCDF.
+
+    Retorna (outputs, empty_bboxes): outputs mapeia o nome de cada região atingida para um dicionário
+    coluna → array NumPy, com o nome do granulo de origem na coluna 'granule'.
+    """
+    outputs = {}
+    with Dataset(name, 'r', memory=buffer) as source:
+        masks, bbox_hits = region_masks(source.variables['flash_lon'][:], source.variables['flash_lat'][:], regions)
+        for region, mask in zip(regions, masks):
+            if mask.any():
+                columns = flash_columns(source, mask)
+                columns['granule'] = np.full(int(mask.sum()), name, dtype=object)
+                outputs[region['name']] = columns
+
+    empty_bboxes = [region['bbox'] for region, hit in zip(regions, bbox_hits) if not hit]
+    return outputs, empty_bboxes
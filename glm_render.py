@@ -0,0 +1,57 @@
+import numpy as np
+import matplotlib.colors as mcolors
+import cartopy.crs as ccrs
+
+# Menor lado de célula (em pixels) para desenhar bordas e rótulos legíveis
+edge_min_pixels = 6
+label_min_pixels = 24
+
+
+def axes_pixels(ax):
+    """Tamanho (largura, altura) da área de desenho dos eixos em pixels."""
+    extent = ax.get_window_extent()
+    return int(round(extent.width)), int(round(extent.height))
+
+
+def cell_pixels(ax, shape):
+    """Menor lado, em pixels, de uma célula de uma grade (linhas, colunas) que ocupa os eixos inteiros."""
+    width, height = axes_pixels(ax)
+    rows, columns = shape
+    return min(width / columns, height / rows)
+
+
+def draw_grid(ax, lat_bins, lon_bins, counts, cmap='coolwarm', labels=None, fontsize=8):
+    """Desenha a grade de contagens como um único pcolormesh.
+
+    Bordas só aparecem quando as células têm pelo menos edge_min_pixels, e os rótulos com as contagens
+    só quando cabem (label_min_pixels); labels=True/False força a escolha.
+    """
+    size = cell_pixels(ax, counts.shape)
+    mesh = ax.pcolormesh(
+        lon_bins, lat_bins, counts, cmap=cmap, vmin=0, vmax=max(counts.max(), 1), shading='flat',
+        edgecolors='black' if size >= edge_min_pixels else 'none', linewidth=0.5,
+        transform=ccrs.PlateCarree(), rasterized=size < edge_min_pixels
+    )
+
+    if labels is None:
+        labels = size >= label_min_pixels
+    if labels:
+        lon_centers = (lon_bins[:-1] + lon_bins[1:]) / 2
+        lat_centers = (lat_bins[:-1] + lat_bins[1:]) / 2
+        for i, j in np.ndindex(counts.shape):
+            ax.text(lon_centers[j], lat_centers[i], int(counts[i, j]), ha='center', va='center',
+                    transform=ccrs.PlateCarree(), fontsize=fontsize, color='black')
+    return mesh
+
+
+def draw_density(ax, counts, bbox, cmap='inferno', alpha=1.0):
+    """Desenha uma grade fina de contagens (ex.: um pixel por célula) como imagem, em escala logarítmica.
+
+    Substitui o scatter de cada flash: o custo depende do tamanho da imagem, não do número de pontos.
+    Células sem flashes ficam transparentes.
+    """
+    lon_min, lon_max, lat_min, lat_max = bbox
+    masked = np.ma.masked_less_equal(counts, 0)
+    norm = mcolors.LogNorm(vmin=1, vmax=max(counts.max(), 1)) if masked.count() else None
+    return ax.imshow(masked, origin='lower', extent=[lon_min, lon_max, lat_min, lat_max], cmap=cmap, norm=norm,
+                     alpha=alpha, interpolation='nearest', transform=ccrs.PlateCarree())
@@ -0,0 +1,177 @@
+import os
+import csv
+import sys
+import argparse
+from datetime import timedelta
+import numpy as np
+from scipy.spatial import cKDTree
+from glm_time import window_start, parse_moment
+from glm_index import FlashIndex, input_directory, index_directory
+
+# Raio médio da Terra em km
+earth_radius = 6371.0088
+
+# Lista padrão de estações (CSV com as colunas id, lat, lon)
+stations_path = "stations.csv"
+
+# Séries de atributos por estação
+features_path = "data/goes16/glm_station_features.csv"
+
+
+def load_stations(path=stations_path):
+    """Lê o CSV de estações. Retorna (ids, latitudes, longitudes)."""
+    with open(path, newline='', encoding='utf-8') as stations_file:
+        rows = list(csv.DictReader(stations_file))
+    ids = [row['id'] for row in rows]
+    latitudes = np.array([float(row['lat']) for row in rows])
+    longitudes = np.array([float(row['lon']) for row in rows])
+    return ids, latitudes, longitudes
+
+
+def unit_vectors(latitudes, longitudes):
+    """Converte lat/lon em graus para pontos (x, y, z) na esfera unitária."""
+    latitudes = np.radians(np.asarray(latitudes, dtype='f8'))
+    longitudes = np.radians(np.asarray(longitudes, dtype='f8'))
+    cos_latitudes = np.cos(latitudes)
+    return np.column_stack((cos_latitudes * np.cos(longitudes), cos_latitudes * np.sin(longitudes), np.sin(latitudes)))
+
+
+def chord_length(distance_km):
+    """Corda na esfera unitária equivalente a uma distância em km sobre a superfície (grande círculo)."""
+    return 2 * np.sin(np.asarray(distance_km, dtype='f8') / (2 * earth_radius))
+
+
+def stations_bbox(latitudes, longitudes, radius_km):
+    """Bbox que contém todas as estações com uma margem de radius_km."""
+    margin_lat = np.degrees(radius_km / earth_radius)
+    margin_lon = margin_lat / max(np.cos(np.radians(np.abs(latitudes).max() + margin_lat)), 1e-6)
+    return (longitudes.min() - margin_lon, longitudes.max() + margin_lon,
+            latitudes.min() - margin_lat, latitudes.max() + margin_lat)
+
+
+class ProximityFeatures:
+    """Número de flashes a até R km de cada estação nos últimos N minutos, em vários raios e janelas.
+
+    Os flashes são acrescentados em lotes: cada lote vira uma KD-tree (pontos na esfera unitária)
+    cruzada de uma vez com a árvore das estações, o que dá todos os pares flash-estação dentro do maior
+    raio. Cada par soma +1/-1 numa série de diferenças nos passos em que o flash está dentro da janela,
+    e a soma acumulada no fim dá as contagens; o custo cresce com os pares, não com estações × flashes × passos.
+    """
+
+    def __init__(self, latitudes, longitudes, start, end, step_minutes=10, radii_km=(10, 20, 50), windows_minutes=(10, 30, 60)):
+        self.radii_km = tuple(radii_km)
+        self.windows_minutes = tuple(windows_minutes)
+        self.step_minutes = step_minutes
+        self.start = window_start(start, step_minutes)
+        steps = int(np.ceil((end - self.start) / timedelta(minutes=step_minutes)))
+        # Instantes das séries: o fim de cada passo; a janela de N minutos de um instante T é (T - N, T]
+        self.times = np.datetime64(self.start, 'us') + np.arange(1, steps + 1) * np.timedelta64(step_minutes, 'm')
+        self.station_tree = cKDTree(unit_vectors(latitudes, longitudes))
+        self.radii_chords = chord_length(self.radii_km)
+        # Uma posição extra por série recebe os -1 que caem depois do último passo
+        self.differences = np.zeros((len(latitudes), len(self.radii_km), len(self.windows_minutes), steps + 1), dtype='i4')
+
+    def add(self, times, latitudes, longitudes):
+        """Acrescenta um lote de flashes (tempos datetime64 e posições em graus)."""
+        if len(times) == 0:
+            return
+        times = np.asarray(times, dtype='datetime64[us]')
+        valid = ~np.isnat(times) & np.isfinite(latitudes) & np.isfinite(longitudes)
+        if not valid.any():
+            return
+        times, latitudes, longitudes = times[valid], np.asarray(latitudes)[valid], np.asarray(longitudes)[valid]
+
+        flash_tree = cKDTree(unit_vectors(latitudes, longitudes))
+        pairs = flash_tree.sparse_distance_matrix(self.station_tree, self.radii_chords.max(), output_type='ndarray')
+        if len(pairs) == 0:
+            return
+        flashes, stations, chords = pairs['i'], pairs['j'], pairs['v']
+
+        steps = self.differences.shape[-1] - 1
+        step = np.timedelta64(self.step_minutes, 'm')
+        # O flash entra nos instantes T_k = início + (k + 1) * passo com t <= T_k < t + N
+        elapsed = (times[flashes] - np.datetime64(self.start, 'us')) / step
+        first = np.clip(np.ceil(elapsed - 1).astype('i8'), 0, steps)
+        shape = self.differences.shape
+        for radius_index, radius_chord in enumerate(self.radii_chords):
+            inside = chords <= radius_chord
+            for window_index, window_minutes in enumerate(self.windows_minutes):
+                last = np.clip(np.ceil(elapsed[inside] + window_minutes / self.step_minutes - 1).astype('i8'), 0, steps)
+                base = (stations[inside] * shape[1] + radius_index) * shape[2] + window_index
+                np.add.at(self.differences.reshape(-1), base * shape[3] + first[inside], 1)
+                np.add.at(self.differences.reshape(-1), base * shape[3] + last, -1)
+
+    def counts(self):
+        """Contagens com forma (estações, raios, janelas, instantes)."""
+        return np.cumsum(self.differences, axis=-1)[..., :-1]
+
+    def column_names(self):
+        return [f"flashes_{radius:g}km_{window}min" for radius in self.radii_km for window in self.windows_minutes]
+
+    def write_csv(self, path, station_ids):
+        """Grava as séries no formato longo: uma linha por estação e instante, uma coluna por raio e janela."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        counts = self.counts()
+        times = self.times.astype('datetime64[s]').astype(str)
+        with open(path + '.part', 'w', newline='', encoding='utf-8') as output_file:
+            writer = csv.writer(output_file)
+            writer.writerow(['station_id', 'time'] + self.column_names())
+            for station_index, station_id in enumerate(station_ids):
+                values = counts[station_index].reshape(-1, len(times)).T
+                for time_text, row in zip(times, values):
+                    writer.writerow([station_id, time_text, *row.tolist()])
+        os.replace(path + '.part', path)
+
+
+def extract_features(stations_file, start, end, step_minutes=10, radii_km=(10, 20, 50), windows_minutes=(10, 30, 60),
+                     output=features_path, root=input_directory, index_path=index_directory, region=None):
+    """Calcula as séries de proximidade das estações em [start, end), lendo os flashes do índice dia a dia.
+
+    Com region, só os granulos de root/<region>/ são lidos, para regiões sobrepostas não contarem o
+    mesmo flash duas vezes.
+    """
+    station_ids, latitudes, longitudes = load_stations(stations_file)
+    features = ProximityFeatures(latitudes, longitudes, start, end, step_minutes, radii_km, windows_minutes)
+    bbox = stations_bbox(latitudes, longitudes, max(radii_km))
+
+    index = FlashIndex(index_path)
+    index.update(root)
+    # A primeira janela olha até max(windows_minutes) antes do início
+    day = start - timedelta(minutes=max(windows_minutes))
+    while day < end:
+        day_end = min(day + timedelta(days=1), end)
+        flashes = index.query(bbox, day, day_end, columns=('flash_time', 'flash_lat', 'flash_lon'), region=region)
+        features.add(flashes['flash_time'], flashes['flash_lat'], flashes['flash_lon'])
+        day = day_end
+    index.close()
+
+    features.write_csv(output, station_ids)
+    print(f"Séries de {len(station_ids)} estações gravadas em {output}.")
+    return features
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Extrai, por estação, o número de flashes a até R km nos últimos N minutos.')
+    parser.add_argument('-b', '--start', required=True, help='Início no formato YYYY-MM-DD ou YYYY-MM-DDTHH:MM[:SS] (UTC)')
+    parser.add_argument('-e', '--end', required=True, help='Término no formato YYYY-MM-DD (dia inteiro, inclusive) ou YYYY-MM-DDTHH:MM[:SS] (exclusivo)')
+    parser.add_argument('--stations', default=stations_path, help='CSV das estações com as colunas id, lat, lon')
+    parser.add_argument('-s', '--step', type=int, default=10, help='Passo das séries em minutos')
+    parser.add_argument('--radius', type=float, action='append', help='Raio em km (pode repetir; padrão 10, 20 e 50)')
+    parser.add_argument('--window', type=int, action='append', help='Janela em minutos (pode repetir; padrão 10, 30 e 60)')
+    parser.add_argument('-o', '--output', default=features_path, help='CSV de saída')
+    parser.add_argument('-i', '--input', default=input_directory, help='Diretório com os granulos filtrados (subdiretórios AAAA-MM-DD)')
+    parser.add_argument('--index', default=index_directory, help='Diretório do índice espaço-temporal')
+    parser.add_argument('-r', '--region', help='Lê só os granulos gravados no subdiretório desta região')
+    args = parser.parse_args(argv[1:])
+
+    start = parse_moment(args.start)
+    end = parse_moment(args.end, end=True)
+    assert start < end, "O início deve ser anterior ao término."
+
+    extract_features(args.stations, start, end, args.step, tuple(args.radius or (10, 20, 50)),
+                     tuple(args.window or (10, 30, 60)), output=args.output, root=args.input, index_path=args.index,
+                     region=args.region)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
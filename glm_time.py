@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta, timezone
+
+
+def parse_granule_time(field):
+    """Converte um campo de tempo do nome do granulo (ex.: 's20230130000000', ano + dia do ano + HHMMSS + décimo) em datetime."""
+    digits = field[1:]
+    return datetime.strptime(digits[:13], '%Y%j%H%M%S') + timedelta(seconds=int(digits[13:14] or 0) / 10)
+
+
+def granule_times(file_name):
+    """Retorna (início, fim, criação) de um granulo GLM a partir do nome OR_GLM-L2-LCFA_G16_s..._e..._c....nc."""
+    fields = file_name.split('/')[-1].rsplit('.', 1)[0].split('_')
+    start, end, created = (parse_granule_time(field) for field in fields[-3:])
+    return start, end, created
+
+
+def window_start(moment, minutes):
+    """Retorna o início da janela de `minutes` minutos (alinhada ao relógio) que contém `moment`."""
+    day = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    elapsed = (moment - day) // timedelta(minutes=minutes)
+    return day + elapsed * timedelta(minutes=minutes)
+
+
+def parse_moment(text, end=False):
+    """Interpreta uma data (YYYY-MM-DD) ou instante (YYYY-MM-DDTHH:MM[:SS], UTC) da linha de comando.
+
+    Com end=True, uma data sem horário significa o dia inteiro, ou seja, a meia-noite seguinte. Um
+    instante com fuso explícito (ex.: 2023-01-13T10:00-03:00) é convertido para UTC.
+    """
+    moment = datetime.fromisoformat(text.strip())
+    if end and len(text.strip()) == len('YYYY-MM-DD'):
+        moment += timedelta(days=1)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def overlaps(granule_start, granule_end, start, end):
+    """Diz se o granulo [granule_start, granule_end] intersecta o intervalo [start, end)."""
+    return granule_start < end and granule_end > start
@@ -0,0 +1,312 @@
+import os
+import sys
+import time
+import uuid
+import socket
+import sqlite3
+import argparse
+import threading
+import multiprocessing
+from datetime import datetime, timedelta
+from glm_time import parse_moment
+from glm_listing import listing_cache_path
+from glm_regions import load_regions, regions_path
+from glm_manifest import manifest_path, negative_cache_path
+from glm_columnar import store_directory
+from glm_cache import cache_directory
+
+# Fila padrão do backfill, ao lado dos dados
+queue_path = "data/goes16/glm_backfill.sqlite"
+
+
+def _timestamp(moment):
+    return moment.isoformat()
+
+
+class WorkQueue:
+    """Fila persistente (SQLite) de unidades de trabalho de um backfill, com posse por tempo limitado (lease).
+
+    O intervalo é dividido em unidades de unit_hours horas. Um worker toma a unidade pendente mais antiga
+    (ou uma cuja posse expirou) com um token próprio e renova a posse enquanto trabalha; se ele morrer,
+    a posse expira e a unidade volta a ser tomada por outro. Unidades concluídas ficam registradas, então
+    o backfill pode ser parado e retomado a qualquer momento. Depois de max_attempts tentativas, a
+    unidade fica como 'failed' até ser liberada com reset().
+
+    O modo WAL só funciona com todos os processos no mesmo host; com shared=True (workers em vários
+    hosts sobre um sistema de arquivos compartilhado), o banco usa o journal tradicional.
+    """
+
+    def __init__(self, path=queue_path, shared=False, max_attempts=3):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=120)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=DELETE" if shared else "PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS units (
+                    id INTEGER PRIMARY KEY,
+                    start TEXT NOT NULL,
+                    end TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    worker TEXT,
+                    token TEXT,
+                    lease_until REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    finished_at REAL,
+                    error TEXT,
+                    UNIQUE (start, end)
+                )"""
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS units_state_start ON units (state, start)")
+
+    def add_range(self, start, end, unit_hours=1):
+        """Divide [start, end) em unidades alinhadas a unit_hours horas e acrescenta as que ainda não existem."""
+        step = timedelta(hours=unit_hours)
+        moment = start.replace(minute=0, second=0, microsecond=0)
+        moment -= timedelta(hours=moment.hour % unit_hours)
+        rows = []
+        while moment < end:
+            rows.append((_timestamp(max(moment, start)), _timestamp(min(moment + step, end))))
+            moment += step
+        with self.lock, self.connection:
+            before = self.connection.total_changes
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO units (start, end, state) VALUES (?, ?, 'pending')", rows
+            )
+            return self.connection.total_changes - before
+
+    def claim(self, worker, lease_seconds=600):
+        """Toma a unidade pendente (ou com posse expirada) mais antiga. Retorna um dicionário, ou None se não há nenhuma."""
+        token = uuid.uuid4().hex
+        now = time.time()
+        with self.lock, self.connection:
+            # Um único UPDATE é atômico entre processos: só um worker fica com cada unidade
+            self.connection.execute(
+                """UPDATE units SET state = 'leased', worker = ?, token = ?, lease_until = ?, attempts = attempts + 1
+                   WHERE id = (
+                       SELECT id FROM units
+                       WHERE (state = 'pending' OR (state = 'leased' AND lease_until < ?)) AND attempts < ?
+                       ORDER BY start LIMIT 1
+                   )""",
+                (worker, token, now + lease_seconds, now, self.max_attempts)
+            )
+            row = self.connection.execute("SELECT id, start, end, attempts FROM units WHERE token = ?", (token,)).fetchone()
+            # Posses que expiraram na última tentativa não voltam mais para a fila
+            self.connection.execute(
+                "UPDATE units SET state = 'failed' WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                (now, self.max_attempts)
+            )
+        if row is None:
+            return None
+        return {'id': row[0], 'start': datetime.fromisoformat(row[1]), 'end': datetime.fromisoformat(row[2]),
+                'attempts': row[3], 'token': token}
+
+    def next_expiry(self):
+        """Instante (time.time()) em que vence a primeira posse ainda ativa, ou None se nenhuma unidade está tomada."""
+        with self.lock:
+            row = self.connection.execute("SELECT MIN(lease_until) FROM units WHERE state = 'leased'").fetchone()
+        return row[0]
+
+    def renew(self, unit, lease_seconds=600):
+        """Estende a posse da unidade. Retorna False se ela já expirou e foi tomada por outro worker."""
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "UPDATE units SET lease_until = ? WHERE id = ? AND token = ? AND state = 'leased'",
+                (time.time() + lease_seconds, unit['id'], unit['token'])
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, unit):
+        """Marca a unidade como concluída. Retorna False se a posse já não era deste worker."""
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "UPDATE units SET state = 'done', finished_at = ?, lease_until = NULL, error = NULL WHERE id = ? AND token = ?",
+                (time.time(), unit['id'], unit['token'])
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, unit, error):
+        """Devolve a unidade à fila depois de um erro, ou a marca como 'failed' se acabaram as tentativas."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                """UPDATE units SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                       lease_until = NULL, error = ?
+                   WHERE id = ? AND token = ?""",
+                (self.max_attempts, str(error), unit['id'], unit['token'])
+            )
+
+    def status(self):
+        """Número de unidades em cada estado."""
+        with self.lock:
+            rows = self.connection.execute("SELECT state, COUNT(*) FROM units GROUP BY state").fetchall()
+        return dict(rows)
+
+    def failures(self):
+        """Unidades que esgotaram as tentativas, com o último erro."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT start, end, attempts, error FROM units WHERE state = 'failed' ORDER BY start"
+            ).fetchall()
+        return [{'start': start, 'end': end, 'attempts': attempts, 'error': error} for start, end, attempts, error in rows]
+
+    def reset(self, failed_only=True):
+        """Devolve à fila as unidades com falha (ou, com failed_only=False, também as em andamento)."""
+        states = ('failed',) if failed_only else ('failed', 'leased')
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                f"UPDATE units SET state = 'pending', attempts = 0, lease_until = NULL WHERE state IN ({','.join('?' * len(states))})",
+                states
+            )
+            return cursor.rowcount
+
+    def close(self):
+        """Fecha a conexão com o banco."""
+        with self.lock:
+            self.connection.close()
+
+
+def worker_name():
+    """Identificação do worker nos registros da fila: host e pid."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def run_worker(path=queue_path, shared=False, lease_seconds=600, max_attempts=3, **download_options):
+    """Toma e processa unidades da fila até ela esvaziar. Cada unidade roda o pipeline do index4.py no seu intervalo.
+
+    Uma thread renova a posse a cada lease_seconds / 3 enquanto a unidade é processada. Uma unidade em
+    que algum granulo falhou volta para a fila (ou fica 'failed' depois de max_attempts tentativas).
+
+    Sem unidade pendente, o worker só termina quando nenhuma outra está tomada: enquanto houver posses
+    ativas, ele espera a primeira vencer (no máximo lease_seconds / 3 de cada vez) e tenta de novo, para
+    assumir a unidade de um worker que morreu mesmo que seja o último ainda rodando.
+    """
+    from index4 import download_files  # Importado aqui para os processos filhos não herdarem o s3fs do pai
+
+    work_queue = WorkQueue(path, shared, max_attempts)
+    name = worker_name()
+    processed = 0
+    while True:
+        unit = work_queue.claim(name, lease_seconds)
+        if unit is None:
+            expiry = work_queue.next_expiry()
+            if expiry is None:
+                break
+            time.sleep(min(max(expiry - time.time(), 0) + 0.1, lease_seconds / 3))
+            continue
+        print(f"[{name}] Unidade {unit['start'].isoformat()} a {unit['end'].isoformat()} (tentativa {unit['attempts']}).")
+
+        done = threading.Event()
+        lost = threading.Event()
+
+        def heartbeat():
+            while not done.wait(lease_seconds / 3):
+                if not work_queue.renew(unit, lease_seconds):
+                    lost.set()
+                    return
+
+        renewer = threading.Thread(target=heartbeat, name='lease', daemon=True)
+        renewer.start()
+        try:
+            errors = download_files(unit['start'], unit['end'], **download_options)
+        except Exception as e:
+            done.set()
+            renewer.join()
+            print(f"[{name}] Erro na unidade {unit['start'].isoformat()}: {e}")
+            work_queue.fail(unit, e)
+            continue
+        done.set()
+        renewer.join()
+        if errors:
+            # Os granulos com erro não entram no manifesto: a próxima tentativa só refaz esses
+            print(f"[{name}] {errors} granulos com erro na unidade {unit['start'].isoformat()}.")
+            work_queue.fail(unit, f"{errors} granulos com erro no pipeline")
+            continue
+        if lost.is_set() or not work_queue.complete(unit):
+            # Outro worker assumiu a unidade; o trabalho é idempotente graças ao manifesto
+            print(f"[{name}] A posse da unidade {unit['start'].isoformat()} expirou antes do fim.")
+        else:
+            processed += 1
+    work_queue.close()
+    print(f"[{name}] Fila vazia. {processed} unidades concluídas.")
+    return processed
+
+
+def run_workers(processes, **options):
+    """Roda processes workers locais em paralelo e espera todos terminarem."""
+    workers = [multiprocessing.Process(target=run_worker, kwargs=options, name=f"backfill-{i}") for i in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Backfill do GLM em unidades de trabalho numa fila compartilhada entre processos e hosts.')
+    parser.add_argument('--queue', default=queue_path, help='Arquivo SQLite da fila')
+    parser.add_argument('--shared', action='store_true', help='Fila num sistema de arquivos compartilhado entre hosts (desliga o modo WAL)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    add_parser = subparsers.add_parser('add', help='Acrescenta um intervalo à fila')
+    add_parser.add_argument('-b', '--start', required=True, help='Início no formato YYYY-MM-DD ou YYYY-MM-DDTHH:MM[:SS] (UTC)')
+    add_parser.add_argument('-e', '--end', required=True, help='Término no formato YYYY-MM-DD (dia inteiro, inclusive) ou YYYY-MM-DDTHH:MM[:SS] (exclusivo)')
+    add_parser.add_argument('--unit_hours', type=int, default=1, help='Horas por unidade de trabalho')
+
+    work_parser = subparsers.add_parser('work', help='Processa unidades da fila até ela esvaziar')
+    work_parser.add_argument('-j', '--processes', type=int, default=1, help='Workers neste host')
+    work_parser.add_argument('--lease', type=float, default=600, help='Segundos de posse de uma unidade sem renovação')
+    work_parser.add_argument('--max_attempts', type=int, default=3, help='Tentativas por unidade antes de marcá-la como falha')
+    work_parser.add_argument('-p', '--probe', action='store_true', help='Lê apenas flash_lat/flash_lon remotamente antes de baixar o granulo')
+    work_parser.add_argument('-c', '--crop', action='store_true', help='Grava apenas os flashes, grupos e eventos dentro do bbox')
+    work_parser.add_argument('--fetch_workers', type=int, default=16, help='Threads de download por worker')
+    work_parser.add_argument('--filter_processes', default=0, help="Processos de filtro por worker: um inteiro, 'auto' ou 0 para usar só threads")
+    work_parser.add_argument('--manifest', default=manifest_path, help='Manifesto dos granulos processados (local a cada host)')
+    work_parser.add_argument('--negative_cache', default=negative_cache_path, help='Cache negativo (local a cada host)')
+    work_parser.add_argument('--listing_cache', default=listing_cache_path, help='Índice das listagens do bucket (local a cada host)')
+    work_parser.add_argument('-r', '--region', action='append', help='Região do registro a filtrar (pode repetir); sem ela, usa o bbox do index4.py')
+    work_parser.add_argument('--regions_file', default=regions_path, help='Arquivo JSON com o registro de regiões')
+    work_parser.add_argument('-o', '--output_format', choices=['netcdf', 'parquet'], default='netcdf', help='Saída: um NetCDF por granulo ou armazenamento colunar Parquet')
+    work_parser.add_argument('--store', default=store_directory, help='Diretório do armazenamento colunar (com --output_format parquet)')
+    work_parser.add_argument('--flash_cache', default=cache_directory, help='Diretório do cache de flashes decodificados')
+    work_parser.add_argument('--no_flash_cache', action='store_true', help='Não guarda os flashes decodificados no cache')
+
+    subparsers.add_parser('status', help='Mostra quantas unidades há em cada estado')
+    reset_parser = subparsers.add_parser('reset', help='Devolve à fila as unidades com falha')
+    reset_parser.add_argument('--leased', action='store_true', help='Devolve também as unidades em andamento (só com todos os workers parados)')
+    args = parser.parse_args(argv[1:])
+
+    if args.command == 'add':
+        start = parse_moment(args.start)
+        end = parse_moment(args.end, end=True)
+        assert start < end, "O início deve ser anterior ao término."
+        work_queue = WorkQueue(args.queue, args.shared)
+        added = work_queue.add_range(start, end, args.unit_hours)
+        print(f"{added} unidades novas na fila {args.queue}.")
+        work_queue.close()
+    elif args.command == 'work':
+        options = dict(
+            path=args.queue, shared=args.shared, lease_seconds=args.lease, max_attempts=args.max_attempts,
+            probe=args.probe, crop=args.crop, fetch_workers=args.fetch_workers, filter_processes=args.filter_processes,
+            manifest_file=args.manifest, negative_cache_file=args.negative_cache, listing_cache_file=args.listing_cache,
+            regions=load_regions(args.regions_file, args.region) if args.region else None,
+            output_format=args.output_format, store_path=args.store,
+            flash_cache=None if args.no_flash_cache else args.flash_cache, quiet=True,
+        )
+        if args.processes > 1:
+            run_workers(args.processes, **options)
+        else:
+            run_worker(**options)
+    else:
+        work_queue = WorkQueue(args.queue, args.shared)
+        if args.command == 'reset':
+            print(f"{work_queue.reset(failed_only=not args.leased)} unidades devolvidas à fila.")
+        counts = work_queue.status()
+        print(", ".join(f"{state}: {count}" for state, count in sorted(counts.items())) or "Fila vazia.")
+        for failure in work_queue.failures():
+            print(f"  Falha {failure['start']} a {failure['end']} ({failure['attempts']} tentativas): {failure['error']}")
+        work_queue.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
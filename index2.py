@@ -4,6 +4,7 @@ import os
 import shutil
 from datetime import datetime, timedelta
 from netCDF4 import Dataset
+from glm_filter import probe_coordinates
 
 # Definir limites de coordenadas de interesse
 lon_min, lon_max = -43.7, -43
@@ -19,7 +20,7 @@ def clear_directory(directory):
         print(f"Diretório {directory} limpo.")
     os.makedirs(directory, exist_ok=True)  
 
-def download_files(start_date, end_date):
+def download_files(start_date, end_date, probe=False):
     """Baixa os arquivos GLM para um intervalo de datas especificado e faz o crop por coordenadas."""
     current_date = start_date
     fs = s3fs.S3FileSystem(anon=True)
@@ -52,6 +53,11 @@ def download_files(start_date, end_date):
             file_name = file.split('/')[-1]
             local_file_path = os.path.join(day_output_directory, file_name)
 
+            # No modo sonda, lê só flash_lat/flash_lon por faixa de bytes antes de baixar
+            if probe and not probe_coordinates(fs, file, (lon_min, lon_max, lat_min, lat_max)):
+                print(f"Nenhum evento dentro do filtro encontrado em {file}. Pulando download.")
+                continue
+
             print(f"Baixando: {file} para {local_file_path}")
             fs.get(file, local_file_path)
 
@@ -104,4 +110,6 @@ def filter_by_coordinates(file_path):
 # Exemplo de uso
 start_date = datetime(2023, 11, 18)
 end_date = datetime(2023, 11, 19)
-download_files(start_date, end_date)
+# Lê só flash_lat/flash_lon de cada granulo antes de decidir se baixa o arquivo inteiro
+probe = True
+download_files(start_date, end_date, probe=probe)
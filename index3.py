@@ -1,9 +1,13 @@
 import s3fs
 import numpy as np
 import os
-import shutil
-from datetime import datetime, timedelta
+from datetime import timedelta
 from netCDF4 import Dataset
+from glm_filter import probe_coordinates, download_filtered_in_memory
+from glm_manifest import Manifest, manifest_path, NegativeCache, negative_cache_path, job_identity
+from glm_regions import bbox_region
+from glm_listing import ListingCache, listing_cache_path
+from glm_time import parse_moment
 import sys
 import argparse
 
@@ -19,54 +23,77 @@ def create_directory(directory):
     os.makedirs(directory, exist_ok=True)
     print(f"Diretório {directory} criado (ou já existia).")
 
-
-def clear_directory(directory):
-    """Limpa o diretório de saída e cria novamente."""
-    if os.path.exists(directory):
-        shutil.rmtree(directory)
-        print(f"Diretório {directory} limpo.")
-    create_directory(directory)
-
-def download_files(start_date, end_date):
-    """Baixa os arquivos GLM para um intervalo de datas especificado e faz o crop por coordenadas."""
-    current_date = start_date
+def download_files(start, end, probe=False, in_memory=False, crop=False, manifest_file=manifest_path, reprocess=False,
+                   negative_cache_file=negative_cache_path, listing_cache_file=listing_cache_path):
+    """Baixa os arquivos GLM do intervalo [start, end) e faz o crop por coordenadas."""
+    current_date = start.replace(hour=0, minute=0, second=0, microsecond=0)
     fs = s3fs.S3FileSystem(anon=True)
-
-    while current_date <= end_date:
-        year = current_date.year
+    bbox = (lon_min, lon_max, lat_min, lat_max)
+    manifest = Manifest(manifest_file, job_identity('netcdf', [bbox_region(bbox)], crop, output=output_directory))
+    negative_cache = NegativeCache(negative_cache_file)
+    listing_cache = ListingCache(fs, listing_cache_file)
+    if reprocess:
+        manifest.forget_range(start, end)
+
+    while current_date < end:
         day_of_year = current_date.timetuple().tm_yday 
-        bucket_path = f'noaa-goes16/GLM-L2-LCFA/{year}/{day_of_year:03d}/'
 
         print(f"Buscando arquivos para {current_date.strftime('%Y-%m-%d')} (dia {day_of_year})")
         
         # Diretório de saída específico para o dia atual
         day_output_directory = os.path.join(output_directory, current_date.strftime('%Y-%m-%d'))
-        clear_directory(day_output_directory)
-
-        # Iterar pelas subpastas de cada hora (00 a 23)
-        files = []
-        for hour in range(24):
-            hour_path = bucket_path + f"{hour:02d}/"  
-            try:
-                hourly_files = fs.ls(hour_path)
-                files.extend(hourly_files)  
-            except FileNotFoundError:
-                print(f"Hora {hour:02d} não encontrada no bucket. Pulando...")
+        create_directory(day_output_directory)
+
+        # Listar só as horas do dia dentro do intervalo pelo índice local (horas fechadas não voltam ao bucket)
+        files = listing_cache.query(max(start, current_date), min(end, current_date + timedelta(days=1)))
 
         print(f"Total de arquivos encontrados para {current_date.strftime('%Y-%m-%d')}: {len(files)}")
 
-        for file in files:
+        for entry in files:
+            file = entry['name']
+            size, etag = entry.get('size'), entry.get('ETag')
+            if manifest.is_done(file, size, etag):
+                continue
             file_name = file.split('/')[-1]
             local_file_path = os.path.join(day_output_directory, file_name)
-            print(f"Baixando: {file} para {local_file_path}")
-            fs.get(file, local_file_path)
-            filter_by_coordinates(local_file_path)
+            if negative_cache.is_known_empty(file_name, bbox):
+                print(f"Granulo {file_name} sabidamente sem eventos no filtro. Pulando download.")
+                result = 'empty'
+            elif probe and not probe_coordinates(fs, file, bbox):
+                print(f"Nenhum evento dentro do filtro encontrado em {file}. Pulando download.")
+                result = 'empty'
+            elif in_memory:
+                result = download_filtered_in_memory(fs, file, local_file_path, bbox, crop=crop)
+            else:
+                print(f"Baixando: {file} para {local_file_path}")
+                try:
+                    fs.get(file, local_file_path)
+                except Exception as e:
+                    print(f"Erro ao baixar o arquivo {file}: {e}")
+                    result = 'error'
+                else:
+                    result = filter_by_coordinates(local_file_path)
+            if result == 'error':
+                # Falhas não vão para o manifesto nem para o cache negativo: o granulo é tentado de novo
+                continue
+            passed = result == 'written'
+            manifest.record(file, size, etag, passed=passed, output=local_file_path if passed else None)
+            if not passed:
+                negative_cache.add(file_name, bbox)
 
         print(f"Download e filtro para {current_date.strftime('%Y-%m-%d')} concluídos.")
         current_date += timedelta(days=1)
 
+    manifest.close()
+    negative_cache.close()
+    listing_cache.close()
+
 def filter_by_coordinates(file_path):
-    """Filtra os eventos GLM de um arquivo NetCDF com base nas coordenadas fornecidas."""
+    """Filtra os eventos GLM de um arquivo NetCDF com base nas coordenadas fornecidas.
+
+    Retorna 'written' (o arquivo fica), 'empty' (sem eventos no filtro; o arquivo é removido) ou
+    'error' (o arquivo não pôde ser lido e também é removido).
+    """
     dataset = None
     try:
         dataset = Dataset(file_path, 'r')
@@ -82,32 +109,48 @@ def filter_by_coordinates(file_path):
             (latitudes >= lat_min) & (latitudes <= lat_max)
         )
 
+        dataset.close()
+        dataset = None
         if np.sum(mask) == 0:
             print(f"Nenhum evento dentro do filtro encontrado em {file_path}. Removendo arquivo.")
-            dataset.close()
             os.remove(file_path)
-        else:
-            print(f"Eventos dentro do filtro encontrados no arquivo {file_path}.")
-        
+            return 'empty'
+        print(f"Eventos dentro do filtro encontrados no arquivo {file_path}.")
+        return 'written'
+
     except Exception as e:
         print(f"Erro ao filtrar o arquivo {file_path}: {e}")
+        if dataset is not None:
+            dataset.close()
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        return 'error'
 
 
 def main(argv):
     parser = argparse.ArgumentParser(description='Download e filtro de arquivos GLM por coordenadas.')
-    parser.add_argument('-b', '--start_date', required=True, help='Data de início no formato YYYY-MM-DD')
-    parser.add_argument('-e', '--end_date', required=True, help='Data de término no formato YYYY-MM-DD')
+    parser.add_argument('-b', '--start', '--start_date', dest='start', required=True, help='Início no formato YYYY-MM-DD ou YYYY-MM-DDTHH:MM[:SS] (UTC)')
+    parser.add_argument('-e', '--end', '--end_date', dest='end', required=True, help='Término no formato YYYY-MM-DD (dia inteiro, inclusive) ou YYYY-MM-DDTHH:MM[:SS] (exclusivo)')
+    parser.add_argument('-p', '--probe', action='store_true', help='Lê apenas flash_lat/flash_lon remotamente antes de baixar o granulo')
+    parser.add_argument('-m', '--in_memory', action='store_true', help='Filtra os granulos em memória e grava em disco apenas os que passam')
+    parser.add_argument('-c', '--crop', action='store_true', help='Grava apenas os flashes, grupos e eventos dentro do bbox (implica --in_memory)')
+    parser.add_argument('--manifest', default=manifest_path, help='Arquivo SQLite com o registro dos granulos já processados')
+    parser.add_argument('--reprocess', action='store_true', help='Esquece no manifesto os granulos do intervalo e processa tudo de novo')
+    parser.add_argument('--negative_cache', default=negative_cache_path, help='Arquivo SQLite com os granulos sabidamente sem eventos no bbox')
+    parser.add_argument('--listing_cache', default=listing_cache_path, help='Arquivo SQLite com o índice das listagens do bucket')
     args = parser.parse_args(argv[1:])
 
     # Converter as strings de data para objetos datetime
-    start_date = datetime.strptime(args.start_date, '%Y-%m-%d')
-    end_date = datetime.strptime(args.end_date, '%Y-%m-%d')
+    start = parse_moment(args.start)
+    end = parse_moment(args.end, end=True)
 
-    # Verificar se a data de início é menor ou igual à data de término
-    assert start_date <= end_date, "A data de início deve ser anterior ou igual à data de término."
+    # Verificar se o início é anterior ao término
+    assert start < end, "O início deve ser anterior ao término."
 
     # Iniciar o processo de download e filtro
-    download_files(start_date, end_date)
+    download_files(start, end, probe=args.probe, in_memory=args.in_memory or args.crop, crop=args.crop,
+                   manifest_file=args.manifest, reprocess=args.reprocess,
+                   negative_cache_file=args.negative_cache, listing_cache_file=args.listing_cache)
 
 if __name__ == "__main__":
     main(sys.argv)
@@ -1,13 +1,13 @@
 import s3fs
-import numpy as np
-import os
-import shutil
-from datetime import datetime, timedelta
-from netCDF4 import Dataset
 import sys
 import argparse
-import tenacity
-import concurrent.futures
+from glm_pipeline import run_pipeline
+from glm_listing import ListingCache, listing_cache_path
+from glm_time import parse_moment
+from glm_regions import load_regions, regions_path, bbox_region
+from glm_manifest import Manifest, manifest_path, NegativeCache, negative_cache_path, job_identity
+from glm_columnar import FlashStore, store_directory
+from glm_cache import cache_directory
 
 # Definir limites de coordenadas de interesse
 lon_min, lon_max = -43.7, -43
@@ -16,154 +16,106 @@ lat_min, lat_max = -23.2, -22.7
 # Diretório de saída
 output_directory = "data/goes16/glm_files/"
 
-def create_directory(directory):
-    """Cria o diretório se ele não existir."""
-    os.makedirs(directory, exist_ok=True)
-    print(f"Diretório {directory} criado (ou já existia).")
 
-
-def clear_directory(directory):
-    """Limpa o diretório de saída e cria novamente."""
-    if os.path.exists(directory):
-        shutil.rmtree(directory)
-        print(f"Diretório {directory} limpo.")
-    create_directory(directory)
-
-
-@tenacity.retry(
-    retry=tenacity.retry_if_exception_type(FileNotFoundError),
-    wait=tenacity.wait_exponential(multiplier=1, min=2, max=10),
-    stop=tenacity.stop_after_attempt(5)
-)
-def safe_ls(fs, path):
-    """Função segura para listar arquivos usando tenacity."""
-    return fs.ls(path)
-
-
-@tenacity.retry(
-    retry=tenacity.retry_if_exception_type(OSError),
-    wait=tenacity.wait_exponential(multiplier=1, min=2, max=10),
-    stop=tenacity.stop_after_attempt(5)
-)
-def safe_get(fs, remote_path, local_path):
-    """Função segura para baixar arquivos usando tenacity."""
-    fs.get(remote_path, local_path)
-
-
-@tenacity.retry(
-    retry=tenacity.retry_if_exception_type(Exception),
-    wait=tenacity.wait_exponential(multiplier=1, min=2, max=10),
-    stop=tenacity.stop_after_attempt(5)
-)
-def safe_filter(file_path):
-    """Função que aplica o filtro de coordenadas de forma segura."""
-    filter_by_coordinates(file_path)
-
-
-def download_files_parallel(files):
-    """Faz o download dos arquivos em paralelo usando ThreadPoolExecutor."""
-    fs = s3fs.S3FileSystem(anon=True)
-
-    def process_file(file):
-        """Função para baixar e filtrar arquivos."""
-        filename = f"{output_directory}/{file.split('/')[-1]}"
-
-        # Criar diretório antes de baixar o arquivo
-        create_directory(os.path.dirname(filename))
-
-        try:
-            print(f"Baixando: {file} para {filename}")
-            safe_get(fs, file, filename)  # Download com retry usando tenacity
-            safe_filter(filename)  # Aplicar filtro após download com retry
-        except Exception as e:
-            print(f"Erro ao processar o arquivo {file}: {str(e)}")
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-        executor.map(process_file, files)
-
-
-def download_files(start_date, end_date):
-    """Baixa os arquivos GLM para um intervalo de datas especificado e faz o crop por coordenadas."""
-    current_date = start_date
+def download_files(start, end, probe=False, crop=False, list_workers=2, fetch_workers=16,
+                   filter_workers=4, write_workers=2, queue_size=64, filter_processes='auto',
+                   manifest_file=manifest_path, reprocess=False, negative_cache_file=negative_cache_path,
+                   listing_cache_file=listing_cache_path, regions=None, output_format='netcdf',
+                   store_path=store_directory, flash_cache=cache_directory, quiet=False, metrics_path=None,
+                   metrics_format='jsonl', metrics_interval=10.0):
+    """Baixa os arquivos GLM do intervalo [start, end) e faz o crop por coordenadas.
+
+    Listagem, download, filtro e gravação rodam como estágios independentes ligados por filas
+    limitadas, de modo que o trabalho flui continuamente por todo o intervalo.
+    O manifesto registra cada granulo processado, então uma nova execução só faz o que falta.
+    Com regiões, cada granulo é baixado uma vez e recortado para todas elas.
+    Com output_format='parquet', os flashes vão para o armazenamento colunar em store_path em vez de
+    um NetCDF por granulo. Os flashes decodificados no filtro ficam no cache em flash_cache (None desliga).
+    Com metrics_path, as métricas do pipeline são exportadas nesse arquivo (JSON lines ou Prometheus).
+    Retorna o número de granulos que falharam (ficam fora do manifesto e são refeitos na próxima execução).
+    """
     fs = s3fs.S3FileSystem(anon=True)
+    bbox = (lon_min, lon_max, lat_min, lat_max)
+    output = store_path if output_format == 'parquet' else output_directory
+    manifest = Manifest(manifest_file, job_identity(output_format, regions or [bbox_region(bbox)], crop, output=output))
+    negative_cache = NegativeCache(negative_cache_file)
+    listing_cache = ListingCache(fs, listing_cache_file)
+    flash_store = FlashStore(store_path) if output_format == 'parquet' else None
+    if reprocess:
+        # Esquece os granulos do intervalo para que sejam baixados de novo
+        manifest.forget_range(start, end)
+        if flash_store is not None:
+            # Apaga as partições das mesmas horas para não duplicar os flashes
+            for region in regions or [{'name': None}]:
+                flash_store.drop_range(start, end, region['name'])
+
+    errors = run_pipeline(
+        start, end, bbox, output_directory, fs=fs,
+        probe=probe, crop=crop, list_workers=list_workers, fetch_workers=fetch_workers,
+        filter_workers=filter_workers, write_workers=write_workers, queue_size=queue_size,
+        filter_processes=filter_processes, manifest=manifest, negative_cache=negative_cache,
+        listing_cache=listing_cache, regions=regions, flash_store=flash_store,
+        flash_cache_directory=flash_cache, quiet=quiet, metrics_path=metrics_path,
+        metrics_format=metrics_format, metrics_interval=metrics_interval
+    )
+    manifest.close()
+    negative_cache.close()
+    listing_cache.close()
+
+    if errors:
+        print(f"Download e filtro de {start.isoformat()} a {end.isoformat()} concluídos com {errors} erros.")
+    else:
+        print(f"Download e filtro de {start.isoformat()} a {end.isoformat()} concluídos.")
+    return errors
 
-    while current_date <= end_date:
-        year = current_date.year
-        day_of_year = current_date.timetuple().tm_yday  # Dia do ano
-        bucket_path = f'noaa-goes16/GLM-L2-LCFA/{year}/{day_of_year:03d}/'
-
-        print(f"Buscando arquivos para {current_date.strftime('%Y-%m-%d')} (dia {day_of_year})")
-
-        # Criar diretório de saída específico para o dia atual dentro do novo diretório
-        day_output_directory = os.path.join(output_directory, current_date.strftime('%Y-%m-%d'))
-        clear_directory(day_output_directory)
-
-        # Iterar pelas subpastas de cada hora (00 a 23)
-        files = []
-        for hour in range(24):
-            hour_path = bucket_path + f"{hour:02d}/"
-            try:
-                hourly_files = safe_ls(fs, hour_path)
-                files.extend(hourly_files)
-            except FileNotFoundError:
-                print(f"Hora {hour:02d} não encontrada no bucket. Pulando...")
-
-        print(f"Total de arquivos encontrados para {current_date.strftime('%Y-%m-%d')}: {len(files)}")
-
-        # Fazer o download em paralelo
-        if files:
-            download_files_parallel(files)
-
-        print(f"Download e filtro para {current_date.strftime('%Y-%m-%d')} concluídos.")
-        current_date += timedelta(days=1)
-
-
-def filter_by_coordinates(file_path):
-    """Filtra os eventos GLM de um arquivo NetCDF com base nas coordenadas fornecidas."""
-    dataset = None
-    try:
-        dataset = Dataset(file_path, 'r')
-
-        longitudes = dataset.variables['flash_lon'][:]
-        latitudes = dataset.variables['flash_lat'][:]
-
-        print(f"Longitude mínima: {longitudes.min()}, máxima: {longitudes.max()}")
-        print(f"Latitude mínima: {latitudes.min()}, máxima: {latitudes.max()}")
-
-        mask = (
-            (longitudes >= lon_min) & (longitudes <= lon_max) &
-            (latitudes >= lat_min) & (latitudes <= lat_max)
-        )
-
-        if np.sum(mask) == 0:
-            print(f"Nenhum evento dentro do filtro encontrado em {file_path}. Removendo arquivo.")
-            dataset.close()
-            os.remove(file_path)
-        else:
-            print(f"Eventos dentro do filtro encontrados no arquivo {file_path}.")
-
-    except Exception as e:
-        print(f"Erro ao filtrar o arquivo {file_path}: {e}")
-
-    finally:
-        if dataset:
-            dataset.close()
 
 def main(argv):
     parser = argparse.ArgumentParser(description='Download e filtro de arquivos GLM por coordenadas.')
-    parser.add_argument('-b', '--start_date', required=True, help='Data de início no formato YYYY-MM-DD')
-    parser.add_argument('-e', '--end_date', required=True, help='Data de término no formato YYYY-MM-DD')
+    parser.add_argument('-b', '--start', '--start_date', dest='start', required=True, help='Início no formato YYYY-MM-DD ou YYYY-MM-DDTHH:MM[:SS] (UTC)')
+    parser.add_argument('-e', '--end', '--end_date', dest='end', required=True, help='Término no formato YYYY-MM-DD (dia inteiro, inclusive) ou YYYY-MM-DDTHH:MM[:SS] (exclusivo)')
+    parser.add_argument('-p', '--probe', action='store_true', help='Lê apenas flash_lat/flash_lon remotamente antes de baixar o granulo')
+    parser.add_argument('-c', '--crop', action='store_true', help='Grava apenas os flashes, grupos e eventos dentro do bbox')
+    parser.add_argument('--list_workers', type=int, default=2, help='Threads do estágio de listagem')
+    parser.add_argument('--fetch_workers', type=int, default=16, help='Threads do estágio de download')
+    parser.add_argument('--filter_workers', type=int, default=4, help='Threads do estágio de filtro (ignorado com --filter_processes)')
+    parser.add_argument('--filter_processes', default='auto', help="Processos para decodificar/filtrar os granulos: um inteiro, 'auto' (um por núcleo) ou 0 para usar só threads")
+    parser.add_argument('--write_workers', type=int, default=2, help='Threads do estágio de gravação')
+    parser.add_argument('--queue_size', type=int, default=64, help='Tamanho máximo das filas entre os estágios')
+    parser.add_argument('--manifest', default=manifest_path, help='Arquivo SQLite com o registro dos granulos já processados')
+    parser.add_argument('--reprocess', action='store_true', help='Esquece no manifesto os granulos do intervalo e processa tudo de novo')
+    parser.add_argument('--negative_cache', default=negative_cache_path, help='Arquivo SQLite com os granulos sabidamente sem eventos no bbox')
+    parser.add_argument('--listing_cache', default=listing_cache_path, help='Arquivo SQLite com o índice das listagens do bucket')
+    parser.add_argument('-r', '--region', action='append', help='Região do registro a filtrar (pode repetir); sem ela, usa o bbox do script')
+    parser.add_argument('--regions_file', default=regions_path, help='Arquivo JSON com o registro de regiões')
+    parser.add_argument('-o', '--output_format', choices=['netcdf', 'parquet'], default='netcdf', help='Saída: um NetCDF por granulo ou armazenamento colunar Parquet particionado por data/hora')
+    parser.add_argument('--store', default=store_directory, help='Diretório do armazenamento colunar (com --output_format parquet)')
+    parser.add_argument('--flash_cache', default=cache_directory, help='Diretório do cache de flashes decodificados')
+    parser.add_argument('--no_flash_cache', action='store_true', help='Não guarda os flashes decodificados no cache')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Não imprime uma mensagem por arquivo')
+    parser.add_argument('--metrics', help='Arquivo para exportar as métricas do pipeline (tempos, bytes, novas tentativas, filas)')
+    parser.add_argument('--metrics_format', choices=['jsonl', 'prometheus'], default='jsonl', help='Formato das métricas: JSON lines ou textfile do Prometheus')
+    parser.add_argument('--metrics_interval', type=float, default=10.0, help='Intervalo em segundos entre as exportações das métricas')
     args = parser.parse_args(argv[1:])
 
     # Converter as strings de data para objetos datetime
-    start_date = datetime.strptime(args.start_date, '%Y-%m-%d')
-    end_date = datetime.strptime(args.end_date, '%Y-%m-%d')
+    start = parse_moment(args.start)
+    end = parse_moment(args.end, end=True)
 
-    # Verificar se a data de início é menor ou igual à data de término
-    assert start_date <= end_date, "A data de início deve ser anterior ou igual à data de término."
+    # Verificar se o início é anterior ao término
+    assert start < end, "O início deve ser anterior ao término."
 
     # Iniciar o processo de download e filtro
-    download_files(start_date, end_date)
+    download_files(
+        start, end, probe=args.probe, crop=args.crop,
+        list_workers=args.list_workers, fetch_workers=args.fetch_workers,
+        filter_workers=args.filter_workers, write_workers=args.write_workers, queue_size=args.queue_size,
+        filter_processes=args.filter_processes, manifest_file=args.manifest, reprocess=args.reprocess,
+        negative_cache_file=args.negative_cache, listing_cache_file=args.listing_cache,
+        regions=load_regions(args.regions_file, args.region) if args.region else None,
+        output_format=args.output_format, store_path=args.store,
+        flash_cache=None if args.no_flash_cache else args.flash_cache, quiet=args.quiet,
+        metrics_path=args.metrics, metrics_format=args.metrics_format, metrics_interval=args.metrics_interval
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,46 @@
+import os
+from datetime import datetime
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('scipy')
+netCDF4 = pytest.importorskip('netCDF4')
+pytest.importorskip('h5py')
+
+from glm_stations import extract_features
+
+
+granule = 'OR_GLM-L2-LCFA_G16_s20231118180000_e20231118180020_c20231118180034.nc'
+
+
+def write_granule(path, latitudes, longitudes):
+    """Grava um granulo mínimo com as variáveis de flash lidas pelo índice."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with netCDF4.Dataset(path, 'w') as dataset:
+        dataset.createDimension('number_of_flashes', len(latitudes))
+        dataset.createVariable('flash_lat', 'f4', ('number_of_flashes',))[:] = latitudes
+        dataset.createVariable('flash_lon', 'f4', ('number_of_flashes',))[:] = longitudes
+        offset = dataset.createVariable('flash_time_offset_of_first_event', 'f4', ('number_of_flashes',))
+        offset.units = 'seconds since 2023-11-18 18:00:00'
+        offset[:] = np.full(len(latitudes), 5.0)
+        dataset.createVariable('flash_energy', 'f4', ('number_of_flashes',))[:] = np.full(len(latitudes), 1e-14)
+
+
+def test_regioes_sobrepostas_nao_contam_o_flash_duas_vezes(tmp_path, monkeypatch):
+    # O cache de flashes padrão é relativo ao diretório atual
+    monkeypatch.chdir(tmp_path)
+    root = tmp_path / 'glm_files'
+    # rio_city está dentro de rio_state: o mesmo flash é gravado nos dois subdiretórios
+    write_granule(str(root / 'rio_state' / '2023-11-18' / granule), [-22.9, -22.0], [-43.2, -42.0])
+    write_granule(str(root / 'rio_city' / '2023-11-18' / granule), [-22.9], [-43.2])
+    stations = tmp_path / 'stations.csv'
+    stations.write_text('id,lat,lon\nA,-22.9,-43.2\n', encoding='utf-8')
+
+    options = dict(step_minutes=10, radii_km=(10,), windows_minutes=(10,), root=str(root),
+                   index_path=str(tmp_path / 'index'))
+    start, end = datetime(2023, 11, 18, 18), datetime(2023, 11, 18, 18, 10)
+    city = extract_features(str(stations), start, end, output=str(tmp_path / 'city.csv'), region='rio_city', **options)
+    state = extract_features(str(stations), start, end, output=str(tmp_path / 'state.csv'), region='rio_state', **options)
+
+    assert city.counts()[0, 0, 0, 0] == 1
+    assert state.counts()[0, 0, 0, 0] == 1
@@ -0,0 +1,15 @@
+from datetime import datetime
+from glm_time import parse_moment
+
+
+def test_parse_moment_sem_fuso_e_utc():
+    assert parse_moment('2023-01-13T10:00') == datetime(2023, 1, 13, 10, 0)
+
+
+def test_parse_moment_converte_fuso_explicito_para_utc():
+    assert parse_moment('2023-01-13T10:00-03:00') == datetime(2023, 1, 13, 13, 0)
+    assert parse_moment('2023-01-13T23:30-03:00', end=True) == datetime(2023, 1, 14, 2, 30)
+
+
+def test_parse_moment_dia_inteiro_no_fim():
+    assert parse_moment('2023-01-13', end=True) == datetime(2023, 1, 14)
@@ -0,0 +1,31 @@
+import sys
+import types
+import pytest
+
+for module in ('numpy', 'netCDF4', 'h5py', 'pyarrow', 'tenacity'):
+    pytest.importorskip(module)
+
+from glm_workqueue import WorkQueue, run_worker
+from datetime import datetime
+
+
+def test_worker_assume_a_unidade_do_unico_outro_worker_que_morreu(tmp_path, monkeypatch):
+    calls = []
+
+    def download_files(start, end, **options):
+        calls.append((start, end))
+        return 0
+
+    # O run_worker importa o index4 (e o s3fs) só ao começar; aqui o download é simulado
+    monkeypatch.setitem(sys.modules, 'index4', types.SimpleNamespace(download_files=download_files))
+    path = str(tmp_path / 'fila.sqlite')
+    work_queue = WorkQueue(path)
+    work_queue.add_range(datetime(2023, 11, 18, 18), datetime(2023, 11, 18, 19))
+
+    # O outro worker toma a única unidade e morre sem renovar nem concluir
+    assert work_queue.claim('morto', lease_seconds=1) is not None
+
+    assert run_worker(path, lease_seconds=1) == 1
+    assert calls == [(datetime(2023, 11, 18, 18), datetime(2023, 11, 18, 19))]
+    assert work_queue.status() == {'done': 1}
+    work_queue.close()